@@ -0,0 +1,199 @@
+import os
+import bz2
+import io
+import shutil
+import tarfile
+import tempfile
+import threading
+import unittest
+
+
+from oktest import ok, main, test
+
+
+from wally import artifacts
+
+
+class BundleTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def make_file(self, name, data):
+        path = os.path.join(self.dir, name)
+        with open(path, "wb") as fd:
+            fd.write(data)
+        return path
+
+    @test("test_bundle_digest_deterministic")
+    def test_deterministic(self):
+        path1 = self.make_file("a", "data a")
+        path2 = self.make_file("b", "data b")
+
+        bundle1 = artifacts.Bundle("b1").add_file("a", path1, 0644).add_file("b", path2, 0755)
+        bundle2 = artifacts.Bundle("b2").add_file("b", path2, 0755).add_file("a", path1, 0644)
+
+        # files order and bundle name don't matter
+        ok(bundle1.digest) == bundle2.digest
+        ok(len(bundle1.digest)) == 40
+        ok(bundle1.remote_path) == os.path.join(artifacts.ARTIFACTS_DIR, bundle1.digest)
+
+    @test("test_bundle_digest_content")
+    def test_content(self):
+        path = self.make_file("a", "data")
+        digest = artifacts.Bundle("b").add_file("a", path, 0644).digest
+
+        ok(artifacts.Bundle("b").add_file("a", path, 0755).digest) != digest
+        ok(artifacts.Bundle("b").add_file("x", path, 0644).digest) != digest
+
+        self.make_file("a", "other data")
+        ok(artifacts.Bundle("b").add_file("a", path, 0644).digest) != digest
+
+    @test("test_bundle_digest_decompress")
+    def test_decompress(self):
+        raw_path = self.make_file("fio", "fio binary")
+        bz2_path = self.make_file("fio.bz2", bz2.compress("fio binary"))
+
+        raw = artifacts.Bundle("fio").add_file("fio", raw_path, 0755)
+        unpacked = artifacts.Bundle("fio").add_file("fio", bz2_path, 0755, decompress=True)
+        packed = artifacts.Bundle("fio").add_file("fio", bz2_path, 0755)
+
+        # digest is calculated for content, stored in bundle
+        ok(unpacked.digest) == raw.digest
+        ok(packed.digest) != raw.digest
+
+        arch = tarfile.open(fileobj=io.BytesIO(unpacked.archive), mode="r:gz")
+        ok(arch.extractfile("fio").read()) == "fio binary"
+        ok(arch.getmember("fio").mode) == 0755
+
+    @test("test_bundle_dir")
+    def test_dir(self):
+        self.make_file("a.py", "a")
+        self.make_file("a.pyc", "compiled")
+        os.mkdir(os.path.join(self.dir, "sub"))
+        self.make_file("sub/b.py", "b")
+
+        bundle = artifacts.dir_bundle("sensors", self.dir)
+        ok(sorted(arcname for arcname, _, _, _ in bundle.files)) == ["a.py", "sub/b.py"]
+
+
+class FakeConn(object):
+    "node, which handles artifacts commands"
+    def __init__(self, ip, installed=False, serve_fails=False, fetch_fails=False):
+        self.ip = ip
+        self.installed = installed
+        self.serve_fails = serve_fails
+        self.fetch_fails = fetch_fails
+        self.actions = []
+
+
+class FakeCluster(object):
+    def __init__(self, conns):
+        self.conns = conns
+        self.lock = threading.Lock()
+        self.serving = set()
+
+    def __call__(self, conn, cmd, stdin_data=None, node=None, nolog=False, timeout=None):
+        with self.lock:
+            if "echo INSTALLED" in cmd:
+                return "INSTALLED" if conn.installed else ""
+
+            if "peer_server.py" in cmd:
+                if conn.serve_fails:
+                    raise OSError("can't bind")
+                self.serving.add(conn.ip)
+                conn.actions.append("serve")
+            elif "kill" in cmd:
+                self.serving.discard(conn.ip)
+                conn.actions.append("stop")
+            elif "curl" in cmd:
+                peer_ip = cmd.split("http://")[1].split(":")[0]
+                if conn.fetch_fails or peer_ip not in self.serving:
+                    raise OSError("fetch failed")
+                conn.installed = True
+                conn.actions.append("fetch " + peer_ip)
+            else:
+                ok(stdin_data).is_a(str)
+                conn.installed = True
+                conn.actions.append("upload")
+            return ""
+
+
+class DeployManyTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        path = os.path.join(self.dir, "script.py")
+        with open(path, "w") as fd:
+            fd.write("print 1")
+        self.bundle = artifacts.Bundle("scripts").add_file("script.py", path)
+
+        self.orig_run_over_ssh = artifacts.run_over_ssh
+        self.orig_settings = dict(artifacts.peer_settings)
+        artifacts.set_peer_fan_out(2)
+
+    def tearDown(self):
+        artifacts.run_over_ssh = self.orig_run_over_ssh
+        artifacts.peer_settings.update(self.orig_settings)
+        shutil.rmtree(self.dir)
+
+    def deploy(self, *conns):
+        cluster = FakeCluster(conns)
+        artifacts.run_over_ssh = cluster
+        targets = [(conn, conn.ip, conn.ip) for conn in conns]
+        artifacts.deploy_many(targets, self.bundle, "/tmp/wally", timeout=10)
+        ok(cluster.serving) == set()
+        return [conn.actions for conn in conns]
+
+    def make_conns(self, count, **params):
+        return [FakeConn("10.0.0.{0}".format(idx), **params) for idx in range(count)]
+
+    @test("test_deploy_many_no_peers")
+    def test_no_peers(self):
+        artifacts.set_peer_fan_out(0)
+        ok(self.deploy(*self.make_conns(3))) == [["upload"]] * 3
+
+    @test("test_deploy_many_installed")
+    def test_installed(self):
+        conns = self.make_conns(4)
+        conns[0].installed = conns[3].installed = True
+        ok(self.deploy(*conns)) == [[], ["upload"], ["upload"], []]
+
+    @test("test_deploy_many_peers")
+    def test_peers(self):
+        ok(self.deploy(*self.make_conns(5))) == [["upload", "serve", "stop"],
+                                                 ["upload", "serve", "stop"],
+                                                 ["fetch 10.0.0.0"],
+                                                 ["fetch 10.0.0.1"],
+                                                 ["fetch 10.0.0.0"]]
+
+    @test("test_deploy_many_seed_fails")
+    def test_seed_fails(self):
+        conns = self.make_conns(5)
+        conns[0].serve_fails = True
+
+        # working seed serves all the rest nodes
+        ok(self.deploy(*conns)) == [["upload", "stop"],
+                                    ["upload", "serve", "stop"],
+                                    ["fetch 10.0.0.1"],
+                                    ["fetch 10.0.0.1"],
+                                    ["fetch 10.0.0.1"]]
+
+    @test("test_deploy_many_all_seeds_fail")
+    def test_all_seeds_fail(self):
+        conns = self.make_conns(4, serve_fails=True)
+        ok(self.deploy(*conns)) == [["upload", "stop"],
+                                    ["upload", "stop"],
+                                    ["upload"],
+                                    ["upload"]]
+
+    @test("test_deploy_many_fetch_fails")
+    def test_fetch_fails(self):
+        conns = self.make_conns(4)
+        conns[3].fetch_fails = True
+        ok(self.deploy(*conns)[2:]) == [["fetch 10.0.0.0"], ["upload"]]
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+import os
+import sys
+import json
+import array
+import shutil
+import tempfile
+import unittest
+import StringIO
+
+
+from oktest import ok, main, test
+
+
+from wally.suits.io import diskstats
+
+
+def make_header(devices, **params):
+    header = {'magic': diskstats.MAGIC,
+              'version': diskstats.VERSION,
+              'interval': 1.0,
+              'devices': devices,
+              'fields': diskstats.FIELD_NAMES,
+              'byteorder': sys.byteorder,
+              'start_time': 1000.0,
+              'start_mono': 10.0}
+    header.update(params)
+    return header
+
+
+def make_record(tm, devices_vals):
+    "devices_vals:[{field: value}] - values for each device"
+    rec = [tm]
+    for vals in devices_vals:
+        rec.extend(float(vals.get(name, 0)) for name in diskstats.FIELD_NAMES)
+    return rec
+
+
+class DiskstatsLogTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.fname = os.path.join(self.dir, "diskstats.bin")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write_log(self, header, records, tail="", swap=False):
+        data = array.array('d', sum(records, []))
+        if swap:
+            data.byteswap()
+        with open(self.fname, "wb") as fd:
+            fd.write(json.dumps(header) + "\n")
+            fd.write(data.tostring() + tail)
+
+    def make_log(self, **params):
+        # vda holds test file, dm-0 is its slave
+        records = [make_record(10.0 + idx, [{'read_ios': 100 * idx, 'write_ios': 10 * idx},
+                                            {'read_ios': idx}])
+                   for idx in range(5)]
+        self.write_log(make_header(['vda', 'dm-0']), records, **params)
+
+    @test("test_diskstats_load")
+    def test_load(self):
+        self.make_log()
+        header, data = diskstats.load_log(self.fname)
+        ok(header['devices']) == ['vda', 'dm-0']
+        ok(len(data)) == 5 * (1 + 2 * len(diskstats.FIELDS))
+
+    @test("test_diskstats_load_partial_record")
+    def test_load_partial_record(self):
+        # sampler may be killed while writing record
+        self.make_log(tail="\0" * 12)
+        _, data = diskstats.load_log(self.fname)
+        ok(len(data)) == 5 * (1 + 2 * len(diskstats.FIELDS))
+
+    @test("test_diskstats_load_byteorder")
+    def test_load_byteorder(self):
+        other = 'big' if sys.byteorder == 'little' else 'little'
+        records = [make_record(10.0, [{'read_ios': 1}]), make_record(11.0, [{'read_ios': 3}])]
+        self.write_log(make_header(['vda'], byteorder=other), records, swap=True)
+
+        header, data = diskstats.load_log(self.fname)
+        ok(diskstats.get_series(header, data, ['read_ios'])) == ([0.0, 1.0], [1.0, 3.0])
+
+    @test("test_diskstats_load_wrong_file")
+    def test_load_wrong_file(self):
+        self.write_log(make_header(['vda'], magic="other"), [])
+        with self.assertRaises(ValueError):
+            diskstats.load_log(self.fname)
+
+    @test("test_diskstats_series")
+    def test_series(self):
+        self.make_log()
+        header, data = diskstats.load_log(self.fname)
+
+        times, vals = diskstats.get_series(header, data, ['read_ios', 'write_ios'])
+        ok(times) == [0.0, 1.0, 2.0, 3.0, 4.0]
+        ok(vals) == [0.0, 110.0, 220.0, 330.0, 440.0]
+
+        _, vals = diskstats.get_series(header, data, ['read_ios'], 'dm-0')
+        ok(vals) == [0.0, 1.0, 2.0, 3.0, 4.0]
+
+    @test("test_diskstats_rate_series")
+    def test_rate_series(self):
+        records = [make_record(10.0, [{'write_ios': 0}]),
+                   make_record(10.5, [{'write_ios': 100}]),
+                   make_record(10.5, [{'write_ios': 100}]),
+                   make_record(12.5, [{'write_ios': 200}])]
+        self.write_log(make_header(['vda']), records)
+        header, data = diskstats.load_log(self.fname)
+
+        # samples with the same time are skipped
+        ok(diskstats.get_rate_series(header, data, ['write_ios'])) == [(0.5, 200.0), (2.5, 50.0)]
+
+    @test("test_diskstats_test_devices")
+    def test_test_devices(self):
+        header = make_header(['vdb', 'vdc', 'dm-1'],
+                             test_files=['/dev/vdb', '/mnt/test/file'],
+                             test_devices=['vdb', 'dm-1'])
+        ok(diskstats.get_test_devices(header)) == [('/dev/vdb', 'vdb'), ('/mnt/test/file', 'dm-1')]
+
+        # log of previous version
+        ok(diskstats.get_test_devices(make_header(['vdb', 'dm-1']))) == [(None, 'vdb')]
+
+    @test("test_diskstats_split")
+    def test_split(self):
+        self.make_log()
+        part1 = os.path.join(self.dir, "part1.bin")
+        part2 = os.path.join(self.dir, "part2.bin")
+        diskstats.split_log(self.fname, [(part1, 0.0, 2.0), (part2, 2.5, 4.0)])
+
+        header, data = diskstats.load_log(part1)
+        times, vals = diskstats.get_series(header, data, ['read_ios'])
+        ok(times) == [0.0, 1.0, 2.0]
+        ok(header['start_time']) == 1000.0
+
+        # previous sample is kept, so rate is known from range begin
+        header, data = diskstats.load_log(part2)
+        times, vals = diskstats.get_series(header, data, ['read_ios'])
+        ok(times) == [0.0, 1.0, 2.0]
+        ok(vals) == [200.0, 300.0, 400.0]
+        ok(header['start_time']) == 1002.0
+
+    @test("test_diskstats_split_empty")
+    def test_split_empty(self):
+        # sampler was killed before first record flush
+        self.write_log(make_header(['vda']), [], tail="\0" * 12)
+        part = os.path.join(self.dir, "part.bin")
+        diskstats.split_log(self.fname, [(part, 0.0, 2.0)])
+
+        header, data = diskstats.load_log(part)
+        ok(len(data)) == 0
+        ok(header['start_time']) == 1000.0
+        ok(diskstats.get_series(header, data, ['read_ios'])) == ([], [])
+
+
+class SamplerTest(unittest.TestCase):
+    @test("test_diskstats_sample")
+    def test_sample(self):
+        stats = StringIO.StringIO(
+            " 253  0 vda 1 2 3 4 5 6 7 8 9 10 11\n"
+            " 253 16 vdb 11 12 13 14 15 16 17 18 19 20 21\n")
+        sampler = diskstats.Sampler(['vdb', 'vdc'], None, 1.0)
+        rec = sampler.sample(stats)
+
+        ok(len(rec)) == 1 + 2 * len(diskstats.FIELDS)
+        ok(list(rec[1:1 + len(diskstats.FIELDS)])) == [11.0, 13.0, 14.0, 15.0, 17.0,
+                                                       18.0, 19.0, 20.0, 21.0]
+        # missing device gets zeroes
+        ok(list(rec[1 + len(diskstats.FIELDS):])) == [0.0] * len(diskstats.FIELDS)
+
+    @test("test_diskstats_header")
+    def test_header(self):
+        sampler = diskstats.Sampler(['vdb'], None, 1.0, ['/dev/vdb'], ['vdb'])
+        header = sampler.get_header()
+        ok(header['test_files']) == ['/dev/vdb']
+        ok(diskstats.get_test_devices(header)) == [('/dev/vdb', 'vdb')]
+
+        header = diskstats.Sampler(['vdb'], None, 1.0).get_header()
+        ok('test_files' in header) == False
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,785 @@
+import os
+import sys
+import bz2
+import time
+import json
+import shutil
+import tempfile
+import unittest
+import threading
+import subprocess
+import collections
+
+
+from oktest import ok, main, test
+from concurrent.futures import ThreadPoolExecutor
+
+
+from wally import utils
+from wally.suits.io import fio
+from wally.suits.io.fio_task_parser import FioJobSection, FioJobBatch
+
+
+class FakeNode(object):
+    def __init__(self, conn_id):
+        self.conn_id = conn_id
+
+    def get_conn_id(self):
+        return self.conn_id
+
+    def get_ip(self):
+        return self.conn_id.split(":")[0]
+
+
+class FakeConfig(object):
+    def __init__(self, log_directory):
+        self.log_directory = log_directory
+
+
+def make_section(name, runtime, ramp_time=0):
+    sec = FioJobSection(name)
+    sec.vals['rw'] = 'randread'
+    sec.vals['blocksize'] = '4k'
+    sec.vals['runtime'] = runtime
+    sec.vals['ramp_time'] = ramp_time
+    return sec
+
+
+def make_job(groupid, elapsed=None):
+    job = {'groupid': groupid, 'jobname': 'job{0}'.format(groupid)}
+    if elapsed is not None:
+        job['elapsed'] = elapsed
+    return job
+
+
+class TestRunStateTest(unittest.TestCase):
+    def wait_all(self, run_state, count):
+        "returns barrier.wait results or exceptions for count threads"
+        def func(_):
+            try:
+                return run_state.barrier.wait()
+            except fio.TaksFinished as exc:
+                return exc
+
+        with ThreadPoolExecutor(count) as pool:
+            return list(pool.map(func, range(count)))
+
+    @test("test_run_state_barrier")
+    def test_barrier(self):
+        run_state = fio.TestRunState(3)
+        res = self.wait_all(run_state, 3)
+        # only one thread is the last
+        ok(sorted(res)) == [False, False, True]
+        ok(run_state.is_aborted()) == False
+
+    @test("test_run_state_node_failed")
+    def test_node_failed(self):
+        run_state = fio.TestRunState(3)
+        timer = threading.Timer(0.2, run_state.node_failed, ["node1", OSError("lost")])
+        timer.start()
+
+        # nodes, waiting for failed one, are released
+        res = self.wait_all(run_state, 2)
+        ok(res[0]).is_a(fio.TaksFinished)
+        ok(res[1]).is_a(fio.TaksFinished)
+
+        run_state.node_failed("node2", OSError("lost too"))
+        ok(run_state.is_aborted()) == True
+        ok(run_state.should_stop()) == True
+        ok(sorted(run_state.failed)) == ["node1", "node2"]
+        # first failure is the reason
+        ok(run_state.abort_reason) == "node node1 failed: lost"
+
+        # late nodes don't start test
+        with self.assertRaises(fio.TaksFinished):
+            run_state.barrier.wait()
+
+    @test("test_run_state_straggler_deadline")
+    def test_straggler_deadline(self):
+        run_state = fio.TestRunState(2, straggler_timeout=0.2)
+        ok(run_state.is_straggler_deadline()) == False
+
+        run_state.node_finished()
+        first_finish_time = run_state.first_finish_time
+        ok(run_state.is_straggler_deadline()) == False
+
+        time.sleep(0.3)
+        run_state.node_finished()
+        ok(run_state.first_finish_time) == first_finish_time
+        ok(run_state.is_straggler_deadline()) == True
+        ok(run_state.should_stop()) == True
+        ok(run_state.is_aborted()) == False
+
+    @test("test_run_state_no_straggler_timeout")
+    def test_no_straggler_timeout(self):
+        run_state = fio.TestRunState(2)
+        run_state.node_finished()
+        run_state.first_finish_time -= 3600
+        ok(run_state.should_stop()) == False
+
+    @test("test_run_state_start_time")
+    def test_start_time(self):
+        run_state = fio.TestRunState(3)
+        now = time.time()
+        start_time = run_state.get_start_time(5)
+        ok(now + 5 <= start_time <= time.time() + 5) == True
+
+        # other nodes get the same start time, their lead is ignored
+        time.sleep(0.01)
+        ok(run_state.get_start_time(10)) == start_time
+
+    @test("test_run_state_stop")
+    def test_stop(self):
+        run_state = fio.TestRunState(2)
+        run_state.stop("low iops")
+        run_state.node_failed("node1", OSError("killed"))
+
+        ok(run_state.stopped) == True
+        ok(run_state.abort_reason) == "low iops"
+        with self.assertRaises(fio.TaksFinished):
+            run_state.barrier.wait()
+
+
+class FakeSeries(object):
+    def __init__(self, skipped=0):
+        self.skipped = skipped
+
+    def skip(self, seconds):
+        return FakeSeries(self.skipped + seconds)
+
+
+class AlignTest(unittest.TestCase):
+    @test("test_align_to_common_start")
+    def test_align(self):
+        res = {'bw': {'node1': [FakeSeries()], 'node2': [FakeSeries(), FakeSeries()]},
+               'lat': {'node1': [FakeSeries()], 'node3': [FakeSeries()]}}
+        fio.align_to_common_start(res, {'node1': 100.0, 'node2': 102.5})
+
+        # the latest node isn't changed, nodes without start time too
+        ok([ts.skipped for ts in res['bw']['node1']]) == [2.5]
+        ok([ts.skipped for ts in res['bw']['node2']]) == [0, 0]
+        ok([ts.skipped for ts in res['lat']['node1']]) == [2.5]
+        ok([ts.skipped for ts in res['lat']['node3']]) == [0]
+
+
+# fake fio, which handles SIGTERM as real fio does
+FAKE_FIO = """#!/bin/sh
+trap 'exit 1' TERM
+sleep 30 &
+wait
+"""
+
+
+class LocalRunTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        remote_dir = os.path.join(self.dir, "remote")
+        os.mkdir(remote_dir)
+
+        self.test = fio.IOPerfTest.__new__(fio.IOPerfTest)
+        self.test.config = FakeConfig(self.dir)
+        self.test.config.remote_dir = remote_dir
+        self.test.task_file = self.test.join_remote("task.cfg")
+        self.test.results_file = self.test.join_remote("results.json")
+        self.test.err_out_file = self.test.join_remote("fio_err_out")
+        self.test.use_system_fio = False
+        self.test.use_sudo = False
+        self.test.status_interval = None
+        self.test.diskstats_interval = 1000
+        self.test.sync_start = False
+        self.test.get_job_text = lambda node, fio_cfg: str(fio_cfg)
+        self.test.get_node_test_files = lambda node: []
+
+        with open(self.test.join_remote("fio"), "w") as fd:
+            fd.write(FAKE_FIO)
+        os.chmod(self.test.join_remote("fio"), 0755)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def run_local(self, run_state):
+        begin = time.time()
+        try:
+            self.test.do_run_local(FakeNode("local"), run_state, make_section("s1", 10), 0)
+        finally:
+            # fio exits on SIGTERM, so there is no wait for kill
+            ok(time.time() - begin) < 3
+
+    @test("test_local_run_aborted")
+    def test_aborted(self):
+        run_state = fio.TestRunState(1)
+        timer = threading.Timer(0.3, run_state.stop, ["abort rule"])
+        timer.start()
+        try:
+            with self.assertRaises(fio.TaksFinished):
+                self.run_local(run_state)
+        finally:
+            timer.cancel()
+
+    @test("test_local_run_straggler")
+    def test_straggler(self):
+        run_state = fio.TestRunState(1, straggler_timeout=0)
+        run_state.node_finished()
+        time.sleep(0.01)
+        with self.assertRaises(fio.StragglerKilled):
+            self.run_local(run_state)
+
+    @test("test_local_stop_fio")
+    def test_stop(self):
+        # process, which ignores SIGTERM, is killed after term_timeout
+        proc = subprocess.Popen(["sh", "-c", "trap '' TERM; sleep 30 & wait; sleep 30"])
+        time.sleep(0.2)
+        begin = time.time()
+        fio.stop_local_fio(proc, term_timeout=0.5)
+        ok(proc.returncode) == -9
+        ok(time.time() - begin) < 3
+
+
+class PipelineTest(unittest.TestCase):
+    def make_test(self, pipeline, collect_during_tests=True, tests_count=3):
+        nodes = [FakeNode("node0"), FakeNode("node1")]
+        test_obj = fio.IOPerfTest.__new__(fio.IOPerfTest)
+        test_obj.config = FakeConfig(None)
+        test_obj.config.nodes = nodes
+        test_obj.config.params = {'cfg': 'io'}
+        test_obj.config_fname = "io.cfg"
+        test_obj.fio_configs = [make_section("s{0}".format(pos), 10)
+                                for pos in range(tests_count)]
+        test_obj.active_nodes = nodes
+        test_obj.pipeline = pipeline
+        test_obj.collect_during_tests = collect_during_tests
+        test_obj.max_latency = None
+        test_obj.min_bw_per_thread = None
+        test_obj.batch = 1
+        test_obj.fio_server = False
+        test_obj.settle_caches = False
+
+        self.lock = threading.Lock()
+        self.events = []
+        self.prepared = collections.defaultdict(threading.Event)
+        self.collected = collections.defaultdict(threading.Event)
+
+        def prepare_run(node, fio_cfg, pos):
+            self.log("prepare", pos)
+            self.prepared[pos].set()
+
+        def run_isolated(pool, fio_cfg, pos):
+            self.log("run", pos)
+            if pipeline:
+                # next test is prepared and previous one is collected
+                # while this test is running
+                if pos + 1 < tests_count:
+                    ok(self.prepared[pos + 1].wait(5)) == True
+                if pos > 0 and collect_during_tests:
+                    ok(self.collected[pos - 1].wait(5)) == True
+            self.log("run_end", pos)
+            return nodes, [(1.0, 2.0)] * len(nodes)
+
+        def collect_run(node, fio_cfg, pos):
+            self.log("collect", pos)
+            self.collected[pos].set()
+
+        def load_results(pos, fio_cfg, test_descr, lat_bw_limit_reached):
+            self.log("load", pos)
+            return pos
+
+        test_obj.pre_run = lambda: None
+        test_obj.prepare_run = prepare_run
+        test_obj.run_isolated = run_isolated
+        test_obj.collect_run = collect_run
+        test_obj.save_test_params = lambda pos, fio_cfg, nodes, intervals: None
+        test_obj.load_results = load_results
+        return test_obj
+
+    def log(self, event, pos):
+        with self.lock:
+            self.events.append((event, pos))
+
+    def first(self, event, pos):
+        return self.events.index((event, pos))
+
+    def last(self, event, pos):
+        return len(self.events) - 1 - self.events[::-1].index((event, pos))
+
+    @test("test_pipeline_off")
+    def test_off(self):
+        ok(list(self.make_test(False).run())) == [0, 1, 2]
+        # prepare and collect are the part of run in this mode
+        ok(self.events) == [("run", 0), ("run_end", 0), ("load", 0),
+                            ("run", 1), ("run_end", 1), ("load", 1),
+                            ("run", 2), ("run_end", 2), ("load", 2)]
+
+    @test("test_pipeline")
+    def test_pipeline(self):
+        ok(list(self.make_test(True).run())) == [0, 1, 2]
+
+        ok(self.events.count(("prepare", 1))) == 2
+        ok(self.events.count(("collect", 1))) == 2
+        for pos in range(3):
+            ok(self.last("prepare", pos)) < self.first("run", pos)
+            ok(self.first("collect", pos)) > self.last("run_end", pos)
+            ok(self.first("load", pos)) > self.last("collect", pos)
+
+        ok([pos for event, pos in self.events if event == "load"]) == [0, 1, 2]
+
+    @test("test_pipeline_collect_after_tests")
+    def test_collect_after_tests(self):
+        ok(list(self.make_test(True, collect_during_tests=False).run())) == [0, 1, 2]
+
+        # results are downloaded only after the last test
+        last_run = self.last("run_end", 2)
+        for pos in range(3):
+            ok(self.first("collect", pos)) > last_run
+            ok(self.last("prepare", pos)) < self.first("run", pos)
+        ok([pos for event, pos in self.events if event == "load"]) == [0, 1, 2]
+
+
+class SplitBatchTest(unittest.TestCase):
+    def setUp(self):
+        self.log_dir = tempfile.mkdtemp()
+        self.test = fio.IOPerfTest.__new__(fio.IOPerfTest)
+        self.test.config = FakeConfig(self.log_dir)
+        self.test.node_devices = {}
+        self.node = FakeNode("192.168.0.1:22")
+        self.batch = FioJobBatch([make_section("s1", 10), make_section("s2", 20, 5)], [3, 4])
+
+    def tearDown(self):
+        shutil.rmtree(self.log_dir)
+
+    def write_rawres(self, jobs, node=None):
+        conn_id = (node or self.node).get_conn_id().replace(":", "_")
+        path = self.test.get_batch_file(3, conn_id, "rawres.json")
+        with open(path, "w") as fd:
+            # fio messages before json are allowed
+            fd.write("fio: some warning\n" + json.dumps({'fio version': '3.1', 'jobs': jobs}))
+        return path
+
+    def load_rawres(self, pos, node=None):
+        conn_id = (node or self.node).get_conn_id().replace(":", "_")
+        fname = os.path.join(self.log_dir, "{0}_{1}_rawres.json".format(pos, conn_id))
+        return json.load(open(fname))
+
+    @test("test_split_batch_by_elapsed")
+    def test_split_by_elapsed(self):
+        rawres = self.write_rawres([make_job(0, 12), make_job(0, 11), make_job(1, 26)])
+        res = self.test.split_batch_results(self.batch, [self.node], [(100.0, 140.0)])
+
+        ok(res) == [[(100.0, 112.0)], [(112.0, 140.0)]]
+        ok([job['jobname'] for job in self.load_rawres(3)['jobs']]) == ['job0', 'job0']
+        ok([job['jobname'] for job in self.load_rawres(4)['jobs']]) == ['job1']
+        ok(self.load_rawres(4)['fio version']) == '3.1'
+        ok(os.path.exists(rawres)) == False
+
+    @test("test_split_batch_by_config")
+    def test_split_by_config(self):
+        # old fio versions don't report elapsed
+        self.write_rawres([make_job(0), make_job(1)])
+        res = self.test.split_batch_results(self.batch, [self.node], [(100.0, 150.0)])
+        ok(res) == [[(100.0, 110.0)], [(110.0, 150.0)]]
+
+    @test("test_split_batch_interval_limit")
+    def test_interval_limit(self):
+        self.write_rawres([make_job(0, 50), make_job(1, 26)])
+        res = self.test.split_batch_results(self.batch, [self.node], [(100.0, 130.0)])
+        ok(res) == [[(100.0, 130.0)], [(130.0, 130.0)]]
+
+    @test("test_split_batch_nodes")
+    def test_nodes(self):
+        node2 = FakeNode("192.168.0.2:22")
+        self.write_rawres([make_job(0, 10), make_job(1, 20)])
+        self.write_rawres([make_job(0, 15), make_job(1, 20)], node2)
+
+        res = self.test.split_batch_results(self.batch, [self.node, node2],
+                                            [(100.0, 130.0), (101.0, 140.0)])
+        ok(res) == [[(100.0, 110.0), (101.0, 116.0)],
+                    [(110.0, 130.0), (116.0, 140.0)]]
+
+    @test("test_split_batch_devices")
+    def test_devices(self):
+        # multi-device run reports group per section and device
+        self.test.node_devices[self.node.get_conn_id()] = ['/dev/vdb', '/dev/vdc']
+        self.write_rawres([make_job(0, 10), make_job(1, 11), make_job(2, 20), make_job(3, 20)])
+
+        res = self.test.split_batch_results(self.batch, [self.node], [(100.0, 140.0)])
+        ok(res) == [[(100.0, 111.0)], [(111.0, 140.0)]]
+        ok([job['groupid'] for job in self.load_rawres(3)['jobs']]) == [0, 1]
+        ok([job['groupid'] for job in self.load_rawres(4)['jobs']]) == [2, 3]
+
+    @test("test_split_batch_wrong_groups")
+    def test_wrong_groups(self):
+        self.write_rawres([make_job(0, 10)])
+        with self.assertRaises(fio.StopTestError):
+            self.test.split_batch_results(self.batch, [self.node], [(100.0, 140.0)])
+
+
+FAKE_FIO_CLIENT = """#!{python}
+import sys, json, shutil
+args = sys.argv[1:]
+out_file = args[1][len("--output="):]
+jobs = {{}}
+stats = []
+for opt, job_file in zip(args[2::2], args[3::2]):
+    host = opt[len("--client="):].split(",")[0]
+    jobs[host] = open(job_file).read()
+    stats.append({{"jobname": "s1", "hostname": host}})
+    open(host + ".s1_lat.1.log", "w").write(host)
+stats.append({{"jobname": "All clients"}})
+json.dump({{"args": args, "jobs": jobs}}, open({record!r}, "w"))
+open(out_file, "w").write("fio: client connected\\n" +
+                          json.dumps({{"fio version": "fio-2.2", "client_stats": stats}}))
+"""
+
+
+class RunClientTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.log_dir = os.path.join(self.dir, "logs")
+        os.mkdir(self.log_dir)
+        self.record = os.path.join(self.dir, "record.json")
+
+        fio_client = os.path.join(self.dir, "fio")
+        with open(fio_client, "w") as fd:
+            fd.write(FAKE_FIO_CLIENT.format(python=sys.executable, record=self.record))
+        os.chmod(fio_client, 0755)
+
+        self.nodes = [FakeNode("10.0.0.1:22"), FakeNode("10.0.0.2:22")]
+        self.test = fio.IOPerfTest.__new__(fio.IOPerfTest)
+        self.test.config = FakeConfig(self.log_dir)
+        self.test.active_nodes = self.nodes
+        self.test.fio_client = fio_client
+        self.test.fio_server_port = 8765
+        self.test.results_file = "/tmp/wally/results.json"
+        self.test.io_log_file = "/tmp/wally/diskstats.bin"
+        self.test.node_devices = {}
+        self.test.node_pinning = {"10.0.0.2:22": {'cpus_allowed': '0-3'}}
+
+        self.fio_cfg = make_section("s1", 10)
+        self.fio_cfg.vals['write_lat_log'] = 's1'
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    @test("test_run_client")
+    def test_run_client(self):
+        nodes, intervals = self.test.run_client(self.fio_cfg, 3)
+        ok(nodes) == self.nodes
+        ok(len(intervals)) == 2
+
+        record = json.load(open(self.record))
+        run_dir = os.path.join(self.log_dir, "fio_client_3")
+        ok(record['args'][2:]) == [
+            "--client=10.0.0.1,8765", os.path.join(run_dir, "task_10.0.0.1.fio"),
+            "--client=10.0.0.2,8765", os.path.join(run_dir, "task_10.0.0.2.fio")]
+
+        # each node gets own job file with node specific options
+        ok(record['jobs']["10.0.0.1"]) == str(self.fio_cfg)
+        ok("cpus_allowed=0-3" in record['jobs']["10.0.0.2"]) == True
+        ok("cpus_allowed" in str(self.fio_cfg)) == False
+
+        # client output and logs are splitted by nodes
+        for host in ("10.0.0.1", "10.0.0.2"):
+            conn_id = host + "_22"
+            res = json.load(open(os.path.join(self.log_dir, "3_{0}_rawres.json".format(conn_id))))
+            ok(res['jobs']) == [{"jobname": "s1", "hostname": host}]
+            ok(res['fio version']) == "fio-2.2"
+            log_file = os.path.join(self.log_dir, "3_{0}_lat.1.log".format(conn_id))
+            ok(open(log_file).read()) == host
+
+        ok(os.path.exists(run_dir)) == False
+
+    @test("test_run_client_failed")
+    def test_failed(self):
+        self.test.fio_client = "false"
+        with self.assertRaises(fio.StopTestError):
+            self.test.run_client(self.fio_cfg, 0)
+
+
+class ParseFioJsonTest(unittest.TestCase):
+    @test("test_parse_fio_json_plain")
+    def test_plain(self):
+        ok(fio.parse_fio_json('{"jobs": [1]}')) == {'jobs': [1]}
+
+    @test("test_parse_fio_json_messages")
+    def test_messages(self):
+        data = "fio: file hash not empty on exit\n" + '{"jobs": [1]}\n'
+        ok(fio.parse_fio_json(data)) == {'jobs': [1]}
+
+    @test("test_parse_fio_json_status_reports")
+    def test_status_reports(self):
+        # --status-interval output - the last report is the final one
+        data = "\n".join(json.dumps({'jobs': [idx]}, indent=4) for idx in range(3))
+        ok(fio.parse_fio_json(data)) == {'jobs': [2]}
+
+
+def make_status(total_ios, runtime_ms, errors=0, lat_ns=1E6):
+    job = {'mixed': {'total_ios': total_ios,
+                     'io_bytes': total_ios * 4096,
+                     'runtime': runtime_ms,
+                     'clat_ns': {'mean': lat_ns}},
+           'total_err': errors}
+    return json.dumps({'jobs': [job]}, indent=4)
+
+
+class FioProgressTest(unittest.TestCase):
+    def make_progress(self, rules, throughput_rules=True):
+        self.run_state = fio.TestRunState(2)
+        return fio.FioProgress("test", self.run_state, 1, rules, 0, throughput_rules)
+
+    def set_stats(self, progress, conn_id, iops, peak, first_report=0):
+        progress.first_report[conn_id] = first_report
+        progress.stats[conn_id] = (float(iops), iops * 4096.0, 1.0)
+        progress.peak[conn_id] = float(peak)
+
+    @test("test_progress_max_errors")
+    def test_max_errors(self):
+        progress = self.make_progress({'max_errors': 2})
+        self.set_stats(progress, "n1", 100, 100)
+        ok(progress.check_rules("n1", 10, 2)) == None
+        ok(progress.check_rules("n1", 10, 3)) != None
+
+    @test("test_progress_grace")
+    def test_grace(self):
+        progress = self.make_progress({'min_iops': 1000, 'grace': 10})
+        self.set_stats(progress, "n1", 100, 100, first_report=100)
+        ok(progress.check_rules("n1", 105, 0)) == None
+        ok(progress.check_rules("n1", 111, 0)) != None
+
+    @test("test_progress_min_iops")
+    def test_min_iops(self):
+        progress = self.make_progress({'min_iops': 1000, 'grace': 0})
+        self.set_stats(progress, "n1", 1500, 1500)
+        ok(progress.check_rules("n1", 10, 0)) == None
+        self.set_stats(progress, "n1", 500, 1500)
+        ok(progress.check_rules("n1", 10, 0)) != None
+
+    @test("test_progress_collapse")
+    def test_collapse(self):
+        progress = self.make_progress({'collapse': 0.5, 'grace': 0})
+        self.set_stats(progress, "n1", 600, 1000)
+        ok(progress.check_rules("n1", 10, 0)) == None
+        self.set_stats(progress, "n1", 400, 1000)
+        ok(progress.check_rules("n1", 10, 0)) != None
+
+    @test("test_progress_divergence")
+    def test_divergence(self):
+        progress = self.make_progress({'divergence': 2, 'grace': 0})
+        self.set_stats(progress, "n1", 1000, 1000)
+        ok(progress.check_rules("n1", 10, 0)) == None
+
+        self.set_stats(progress, "n2", 600, 600)
+        ok(progress.check_rules("n1", 10, 0)) == None
+
+        self.set_stats(progress, "n2", 400, 600)
+        ok(progress.check_rules("n2", 10, 0)) != None
+
+    @test("test_progress_no_throughput_rules")
+    def test_no_throughput_rules(self):
+        # batch mode - only errors are checked
+        progress = self.make_progress({'min_iops': 1000, 'max_errors': 0, 'grace': 0},
+                                      throughput_rules=False)
+        self.set_stats(progress, "n1", 1, 1)
+        ok(progress.check_rules("n1", 10, 0)) == None
+        ok(progress.check_rules("n1", 10, 1)) != None
+
+    @test("test_progress_feed")
+    def test_feed(self):
+        progress = self.make_progress({'min_iops': 500, 'grace': 0})
+        stream = make_status(0, 0) + make_status(1000, 1000) + make_status(2000, 2000)
+
+        # reports may be splitted by channel at any point
+        progress.feed("n1", stream[:30])
+        progress.feed("n1", stream[30:-10])
+        ok(progress.stats["n1"][0]) == 1000
+        ok(self.run_state.is_aborted()) == False
+
+        progress.feed("n1", stream[-10:] + make_status(2100, 3000))
+        ok(progress.stats["n1"][0]) == 100
+        ok(self.run_state.is_aborted()) == True
+        ok(self.run_state.stopped) == True
+
+
+GB = 1024 ** 3
+
+
+class ChooseFileSizeTest(unittest.TestCase):
+    @test("test_file_size_by_ram")
+    def test_by_ram(self):
+        size, limit, rationale = fio.choose_file_size(8 * GB, 1000 * GB, 0, 4, GB, 0.9)
+        ok(size) == 32 * GB
+        ok(limit) == 900 * GB
+        ok(rationale.startswith("4 x (RAM")) == True
+
+    @test("test_file_size_cache")
+    def test_cache(self):
+        size, _, _ = fio.choose_file_size(8 * GB, 1000 * GB, 2 * GB, 2, GB, 0.9)
+        ok(size) == 20 * GB
+
+    @test("test_file_size_gb_aligned")
+    def test_gb_aligned(self):
+        size, limit, _ = fio.choose_file_size(GB + 1, int(10.5 * GB), 0, 1, GB, 1.0)
+        ok(size) == 2 * GB
+        ok(limit) == 10 * GB
+
+    @test("test_file_size_min")
+    def test_min(self):
+        size, _, rationale = fio.choose_file_size(GB // 4, 1000 * GB, 0, 2, 10 * GB, 0.9)
+        ok(size) == 10 * GB
+        ok("raised to min" in rationale) == True
+
+    @test("test_file_size_limited")
+    def test_limited(self):
+        size, limit, rationale = fio.choose_file_size(64 * GB, 100 * GB, 0, 4, GB, 0.9)
+        ok(size) == 90 * GB
+        ok(limit) == 90 * GB
+        ok("limited by 90%" in rationale) == True
+
+    @test("test_file_size_no_space")
+    def test_no_space(self):
+        with self.assertRaises(fio.StopTestError):
+            fio.choose_file_size(8 * GB, GB // 2, 0, 4, GB, 0.9)
+
+
+class RunIsolatedTest(unittest.TestCase):
+    def make_test(self, do_run, nodes_count=3, max_node_failures=None):
+        test_obj = fio.IOPerfTest.__new__(fio.IOPerfTest)
+        test_obj.active_nodes = [FakeNode("node{0}".format(idx)) for idx in range(nodes_count)]
+        test_obj.straggler_timeout = 0
+        test_obj.status_interval = None
+        test_obj.max_node_failures = max_node_failures
+        test_obj.node_failures = collections.Counter()
+        test_obj.excluded_nodes = {}
+        test_obj.do_run = do_run
+        return test_obj
+
+    def run_test(self, test_obj):
+        with ThreadPoolExecutor(len(test_obj.active_nodes)) as pool:
+            return test_obj.run_isolated(pool, make_section("s1", 10), 0)
+
+    @test("test_run_isolated_straggler")
+    def test_straggler(self):
+        calls = collections.Counter()
+
+        def do_run(node, run_state, fio_cfg, pos):
+            calls[node.get_conn_id()] += 1
+            if node.get_conn_id() == "node1":
+                while not run_state.is_straggler_deadline():
+                    time.sleep(0.01)
+                raise fio.StragglerKilled("killed")
+            run_state.node_finished()
+            return (1.0, 2.0)
+
+        test_obj = self.make_test(do_run)
+        nodes, intervals = self.run_test(test_obj)
+
+        # finished nodes results are kept and test isn't retried
+        ok([node.get_conn_id() for node in nodes]) == ["node0", "node2"]
+        ok(intervals) == [(1.0, 2.0), (1.0, 2.0)]
+        ok(dict(calls)) == {"node0": 1, "node1": 1, "node2": 1}
+        ok(dict(test_obj.node_failures)) == {"node1": 1}
+        ok(len(test_obj.active_nodes)) == 3
+
+    @test("test_run_isolated_straggler_excluded")
+    def test_straggler_excluded(self):
+        def do_run(node, run_state, fio_cfg, pos):
+            if node.get_conn_id() == "node1":
+                while not run_state.is_straggler_deadline():
+                    time.sleep(0.01)
+                raise fio.StragglerKilled("killed")
+            run_state.node_finished()
+            return (1.0, 2.0)
+
+        test_obj = self.make_test(do_run, max_node_failures=1)
+        nodes, _ = self.run_test(test_obj)
+        ok(len(nodes)) == 2
+        ok(list(test_obj.excluded_nodes)) == ["node1"]
+        ok([node.get_conn_id() for node in test_obj.active_nodes]) == ["node0", "node2"]
+
+    @test("test_run_isolated_retry")
+    def test_retry(self):
+        calls = collections.Counter()
+
+        def do_run(node, run_state, fio_cfg, pos):
+            calls[node.get_conn_id()] += 1
+            if node.get_conn_id() == "node1" and calls["node1"] == 1:
+                raise RuntimeError("fio crashed")
+            run_state.barrier.wait()
+            return (1.0, 2.0)
+
+        test_obj = self.make_test(do_run)
+        nodes, intervals = self.run_test(test_obj)
+
+        # node failure aborts test on all nodes, test is retried
+        ok(len(nodes)) == 3
+        ok(dict(calls)) == {"node0": 2, "node1": 2, "node2": 2}
+        ok(dict(test_obj.node_failures)) == {"node1": 1}
+
+
+class DeployToolsTest(unittest.TestCase):
+    def setUp(self):
+        self.deploys = []
+        self.orig_deploy_many = fio.artifacts.deploy_many
+        fio.artifacts.deploy_many = lambda targets, bundle, dst: \
+            self.deploys.append((bundle.name, [conn_id for _, _, conn_id in targets], dst))
+
+        self.test = fio.IOPerfTest.__new__(fio.IOPerfTest)
+        self.test.config = FakeConfig("/tmp")
+        self.test.config.remote_dir = "/tmp/wally"
+        self.test.use_system_fio = False
+        self.test.node_os = {}
+        self.nodes = []
+
+    def tearDown(self):
+        fio.artifacts.deploy_many = self.orig_deploy_many
+
+    def add_node(self, conn_id, release):
+        node = FakeNode(conn_id)
+        node.connection = None
+        node.get_ip = lambda: conn_id
+        self.nodes.append(node)
+        self.test.node_os[conn_id] = utils.os_release('ubuntu', release, 'x86_64')
+
+    @test("test_deploy_tools_once")
+    def test_once(self):
+        for idx in range(3):
+            self.add_node("node{0}".format(idx), "trusty")
+        self.test.deploy_tools(self.nodes)
+
+        # each bundle is deployed once for all nodes
+        all_nodes = ["node0", "node1", "node2"]
+        ok(self.deploys) == [("io_scripts", all_nodes, "/tmp/wally"),
+                             ("fio", all_nodes, "/tmp/wally")]
+
+    @test("test_deploy_tools_os")
+    def test_os(self):
+        self.add_node("node0", "trusty")
+        self.add_node("node1", "xenial")
+        self.add_node("node2", "trusty")
+        fio_dir = tempfile.mkdtemp()
+        try:
+            for release in ("trusty", "xenial"):
+                with open(os.path.join(fio_dir, release), "wb") as fd:
+                    fd.write(bz2.compress("fio " + release))
+
+            self.test.get_fio_path = lambda os_info: os.path.join(fio_dir, os_info.release)
+            self.test.deploy_tools(self.nodes)
+        finally:
+            shutil.rmtree(fio_dir)
+
+        # nodes with different os get different fio binary
+        ok(self.deploys[1:]) == [("fio", ["node0", "node2"], "/tmp/wally"),
+                                 ("fio", ["node1"], "/tmp/wally")]
+
+    @test("test_deploy_tools_no_fio")
+    def test_no_fio(self):
+        self.add_node("node0", "unknown")
+        with self.assertRaises(RuntimeError):
+            self.test.deploy_tools(self.nodes)
+
+        self.test.use_system_fio = True
+        del self.deploys[:]
+        self.test.deploy_tools(self.nodes)
+        ok([name for name, _, _ in self.deploys]) == ["io_scripts"]
+
+
+if __name__ == '__main__':
+    main()
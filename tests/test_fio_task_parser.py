@@ -0,0 +1,70 @@
+import unittest
+
+
+from oktest import ok, main, test
+
+
+from wally.suits.io import fio_task_parser
+from wally.suits.io.fio_task_parser import FioJobSection
+
+
+def make_section(name, **vals):
+    sec = FioJobSection(name)
+    sec.vals['rw'] = 'randwrite'
+    sec.vals['blocksize'] = '4k'
+    sec.vals.update(vals)
+    return sec
+
+
+class DevicesSplitTest(unittest.TestCase):
+    @test("test_device_label")
+    def test_device_label(self):
+        ok(fio_task_parser.device_label("/dev/vdb")) == "vdb"
+        ok(fio_task_parser.device_label("/dev/disk/by-id/ata-ST1000_Z1@2")) == "ata-ST1000-Z1-2"
+        ok(fio_task_parser.device_label("/mnt/ceph.img/")) == "ceph-img"
+
+    @test("test_split_by_devices")
+    def test_split(self):
+        sec = make_section("hdd_test_rws4k_th1", filename="/tmp/xxx", stonewall='1',
+                           write_lat_log='hdd_test', write_iops_log='hdd_test')
+        res = fio_task_parser.split_by_devices(sec, ["/dev/vdb", "/dev/vdc"])
+
+        ok([label for label, _ in res]) == ["vdb", "vdc"]
+        (_, sec1), (_, sec2) = res
+        ok(sec1.name) == "hdd_test_rws4k_th1@vdb"
+        ok(sec2.name) == "hdd_test_rws4k_th1@vdc"
+        ok(sec1.vals['filename']) == "/dev/vdb"
+        ok(sec2.vals['filename']) == "/dev/vdc"
+        ok(sec1.vals['write_lat_log']) == "hdd_test_vdb"
+        ok(sec2.vals['write_iops_log']) == "hdd_test_vdc"
+
+        # first copy waits for previous jobs, others are started with it
+        ok(sec1.vals['stonewall']) == '1'
+        ok('new_group' in sec1.vals) == False
+        ok('stonewall' in sec2.vals) == False
+        ok(sec2.vals['new_group']) == '1'
+
+        # original section isn't changed
+        ok(sec.name) == "hdd_test_rws4k_th1"
+        ok(sec.vals['filename']) == "/tmp/xxx"
+        ok(sec.vals['write_lat_log']) == "hdd_test"
+
+    @test("test_split_by_single_device")
+    def test_split_single(self):
+        sec = make_section("test", stonewall='1')
+        [(label, dev_sec)] = fio_task_parser.split_by_devices(sec, ["/dev/sdb"])
+        ok(label) == "sdb"
+        ok(dev_sec.vals['stonewall']) == '1'
+        ok('write_lat_log' in dev_sec.vals) == False
+
+    @test("test_get_job_device")
+    def test_get_job_device(self):
+        sec = make_section("test@x")
+        [(_, dev_sec)] = fio_task_parser.split_by_devices(sec, ["/dev/vdb"])
+        ok(fio_task_parser.get_job_device({'jobname': dev_sec.name})) == "vdb"
+        ok(fio_task_parser.get_job_device({'jobname': "test"})) == None
+        ok(fio_task_parser.get_job_device({})) == None
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+import json
+import unittest
+
+
+from oktest import ok, main, test
+
+
+from wally import hw_info, utils
+
+
+class CpuListTest(unittest.TestCase):
+    @test("test_cpu_list")
+    def test_cpu_list(self):
+        ok(hw_info.parse_cpu_list("0-3,8\n")) == [0, 1, 2, 3, 8]
+        ok(hw_info.format_cpu_list([8, 2, 0, 1, 3])) == "0-3,8"
+        ok(hw_info.format_cpu_list([1, 3])) == "1,3"
+
+
+SW_INFO_OUT = """== kernel
+4.4.0-31-generic
+== block
+vda scheduler noop [deadline] cfq
+vda nr_requests 128
+vda rotational 1
+loop0 scheduler none
+nvme0n1 scheduler [none] mq-deadline
+== mounts
+sysfs /sys sysfs rw,nosuid 0 0
+/dev/vda1 / ext4 rw,relatime,data=ordered 0 0
+== sysctl
+dirty_ratio 20
+swappiness 60
+== governor
+performance
+performance
+powersave
+== libvirt
+== qemu
+QEMU emulator version 2.5.0
+== ceph
+"""
+
+
+class SWInfoTest(unittest.TestCase):
+    @test("test_sw_info_parse")
+    def test_parse(self):
+        info = hw_info.parse_sw_info(SW_INFO_OUT)
+        ok(info.kernel_version) == "4.4.0-31-generic"
+        # virtual devices are skipped, selected scheduler is taken
+        ok(info.block) == {'vda': {'scheduler': 'deadline',
+                                   'nr_requests': '128',
+                                   'rotational': '1'},
+                           'nvme0n1': {'scheduler': 'none'}}
+        ok(info.mounts) == {'/': ('/dev/vda1', 'ext4', 'rw,relatime,data=ordered')}
+        ok(info.sysctl) == {'vm.dirty_ratio': '20', 'vm.swappiness': '60'}
+        ok(info.cpu_governors) == {'performance': 2, 'powersave': 1}
+        ok(info.libvirt_version) == None
+        ok(info.qemu_version) == "QEMU emulator version 2.5.0"
+        ok(info.ceph_version) == None
+
+    @test("test_sw_info_parse_empty")
+    def test_parse_empty(self):
+        info = hw_info.parse_sw_info("")
+        ok(info.kernel_version) == None
+        ok(info.get_facts()) == {}
+
+    @test("test_sw_info_facts")
+    def test_facts(self):
+        info = hw_info.parse_sw_info(SW_INFO_OUT)
+        info.OS_version = utils.os_release('ubuntu', 'xenial', 'x86_64')
+        facts = info.get_facts()
+
+        ok(facts['kernel']) == "4.4.0-31-generic"
+        ok(facts['os']) == "ubuntu xenial x86_64"
+        ok(facts['block.vda.scheduler']) == "deadline"
+        ok(facts['mount./']) == "/dev/vda1 ext4 rw,relatime,data=ordered"
+        ok(facts['sysctl.vm.swappiness']) == "60"
+        ok(facts['cpu.governor']) == "performance*2, powersave*1"
+        ok(facts['qemu']) == "QEMU emulator version 2.5.0"
+        ok('libvirt' in facts) == False
+
+    @test("test_sw_info_single_governor")
+    def test_single_governor(self):
+        info = hw_info.SWInfo()
+        info.cpu_governors = {'performance': 8}
+        ok(info.get_facts()) == {'cpu.governor': 'performance'}
+
+
+class DiffFactsTest(unittest.TestCase):
+    @test("test_diff_facts_same")
+    def test_same(self):
+        facts = {'n1': {'kernel': '4.4', 'os': 'ubuntu'}}
+        ok(hw_info.diff_facts(facts, dict(facts))) == []
+
+    @test("test_diff_facts")
+    def test_diff(self):
+        facts1 = {'n1': {'kernel': '4.4', 'sysctl.vm.swappiness': '60'},
+                  'n2': {'kernel': '4.4'}}
+        facts2 = {'n1': {'kernel': '4.15', 'block.vda.scheduler': 'noop'},
+                  'n3': {'kernel': '4.4'}}
+
+        ok(hw_info.diff_facts(facts1, facts2)) == [
+            ('n1', 'block.vda.scheduler', None, 'noop'),
+            ('n1', 'kernel', '4.4', '4.15'),
+            ('n1', 'sysctl.vm.swappiness', '60', None),
+            ('n2', 'kernel', '4.4', None),
+            ('n3', 'kernel', None, '4.4')]
+
+
+HW_INFO_OUT = """== hostname
+node-1
+== dmi
+sys_vendor Supermicro
+product_name To be filled by O.E.M.
+board_vendor Supermicro
+board_name X9DRW
+board_version
+== cpu
+processor\t: 0
+model name\t: Intel(R) Xeon(R) CPU  E5-2650 0 @ 2.00GHz
+processor\t: 1
+model name\t: Intel(R) Xeon(R) CPU  E5-2650 0 @ 2.00GHz
+processor\t: 2
+model name\t: Intel(R) Xeon(R) CPU E5-2680 v2 @ 2.80GHz
+processor\t: 3
+== mem
+MemTotal:       65871024 kB
+== disks
+sda 1953525168 ATA ST1000NM0033
+loop0 0
+dm-0 409600
+sr0 2097151 QEMU DVD-ROM
+sdb 0
+== storage
+0000:00:1f.2 0x8086 0x1d02 ahci
+0000:03:00.0 0x1000 0x0087
+== net
+eth0 up 10000 full
+eth1 down
+== numa
+node 0 0-1
+node 1 2-3
+dev eth0 0
+dev sda -1
+== os
+x86_64
+ID=ubuntu
+VERSION_CODENAME=xenial
+"""
+
+
+class HWInfoTest(unittest.TestCase):
+    @test("test_hw_info_parse")
+    def test_parse(self):
+        info = hw_info.parse_hw_info(HW_INFO_OUT)
+        ok(info.hostname) == "node-1"
+        ok(info.sys_name) == "Supermicro"
+        ok(info.mb) == "Supermicro X9DRW"
+        ok(info.ram_size) == 65871024 * 1024
+        ok(info.disks_info) == {'sda': ("ATA ST1000NM0033", 1953525168 * 512)}
+        ok(info.storage_controllers) == ["0000:00:1f.2: ahci [8086:1d02]",
+                                         "0000:03:00.0: no driver [1000:0087]"]
+        ok(info.net_info) == {'eth0': ("10000Mbit/s", "full", [])}
+        ok(info.os_info) == utils.os_release('ubuntu', 'xenial', 'x86_64')
+
+    @test("test_hw_info_cpu_models")
+    def test_cpu_models(self):
+        info = hw_info.parse_hw_info(HW_INFO_OUT)
+        # models are kept in order, processor without model name is counted as unknown
+        ok(info.cores) == [("Intel(R) Xeon(R) CPU E5-2650 0 @ 2.00GHz", 2),
+                           ("Intel(R) Xeon(R) CPU E5-2680 v2 @ 2.80GHz", 1),
+                           ("unknown", 1)]
+        ok(info.get_summary()['cores']) == 4
+
+    @test("test_hw_info_parse_empty")
+    def test_parse_empty(self):
+        info = hw_info.parse_hw_info("")
+        ok(info.hostname) == None
+        ok(info.cores) == []
+        ok(info.os_info) == None
+
+    @test("test_hw_info_numa")
+    def test_numa(self):
+        numa_nodes, devices_numa = hw_info.parse_numa_info(
+            "node 0 0-3,8\nnode 1 4-7,9-10\ndev eth0 1\ndev vda -1\n")
+        ok(numa_nodes) == {0: [0, 1, 2, 3, 8], 1: [4, 5, 6, 7, 9, 10]}
+        # devices without known locality are skipped
+        ok(devices_numa) == {'eth0': 1}
+
+        ok(hw_info.parse_numa_info("")) == ({}, {})
+
+    @test("test_hw_info_dict")
+    def test_dict(self):
+        info = hw_info.parse_hw_info(HW_INFO_OUT)
+        # to_dict result is stored as json
+        data = json.loads(json.dumps(info.to_dict()))
+        info2 = hw_info.HWInfo.from_dict(data)
+
+        for name in hw_info.HWInfo.STORED_FIELDS:
+            ok(getattr(info2, name)) == getattr(info, name)
+        ok(info2.os_info.distro) == 'ubuntu'
+
+
+if __name__ == '__main__':
+    main()
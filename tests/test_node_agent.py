@@ -0,0 +1,220 @@
+import os
+import sys
+import json
+import errno
+import shutil
+import struct
+import tempfile
+import unittest
+import subprocess
+
+
+from oktest import ok, main, test
+
+
+from wally.agent import api
+
+
+class PipeChannel(object):
+    "paramiko channel subset on top of local process pipes"
+    def __init__(self):
+        self.proc = None
+
+    def exec_command(self, cmd):
+        self.proc = subprocess.Popen(cmd, shell=True,
+                                     stdin=subprocess.PIPE,
+                                     stdout=subprocess.PIPE)
+
+    def recv(self, size):
+        return os.read(self.proc.stdout.fileno(), size)
+
+    def sendall(self, data):
+        self.proc.stdin.write(data)
+        self.proc.stdin.flush()
+
+    def close(self):
+        if self.proc.poll() is None:
+            self.proc.stdin.close()
+            self.proc.wait()
+
+
+class PipeConnection(object):
+    "paramiko.SSHClient subset, each session is new local agent process"
+    def __init__(self):
+        self.channels = []
+
+    def get_transport(self):
+        return self
+
+    def open_session(self):
+        self.channels.append(PipeChannel())
+        return self.channels[-1]
+
+
+def start_local_agent():
+    return api.AgentConnection(PipeConnection(), api.AGENT_SOURCE, node="local",
+                               python=sys.executable)
+
+
+class AgentProtocolTest(unittest.TestCase):
+    def setUp(self):
+        self.proc = subprocess.Popen([sys.executable, api.AGENT_SOURCE],
+                                     stdin=subprocess.PIPE,
+                                     stdout=subprocess.PIPE)
+
+    def tearDown(self):
+        self.proc.stdin.close()
+        self.proc.wait()
+
+    def pack(self, req_id, func, **params):
+        data = json.dumps({'id': req_id, 'func': func, 'params': params})
+        return struct.pack("!I", len(data)) + data
+
+    def read_msg(self):
+        size = struct.unpack("!I", self.proc.stdout.read(4))[0]
+        return json.loads(self.proc.stdout.read(size))
+
+    @test("test_agent_framing")
+    def test_framing(self):
+        # several requests in one write and one request splitted
+        # into many writes
+        self.proc.stdin.write(self.pack(1, "ping") + self.pack(2, "listdir", path="/"))
+        self.proc.stdin.flush()
+        for char in self.pack(3, "ping"):
+            self.proc.stdin.write(char)
+            self.proc.stdin.flush()
+
+        msgs = dict((msg['id'], msg) for msg in [self.read_msg() for _ in range(3)])
+        ok(sorted(msgs)) == [1, 2, 3]
+        ok(msgs[1]) == {'id': 1, 'ok': True, 'result': self.proc.pid}
+        ok('tmp' in msgs[2]['result']) == True
+        ok(msgs[3]['result']) == self.proc.pid
+
+    @test("test_agent_error_response")
+    def test_error(self):
+        self.proc.stdin.write(self.pack(7, "get", path="/no/such/file"))
+        self.proc.stdin.flush()
+        msg = self.read_msg()
+        ok(msg['id']) == 7
+        ok(msg['ok']) == False
+        ok(msg['errno']) == errno.ENOENT
+        ok(msg['error'].startswith("IOError")) == True
+
+    @test("test_agent_eof")
+    def test_eof(self):
+        # agent exits, when controller closes channel
+        self.proc.stdin.write(self.pack(1, "ping")[:6])
+        self.proc.stdin.close()
+        ok(self.proc.wait()) == 0
+        ok(self.proc.stdout.read()) == ""
+        self.proc.stdin = open(os.devnull, "w")
+
+
+class AgentConnectionTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.agent = start_local_agent()
+
+    def tearDown(self):
+        self.agent.close()
+        self.agent.reader.join(10)
+        shutil.rmtree(self.dir)
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    @test("test_agent_call")
+    def test_call(self):
+        ok(self.agent.call('ping', call_timeout=10)).is_a(int)
+        ok(self.agent.run("cat; echo -n err >&2; exit 2", stdin_data="data\0")) == \
+            (2, "data\0err")
+
+    @test("test_agent_remote_exception")
+    def test_remote_exception(self):
+        try:
+            self.agent.get(self.path("missing"))
+        except IOError as exc:
+            ok(exc.errno) == errno.ENOENT
+        else:
+            assert False, "IOError isn't raised"
+
+        # errors without errno
+        with self.assertRaises(OSError):
+            self.agent.call('no_such_func')
+
+        # connection is usable after errors
+        ok(self.agent.listdir(self.dir)) == []
+
+    @test("test_agent_put_get_many")
+    def test_get_many(self):
+        self.agent.put(self.path("a"), "data a\0", mode=0600)
+        self.agent.put(self.path("b"), "")
+        ok(os.stat(self.path("a")).st_mode & 0777) == 0600
+
+        # missing files are skipped
+        res = self.agent.get_many([self.path("a"), self.path("b"), self.path("c")])
+        ok(res) == {self.path("a"): "data a\0", self.path("b"): ""}
+
+    @test("test_agent_remove")
+    def test_remove(self):
+        self.agent.put(self.path("a"), "a")
+        self.agent.put(self.path("b"), "b")
+
+        with self.assertRaises(IOError):
+            self.agent.remove([self.path("a"), self.path("missing")])
+        ok(os.path.exists(self.path("a"))) == False
+
+        self.agent.remove([self.path("missing"), self.path("b")], missing_ok=True)
+        ok(os.listdir(self.dir)) == []
+
+    @test("test_agent_sftp_remove")
+    def test_sftp_remove(self):
+        # the same as paramiko sftp
+        sftp = api.AgentSFTP(self.agent)
+        try:
+            sftp.remove(self.path("missing"))
+        except IOError as exc:
+            ok(exc.errno) == errno.ENOENT
+        else:
+            assert False, "IOError isn't raised"
+
+    @test("test_agent_spawn")
+    def test_spawn(self):
+        out_file = self.path("out")
+        pid = self.agent.spawn("echo started; exit 3", out_file=out_file)
+
+        # exit event is send without request
+        ok(self.agent.wait_exit(pid, 10)) == True
+        ok(self.agent.exited[pid]) == 3
+        ok(self.agent.is_running(pid)) == False
+        ok(open(out_file).read()) == "started\n"
+
+        self.agent.forget(pid)
+        ok(pid in self.agent.exited) == False
+
+    @test("test_agent_spawn_kill")
+    def test_spawn_kill(self):
+        pid = self.agent.spawn("sleep 30")
+        ok(self.agent.wait_exit(pid, 0.1)) == False
+        ok(self.agent.is_running(pid)) == True
+
+        self.agent.kill(pid)
+        ok(self.agent.wait_exit(pid, 10)) == True
+        ok(self.agent.exited[pid]) == -15
+
+    @test("test_agent_closed")
+    def test_closed(self):
+        pid = self.agent.spawn("sleep 30")
+        self.agent.close()
+        self.agent.reader.join(10)
+
+        ok(self.agent.is_alive()) == False
+        with self.assertRaises(api.paramiko.SSHException):
+            self.agent.wait_exit(pid, 10)
+        with self.assertRaises(api.paramiko.SSHException):
+            self.agent.call('ping')
+        os.killpg(pid, 9)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import StringIO
+
+
+from oktest import ok, main, test
+
+
+from wally.suits.io import prefill
+
+
+MB = 1024 ** 2
+
+
+class PrefillCheckTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def make_file(self, name, size, filled=True, first_block=True):
+        fname = os.path.join(self.dir, name)
+        with open(fname, "wb") as fd:
+            if filled:
+                fd.write(os.urandom(size))
+            else:
+                if first_block:
+                    fd.write(os.urandom(prefill.SAMPLE_SIZE))
+                fd.truncate(size)
+        return fname
+
+    @test("test_prefill_no_file")
+    def test_no_file(self):
+        fname = os.path.join(self.dir, "xxx")
+        ok(prefill.check_file(fname, MB, {}, 10)) == "no such file"
+
+    @test("test_prefill_too_small")
+    def test_too_small(self):
+        fname = self.make_file("small", MB)
+        ok(prefill.check_file(fname, 2 * MB, {}, 10)) == "file is too small"
+
+    @test("test_prefill_sparse")
+    def test_sparse(self):
+        fname = self.make_file("sparse", MB, filled=False)
+        manifest = {}
+        reason = prefill.check_file(fname, MB, manifest, 10)
+        # hole is found by SEEK_HOLE, if fs supports it, else by zero block
+        ok(reason.startswith("hole") or reason.startswith("zero block")) == True
+        ok(manifest) == {}
+
+    @test("test_prefill_filled")
+    def test_filled(self):
+        fname = self.make_file("filled", MB)
+        manifest = {}
+        ok(prefill.check_file(fname, MB, manifest, 10)) == None
+        ok(manifest[fname]['size']) == MB
+        ok(manifest[fname]['ino']) == os.stat(fname).st_ino
+
+    @test("test_prefill_manifest")
+    def test_manifest(self):
+        # only first block is checked for files from manifest
+        fname = self.make_file("sparse", MB, filled=False)
+        manifest = {fname: prefill.get_entry(os.stat(fname), MB)}
+        ok(prefill.check_file(fname, MB, manifest, 10)) == None
+
+        # file in manifest is smaller than required
+        ok(prefill.check_file(fname, MB, {fname: prefill.get_entry(os.stat(fname), MB // 2)},
+                              10)) != None
+
+    @test("test_prefill_manifest_new_file")
+    def test_manifest_new_file(self):
+        fname = self.make_file("sparse", MB, filled=False, first_block=False)
+        manifest = {fname: prefill.get_entry(os.stat(fname), MB)}
+        ok(prefill.check_file(fname, MB, manifest, 10)) != None
+
+    @test("test_prefill_main")
+    def test_main(self):
+        filled = self.make_file("filled", MB)
+        sparse = self.make_file("sparse", MB, filled=False)
+        manifest_path = os.path.join(self.dir, "manifest.json")
+        args = ["prefill.py", "check", manifest_path, "10", filled + ":1", sparse + ":1"]
+
+        stdout = StringIO.StringIO()
+        prefill.sys.stdout, orig_stdout = stdout, prefill.sys.stdout
+        try:
+            ok(prefill.main(args)) == 0
+        finally:
+            prefill.sys.stdout = orig_stdout
+
+        res = json.loads(stdout.getvalue())
+        ok(res[filled]) == None
+        ok(res[sparse]) != None
+        ok(sorted(prefill.load_manifest(manifest_path))) == [filled]
+
+        prefill.main(["prefill.py", "update", manifest_path, "10", sparse + ":1"])
+        ok(sorted(prefill.load_manifest(manifest_path))) == sorted([filled, sparse])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+
+from oktest import ok, main, test
+
+
+from wally.suits.io import reduce_logs
+
+
+class ReduceLogsTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write_log(self, name, samples):
+        fname = os.path.join(self.dir, name)
+        with open(fname, "w") as fd:
+            for offset, val in samples:
+                fd.write("{0}, {1}, 0, 4096\n".format(offset, val))
+        return fname
+
+    def read_log(self, fname):
+        with open(fname) as fd:
+            return [tuple(map(int, line.split(',')[:2])) for line in fd]
+
+    @test("test_reduce_log_type")
+    def test_log_type(self):
+        ok(reduce_logs.log_type("/tmp/x/fio_log_clat.1.log")) == 'clat'
+        ok(reduce_logs.log_type("fio_log_iops.2.vdb.log")) == 'iops'
+
+    @test("test_reduce_log_windows")
+    def test_windows(self):
+        fname = self.write_log("fio_iops.1.log",
+                               [(500, 10), (1000, 20), (1500, 30), (2000, 50), (3200, 7)])
+        tmp_fname, summary = reduce_logs.reduce_log(fname, 1000)
+
+        # offset is the end of sample period, so 1000 is in the first window
+        ok(self.read_log(tmp_fname)) == [(1000, 15), (2000, 40), (4000, 7)]
+        ok(summary) == {'count': 5, 'min': 7, 'max': 50, 'avg': 23.4}
+
+        # original log isn't changed till main replaces it
+        ok(len(self.read_log(fname))) == 5
+
+    @test("test_reduce_log_lat_hist")
+    def test_lat_hist(self):
+        fname = self.write_log("fio_clat.1.log", [(1, 1), (2, 3), (3, 4), (4, 1000)])
+        _, summary = reduce_logs.reduce_log(fname, 1000)
+        ok(summary['hist']) == {'1': 1, '2': 1, '3': 1, '10': 1}
+
+    @test("test_reduce_log_empty")
+    def test_empty(self):
+        fname = self.write_log("fio_bw.1.log", [])
+        tmp_fname, summary = reduce_logs.reduce_log(fname, 1000)
+        ok(self.read_log(tmp_fname)) == []
+        ok(summary) == {'count': 0, 'min': None, 'max': None, 'avg': None}
+
+    @test("test_reduce_logs_main")
+    def test_main(self):
+        log1 = self.write_log("fio_iops.1.log", [(100, 1), (200, 3)])
+        log2 = self.write_log("fio_lat.1.log", [(100, 5)])
+        raw_dir = os.path.join(self.dir, "raw")
+        summary_file = os.path.join(self.dir, "summary.json")
+
+        ok(reduce_logs.main(["reduce_logs.py", "1000", summary_file, raw_dir, log1, log2])) == 0
+
+        ok(self.read_log(log1)) == [(1000, 2)]
+        ok(self.read_log(os.path.join(raw_dir, "fio_iops.1.log"))) == [(100, 1), (200, 3)]
+        ok(sorted(os.listdir(raw_dir))) == ["fio_iops.1.log", "fio_lat.1.log"]
+
+        summary = json.load(open(summary_file))
+        ok(sorted(summary)) == ["fio_iops.1.log", "fio_lat.1.log"]
+        ok(summary["fio_lat.1.log"]['count']) == 1
+
+    @test("test_reduce_logs_no_raw")
+    def test_no_raw(self):
+        log1 = self.write_log("fio_iops.1.log", [(100, 1)])
+        summary_file = os.path.join(self.dir, "summary.json")
+        reduce_logs.main(["reduce_logs.py", "1000", summary_file, "-", log1])
+        ok(sorted(os.listdir(self.dir))) == ["fio_iops.1.log", "summary.json"]
+
+
+if __name__ == '__main__':
+    main()
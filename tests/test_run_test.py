@@ -0,0 +1,67 @@
+import unittest
+
+
+from oktest import ok, main, test
+
+
+from wally import run_test
+
+
+class TestGroupsTest(unittest.TestCase):
+    nodes = ["node{0}".format(idx) for idx in range(7)]
+
+    @test("test_groups_all")
+    def test_all(self):
+        ok(run_test.get_test_groups(self.nodes, 'all', {})) == [self.nodes]
+
+    @test("test_groups_single")
+    def test_single(self):
+        ok(run_test.get_test_groups(self.nodes, 2, {})) == [self.nodes[:2]]
+        ok(run_test.get_test_groups(self.nodes, 3, {'count': 1})) == [self.nodes[:3]]
+
+    @test("test_groups_count")
+    def test_count(self):
+        groups = run_test.get_test_groups(self.nodes, 2, {'count': 3})
+        ok(groups) == [self.nodes[:2], self.nodes[2:4], self.nodes[4:6]]
+
+    @test("test_groups_auto")
+    def test_auto(self):
+        groups = run_test.get_test_groups(self.nodes, 3, {'count': 'auto'})
+        ok(groups) == [self.nodes[:3], self.nodes[3:6]]
+
+    @test("test_groups_disjoint")
+    def test_disjoint(self):
+        groups = run_test.get_test_groups(self.nodes, 2, {'count': 'auto'})
+        all_nodes = sum(groups, [])
+        ok(len(all_nodes)) == len(set(all_nodes))
+
+    @test("test_groups_not_enough_nodes")
+    def test_not_enough_nodes(self):
+        # incomplete groups are dropped
+        groups = run_test.get_test_groups(self.nodes, 3, {'count': 4})
+        ok(groups) == [self.nodes[:3], self.nodes[3:6]]
+
+
+class FactsDiffTest(unittest.TestCase):
+    @test("test_facts_diff_same")
+    def test_same(self):
+        facts = {'n1': {'kernel': '4.4'}}
+        ok(run_test.format_facts_diff(facts, facts)) == "Environment facts are the same"
+
+    @test("test_facts_diff_table")
+    def test_table(self):
+        facts1 = {'n1': {'kernel': '4.4', 'qemu': '2.5'}}
+        facts2 = {'n1': {'kernel': '4.15'}}
+
+        lines = run_test.format_facts_diff(facts1, facts2).split("\n")
+        rows = [[cell.strip() for cell in line.strip('|').split('|')]
+                for line in lines if line.startswith('|')]
+
+        # values are shown as is, not as numbers
+        ok(rows) == [['Node', 'Fact', 'Value_1', 'Value_2'],
+                     ['n1', 'kernel', '4.4', '4.15'],
+                     ['n1', 'qemu', '2.5', '-']]
+
+
+if __name__ == '__main__':
+    main()
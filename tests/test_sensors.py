@@ -0,0 +1,39 @@
+import unittest
+
+
+from oktest import ok, main, test
+
+
+from wally.sensors import api
+
+
+class RebaseCsvTest(unittest.TestCase):
+    @test("test_rebase_csv_time")
+    def test_rebase(self):
+        data = "NEW_DATA\n" + \
+               "time,source_id,sda.io_queue\n" + \
+               "1000.6,node1,10\n" + \
+               "1001,node1,12\n" + \
+               "NEW_DATA\n" + \
+               "time,source_id\n" + \
+               "1002.2,node1\n"
+
+        # node clock is 10.1s ahead, times are rounded to seconds
+        ok(api.rebase_csv_time(data, 10.1).split("\n")) == [
+            "NEW_DATA",
+            "time,source_id,sda.io_queue",
+            "991,node1,10",
+            "991,node1,12",
+            "NEW_DATA",
+            "time,source_id",
+            "992,node1",
+            ""]
+
+    @test("test_rebase_csv_time_no_offset")
+    def test_no_offset(self):
+        data = "NEW_DATA\ntime,source_id\n1000,node1\n1001,node1"
+        ok(api.rebase_csv_time(data, 0)) == data
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+import os
+import json
+import time
+import shutil
+import httplib
+import tempfile
+import threading
+import unittest
+
+
+from oktest import ok, main, test
+
+
+from wally import service
+from wally.service import Campaign, CampaignsQueue
+
+
+def make_queue(max_parallel, *campaigns_params):
+    queue = CampaignsQueue(None, max_parallel)
+    for resources, estimated_time in campaigns_params:
+        queue.campaigns.append(Campaign("cfg.yaml", "", set(resources), estimated_time))
+    return queue
+
+
+def start(campaign, ago=0):
+    campaign.status = 'running'
+    campaign.start_time = time.time() - ago
+
+
+class CampaignsQueueTest(unittest.TestCase):
+    @test("test_queue_get_next_order")
+    def test_get_next_order(self):
+        queue = make_queue(1, (["node:a"], 10), (["node:b"], 10))
+        ok(queue.get_next()).is_(queue.campaigns[0])
+
+        queue.campaigns[0].status = 'done'
+        ok(queue.get_next()).is_(queue.campaigns[1])
+
+    @test("test_queue_get_next_max_parallel")
+    def test_get_next_max_parallel(self):
+        queue = make_queue(1, (["node:a"], 10), (["node:b"], 10))
+        start(queue.campaigns[0])
+        ok(queue.get_next()) == None
+
+        queue.max_parallel = 2
+        ok(queue.get_next()).is_(queue.campaigns[1])
+
+    @test("test_queue_get_next_resources")
+    def test_get_next_resources(self):
+        queue = make_queue(3,
+                           (["node:a"], 10),
+                           (["node:a", "node:b"], 10),
+                           (["node:b"], 10),
+                           (["node:c"], 10))
+        start(queue.campaigns[0])
+
+        # campaign 2 shares node:b with queued campaign 1, which
+        # was submitted earlier, so it waits for campaign 1
+        ok(queue.get_next()).is_(queue.campaigns[3])
+
+    @test("test_queue_get_next_skips_finished")
+    def test_get_next_skips_finished(self):
+        queue = make_queue(1, (["node:a"], 10), (["node:a"], 10))
+        queue.campaigns[0].status = 'canceled'
+        ok(queue.get_next()).is_(queue.campaigns[1])
+
+        queue.campaigns[1].status = 'failed'
+        ok(queue.get_next()) == None
+
+    @test("test_queue_cancel")
+    def test_cancel(self):
+        queue = make_queue(1, (["node:a"], 10), (["node:a"], 10))
+        start(queue.campaigns[0])
+
+        ok(queue.cancel(queue.campaigns[0].id)) == False
+        ok(queue.cancel(queue.campaigns[1].id)) == True
+        ok(queue.campaigns[1].status) == 'canceled'
+        ok(queue.cancel("unknown")) == False
+
+    @test("test_queue_eta_serial")
+    def test_eta_serial(self):
+        queue = make_queue(1, (["node:a"], 100), (["node:b"], 50), (["node:c"], None))
+        start(queue.campaigns[0], ago=30)
+
+        now = time.time()
+        queue.update_eta()
+
+        first, second, third = queue.campaigns
+        ok(abs(first.eta - (now + 70))) < 1
+        ok(abs(second.eta - (now + 120))) < 1
+        # unknown duration counts as zero
+        ok(abs(third.eta - (now + 120))) < 1
+
+    @test("test_queue_eta_parallel")
+    def test_eta_parallel(self):
+        queue = make_queue(2, (["node:a"], 100), (["node:b"], 50), (["node:c"], 10))
+        start(queue.campaigns[0])
+
+        now = time.time()
+        queue.update_eta()
+
+        first, second, third = queue.campaigns
+        ok(abs(first.eta - (now + 100))) < 1
+        # free slot is used first, next one is the earliest finished slot
+        ok(abs(second.eta - (now + 50))) < 1
+        ok(abs(third.eta - (now + 60))) < 1
+
+    @test("test_queue_eta_overdue")
+    def test_eta_overdue(self):
+        queue = make_queue(1, (["node:a"], 10), (["node:b"], 20))
+        start(queue.campaigns[0], ago=100)
+
+        now = time.time()
+        queue.update_eta()
+
+        # running campaign, which exceeded estimation, may finish any moment
+        ok(abs(queue.campaigns[0].eta - now)) < 1
+        ok(abs(queue.campaigns[1].eta - (now + 20))) < 1
+
+
+class ServiceAuthTest(unittest.TestCase):
+    token = "secret"
+
+    def setUp(self):
+        self.queue = make_queue(1, (["node:a"], 10))
+        self.server = service.ThreadedHTTPServer(("127.0.0.1", 0),
+                                                 service.make_handler(self.queue, self.token))
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def request(self, method, path, body=None, headers={}):
+        conn = httplib.HTTPConnection(*self.server.server_address)
+        try:
+            conn.request(method, path, body, headers)
+            resp = conn.getresponse()
+            return resp.status, json.loads(resp.read())
+        finally:
+            conn.close()
+
+    @test("test_service_get_without_token")
+    def test_get(self):
+        code, data = self.request("GET", "/campaigns")
+        ok(code) == 200
+        ok([campaign['id'] for campaign in data]) == [self.queue.campaigns[0].id]
+
+    @test("test_service_change_requires_token")
+    def test_no_token(self):
+        path = "/campaigns/" + self.queue.campaigns[0].id
+        ok(self.request("DELETE", path)[0]) == 401
+        ok(self.request("DELETE", path, headers=service.get_auth_header("wrong"))[0]) == 401
+        ok(self.request("DELETE", path, headers={'Authorization': 'Token '})[0]) == 401
+        ok(self.queue.campaigns[0].status) == 'queued'
+
+        body = json.dumps({'config_file': '/tmp/cfg.yaml'})
+        ok(self.request("POST", "/campaigns", body)[0]) == 401
+        ok(len(self.queue.campaigns)) == 1
+
+    @test("test_service_change_with_token")
+    def test_token(self):
+        path = "/campaigns/" + self.queue.campaigns[0].id
+        ok(self.request("DELETE", path, headers=service.get_auth_header(self.token))[0]) == 200
+        ok(self.queue.campaigns[0].status) == 'canceled'
+
+
+class ServiceTokenTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.token_file = os.path.join(self.dir, "wally", "token")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    @test("test_service_token_create")
+    def test_create(self):
+        token = service.get_token(self.token_file, create=True)
+        ok(len(token)) == 32
+        ok(os.stat(self.token_file).st_mode & 0o777) == 0o600
+
+        # existing token is reused by service and clients
+        ok(service.get_token(self.token_file, create=True)) == token
+        ok(service.get_token(self.token_file)) == token
+
+    @test("test_service_token_missing")
+    def test_missing(self):
+        with self.assertRaises(IOError):
+            service.get_token(self.token_file)
+
+        os.makedirs(os.path.dirname(self.token_file))
+        open(self.token_file, "w").close()
+        with self.assertRaises(ValueError):
+            service.get_token(self.token_file, create=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+import io
+import sys
+import json
+import unittest
+
+
+from oktest import ok, main, test
+
+
+from wally.suits.io import settle_caches
+
+
+MEMINFO = """MemTotal:       16310840 kB
+MemFree:         8172848 kB
+Cached:          {cached} kB
+SwapCached:            0 kB
+Dirty:           {dirty} kB
+Writeback:       {writeback} kB
+WritebackTmp:     100000 kB
+"""
+
+
+class DropCachesFile(io.BytesIO):
+    def close(self):
+        self.data = self.getvalue()
+        io.BytesIO.close(self)
+
+
+class FakeProc(object):
+    "/proc files and sync command"
+    def __init__(self, states):
+        self.states = list(states)
+        self.reads = 0
+        self.synced = False
+        self.drop_caches = None
+
+    def open(self, path, mode='r'):
+        if path == '/proc/meminfo':
+            cached, dirty, writeback = self.states[min(self.reads, len(self.states) - 1)]
+            self.reads += 1
+            return io.BytesIO(MEMINFO.format(cached=cached, dirty=dirty, writeback=writeback))
+
+        ok(path) == '/proc/sys/vm/drop_caches'
+        ok(mode) == 'w'
+        self.drop_caches = DropCachesFile()
+        return self.drop_caches
+
+    def call(self, cmd):
+        self.synced = True
+        return 0
+
+
+class SettleCachesTest(unittest.TestCase):
+    def setUp(self):
+        self.orig_subprocess = settle_caches.subprocess
+        self.orig_stdout = sys.stdout
+        self.orig_interval = settle_caches.POLL_INTERVAL
+        settle_caches.POLL_INTERVAL = 0.01
+
+    def tearDown(self):
+        settle_caches.subprocess = self.orig_subprocess
+        settle_caches.POLL_INTERVAL = self.orig_interval
+        sys.stdout = self.orig_stdout
+        if hasattr(settle_caches, 'open'):
+            del settle_caches.open
+
+    def run_settle(self, states, *args):
+        proc = FakeProc(states)
+        settle_caches.open = proc.open
+        settle_caches.subprocess = proc
+        sys.stdout = io.BytesIO()
+        try:
+            ok(settle_caches.main(["settle_caches.py"] + list(args))) == 0
+            res = json.loads(sys.stdout.getvalue())
+        finally:
+            sys.stdout = self.orig_stdout
+        ok(proc.synced) == True
+        return proc, res
+
+    @test("test_settle_caches_meminfo")
+    def test_meminfo(self):
+        settle_caches.open = FakeProc([(1000, 20, 30)]).open
+        ok(settle_caches.meminfo()) == {'Cached': 1000, 'Dirty': 20, 'Writeback': 30}
+
+    @test("test_settle_caches_threshold")
+    def test_threshold(self):
+        # Dirty + Writeback is compared with limit, WritebackTmp is ignored
+        states = [(5000, 4000, 100), (5000, 900, 200), (5000, 600, 400), (5000, 0, 0)]
+        proc, res = self.run_settle(states, "0", "1000", "10")
+
+        ok(res['settled']) == True
+        ok(proc.reads) == 4
+        ok(res['before']) == {'Cached': 5000, 'Dirty': 4000, 'Writeback': 100}
+        ok(res['after']) == {'Cached': 5000, 'Dirty': 0, 'Writeback': 0}
+        ok(proc.drop_caches) == None
+
+    @test("test_settle_caches_timeout")
+    def test_timeout(self):
+        proc, res = self.run_settle([(5000, 4000, 100)], "1", "1000", "0.05")
+        ok(res['settled']) == False
+        ok(res['settle_time']) >= 0.05
+
+        # caches are dropped even if dirty pages aren't written back
+        ok(proc.drop_caches.data) == "3\n"
+
+    @test("test_settle_caches_drop")
+    def test_drop(self):
+        proc, res = self.run_settle([(5000, 0, 0), (5000, 0, 0), (100, 0, 0)],
+                                    "1", "1000", "10")
+        ok(res['settled']) == True
+        ok(proc.drop_caches.data) == "3\n"
+        ok(res['before']['Cached']) == 5000
+        ok(res['after']['Cached']) == 100
+
+
+if __name__ == '__main__':
+    main()
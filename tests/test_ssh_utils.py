@@ -0,0 +1,441 @@
+import os
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+import subprocess
+
+
+from oktest import ok, main, test
+
+
+from wally import ssh_utils
+
+
+class FakeClock(object):
+    "remote node, which clock is offset seconds ahead, answers with delays"
+    def __init__(self, offset, delays):
+        self.offset = offset
+        self.delays = list(delays)
+
+    def __call__(self, conn, cmd, nolog=False, node=None):
+        ok(cmd) == "date +%s.%N"
+        delay = self.delays.pop(0)
+        time.sleep(delay / 2)
+        res = "{0:.9f}\n".format(time.time() + self.offset)
+        time.sleep(delay / 2)
+        return res
+
+
+class TimeOffsetTest(unittest.TestCase):
+    def setUp(self):
+        self.orig_run_over_ssh = ssh_utils.run_over_ssh
+
+    def tearDown(self):
+        ssh_utils.run_over_ssh = self.orig_run_over_ssh
+
+    @test("test_time_offset")
+    def test_offset(self):
+        ssh_utils.run_over_ssh = FakeClock(100.0, [0.2, 0.02, 0.1])
+        offset, rtt = ssh_utils.get_time_offset(object(), samples=3)
+
+        # sample with minimal rtt is used
+        ok(0.02 <= rtt < 0.1) == True
+        ok(abs(offset - 100.0)) < 0.01
+
+    @test("test_time_offset_local")
+    def test_local(self):
+        ok(ssh_utils.get_time_offset(ssh_utils.Local())) == (0.0, 0.0)
+
+    @test("test_time_offset_bad_output")
+    def test_bad_output(self):
+        ssh_utils.run_over_ssh = lambda conn, cmd, nolog=False, node=None: "date: error"
+        with self.assertRaises(OSError):
+            ssh_utils.get_time_offset(object())
+
+
+class FakeConn(object):
+    "ssh connection, which only tracks its state"
+    def __init__(self, host="10.0.0.1", alive=True):
+        self.wally_creds = ssh_utils.parse_ssh_uri("root@{0}".format(host))
+        self.wally_lock = threading.Lock()
+        self.wally_stats = ssh_utils.ConnStats()
+        self.alive = alive
+        self.responds = True
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+        self.alive = False
+
+
+class FakeAgent(object):
+    def __init__(self, node):
+        self.node = node
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionRestoreTest(unittest.TestCase):
+    def setUp(self):
+        self.orig = dict((name, getattr(ssh_utils, name))
+                         for name in ('ssh_connect', 'deploy_agent', 'is_alive',
+                                      'probe_connection', 'ensure_connected'))
+        self.connected = []
+        self.probes = []
+
+        def ssh_connect(creds, reuse_conn=None, **params):
+            self.connected.append((creds.host, params))
+            reuse_conn.alive = True
+            return reuse_conn
+
+        def probe_connection(conn, timeout=30):
+            self.probes.append(conn)
+            return conn.alive and conn.responds
+
+        ssh_utils.ssh_connect = ssh_connect
+        ssh_utils.is_alive = lambda conn: conn.alive
+        ssh_utils.probe_connection = probe_connection
+
+    def tearDown(self):
+        for name, func in self.orig.items():
+            setattr(ssh_utils, name, func)
+
+    @test("test_restore_connection")
+    def test_restore(self):
+        conn = FakeConn()
+        ssh_utils.restore_connection(conn, conn.wally_creds, conn_timeout=5)
+        ok(self.connected) == [("10.0.0.1", {'conn_timeout': 5})]
+        ok(conn.wally_stats.reconnects) == 1
+
+    @test("test_restore_connection_agent")
+    def test_restore_agent(self):
+        deployed = []
+        ssh_utils.deploy_agent = lambda conn, node=None: deployed.append(node)
+
+        conn = FakeConn()
+        agent = conn.wally_agent = FakeAgent("node-1")
+        ssh_utils.restore_connection(conn, conn.wally_creds)
+
+        # old agent channel is dead, new agent is started for the same node
+        ok(agent.closed) == True
+        ok(conn.wally_agent) == None
+        ok(deployed) == ["node-1"]
+
+    @test("test_restore_connection_agent_fails")
+    def test_restore_agent_fails(self):
+        def deploy_agent(conn, node=None):
+            raise OSError("no python")
+        ssh_utils.deploy_agent = deploy_agent
+
+        conn = FakeConn()
+        conn.wally_agent = FakeAgent("node-1")
+
+        # connection is usable without agent
+        ok(ssh_utils.restore_connection(conn, conn.wally_creds)).is_(conn)
+        ok(conn.wally_agent) == None
+
+    @test("test_ensure_connected")
+    def test_ensure_connected(self):
+        conn = FakeConn()
+        ok(ssh_utils.ensure_connected(conn)) == True
+        ok(self.connected) == []
+
+        conn.alive = False
+        ok(ssh_utils.ensure_connected(conn)) == True
+        ok(self.connected) == [("10.0.0.1", {'conn_timeout': 30})]
+
+        # local and foreign connections are never touched
+        ok(ssh_utils.ensure_connected(ssh_utils.Local())) == True
+        ok(ssh_utils.ensure_connected(object())) == True
+
+    @test("test_ensure_connected_probe")
+    def test_ensure_connected_probe(self):
+        conn = FakeConn()
+        ok(ssh_utils.ensure_connected(conn, probe=True)) == True
+        ok(self.probes) == [conn]
+        ok(conn.closed) == False
+        ok(self.connected) == []
+
+        # transport is open, but node doesn't respond
+        conn.responds = False
+        ok(ssh_utils.ensure_connected(conn, probe=True)) == True
+        ok(conn.closed) == True
+        ok(self.connected) == [("10.0.0.1", {'conn_timeout': 30})]
+
+    @test("test_ensure_connected_busy")
+    def test_ensure_connected_busy(self):
+        conn = FakeConn()
+        ssh_utils.mark_busy(conn)
+        try:
+            # loaded node isn't probed
+            ok(ssh_utils.ensure_connected(conn, probe=True)) == True
+            ok(self.probes) == []
+
+            # but dead transport is restored
+            conn.alive = False
+            ok(ssh_utils.ensure_connected(conn, probe=True)) == True
+            ok(len(self.connected)) == 1
+        finally:
+            ssh_utils.mark_idle(conn)
+
+    @test("test_ensure_connected_fails")
+    def test_ensure_connected_fails(self):
+        def ssh_connect(creds, reuse_conn=None, **params):
+            raise OSError("no route to host")
+        ssh_utils.ssh_connect = ssh_connect
+        ok(ssh_utils.ensure_connected(FakeConn(alive=False))) == False
+
+    @test("test_busy_marks")
+    def test_busy_marks(self):
+        conn = FakeConn()
+        ok(ssh_utils.is_busy(conn)) == False
+        ssh_utils.mark_busy(conn)
+        ssh_utils.mark_busy(conn)
+        ssh_utils.mark_idle(conn)
+        ok(ssh_utils.is_busy(conn)) == True
+        ssh_utils.mark_idle(conn)
+        ok(ssh_utils.is_busy(conn)) == False
+
+        # extra mark_idle don't break counter
+        ssh_utils.mark_idle(conn)
+        ok(ssh_utils.is_busy(conn)) == False
+
+    @test("test_monitor_failures")
+    def test_monitor_failures(self):
+        restored = []
+        ssh_utils.ensure_connected = lambda conn, probe=False: restored.append(conn)
+
+        conn = FakeConn(alive=False)
+        monitor = ssh_utils.ConnectionsMonitor([conn], max_failures=3)
+        monitor.check(conn)
+        monitor.check(conn)
+        ok(restored) == []
+        ok(monitor.failures) == {id(conn): 2}
+
+        monitor.check(conn)
+        ok(restored) == [conn]
+        ok(monitor.failures) == {}
+
+    @test("test_monitor_failures_reset")
+    def test_monitor_failures_reset(self):
+        ssh_utils.ensure_connected = lambda conn, probe=False: None
+
+        conn = FakeConn(alive=False)
+        monitor = ssh_utils.ConnectionsMonitor([conn], max_failures=3)
+        monitor.check(conn)
+
+        # successful probe resets counter, busy connection isn't probed
+        conn.alive = True
+        monitor.check(conn)
+        ok(monitor.failures) == {}
+
+        conn.alive = False
+        ssh_utils.mark_busy(conn)
+        try:
+            monitor.check(conn)
+        finally:
+            ssh_utils.mark_idle(conn)
+        ok(monitor.failures) == {}
+        ok(self.probes) == [conn, conn]
+
+
+class MonitoringPauseTest(unittest.TestCase):
+    @test("test_pause_monitoring")
+    def test_pause(self):
+        ok(ssh_utils.is_monitoring_paused()) == False
+        with ssh_utils.pause_monitoring():
+            with ssh_utils.pause_monitoring():
+                ok(ssh_utils.is_monitoring_paused()) == True
+            # nested pause don't resume monitoring
+            ok(ssh_utils.is_monitoring_paused()) == True
+        ok(ssh_utils.is_monitoring_paused()) == False
+
+    @test("test_pause_monitoring_exception")
+    def test_pause_exception(self):
+        with self.assertRaises(ValueError):
+            with ssh_utils.pause_monitoring():
+                raise ValueError()
+        ok(ssh_utils.is_monitoring_paused()) == False
+
+
+class JumpConn(object):
+    "connection to jump host, which is also its transport"
+    def __init__(self, uri):
+        self.uri = uri
+        self.alive = True
+        self.channels = []
+
+    def get_transport(self):
+        return self
+
+    def open_channel(self, kind, dest_addr, src_addr):
+        self.channels.append((kind, dest_addr))
+        return "channel"
+
+    def close(self):
+        self.alive = False
+
+
+class JumpHostTest(unittest.TestCase):
+    def setUp(self):
+        self.orig_connect = ssh_utils.connect
+        self.orig_is_alive = ssh_utils.is_alive
+        ssh_utils.connect = JumpConn
+        ssh_utils.is_alive = lambda conn: conn.alive
+
+    def tearDown(self):
+        ssh_utils.connect = self.orig_connect
+        ssh_utils.is_alive = self.orig_is_alive
+
+    @test("test_jump_host_pool")
+    def test_pool(self):
+        jump_host = ssh_utils.JumpHost("root@fuel", pool_size=2)
+        conns = [jump_host.get_conn() for _ in range(6)]
+
+        # pool is filled first, then connections are used round robin
+        ok(len(jump_host.conns)) == 2
+        ok(conns[0]).is_not(conns[1])
+        for conn in conns[2:]:
+            ok(conn in jump_host.conns) == True
+        ok(conns[2:]) == [conns[1], conns[0], conns[1], conns[0]]
+        ok(conns[0].uri) == "root@fuel"
+
+    @test("test_jump_host_first_conn")
+    def test_first_conn(self):
+        first = JumpConn("root@fuel")
+        jump_host = ssh_utils.JumpHost("root@fuel", pool_size=1, first_conn=first)
+        ok(jump_host.get_conn()).is_(first)
+        ok(jump_host.get_conn()).is_(first)
+
+    @test("test_jump_host_dead_conn")
+    def test_dead_conn(self):
+        jump_host = ssh_utils.JumpHost("root@fuel", pool_size=2)
+        conn1 = jump_host.get_conn()
+        conn2 = jump_host.get_conn()
+
+        # dead connections are dropped and replaced by new ones
+        conn1.alive = False
+        conn3 = jump_host.get_conn()
+        ok(jump_host.conns) == [conn2, conn3]
+        ok(conn3).is_not(conn1)
+
+    @test("test_jump_host_channel")
+    def test_channel(self):
+        jump_host = ssh_utils.JumpHost("root@fuel", pool_size=2)
+        for _ in range(4):
+            ok(jump_host.open_channel("10.20.0.3", 22)) == "channel"
+
+        # channels are spread over pool
+        for conn in jump_host.conns:
+            ok(conn.channels) == [('direct-tcpip', ("10.20.0.3", 22))] * 2
+
+        conns = list(jump_host.conns)
+        jump_host.close()
+        ok(jump_host.conns) == []
+        ok([conn.alive for conn in conns]) == [False, False]
+
+
+class ShellSession(object):
+    "paramiko channel subset, command is executed by local shell"
+    def __init__(self):
+        self.proc = None
+
+    def settimeout(self, timeout):
+        pass
+
+    def exec_command(self, cmd):
+        self.proc = subprocess.Popen(cmd, shell=True, executable="/bin/bash",
+                                     stdin=subprocess.PIPE,
+                                     stdout=subprocess.PIPE,
+                                     stderr=subprocess.PIPE)
+
+    def shutdown_write(self):
+        self.proc.stdin.close()
+
+    def makefile(self, mode):
+        return self.proc.stdout
+
+    def recv_exit_status(self):
+        return self.proc.wait()
+
+    def recv_stderr_ready(self):
+        return True
+
+    def recv_stderr(self, size):
+        return self.proc.stderr.read(size)
+
+    def close(self):
+        if self.proc.poll() is None:
+            self.proc.kill()
+            self.proc.wait()
+
+
+class ShellConn(object):
+    def get_transport(self):
+        return self
+
+    def open_session(self):
+        return ShellSession()
+
+
+class FilesStreamTest(unittest.TestCase):
+    def setUp(self):
+        self.remote = tempfile.mkdtemp()
+        self.local = tempfile.mkdtemp()
+        self.data = {"a.json": "{}\n",
+                     "b_lat.1.log": os.urandom(3 * 1024 * 1024 + 17),
+                     "empty.log": ""}
+        for name, data in self.data.items():
+            with open(os.path.join(self.remote, name), "wb") as fd:
+                fd.write(data)
+
+    def tearDown(self):
+        shutil.rmtree(self.remote)
+        shutil.rmtree(self.local)
+
+    def get_files(self, names, conn=None, compress=False):
+        files = dict((name, os.path.join(self.local, "res_" + name)) for name in names)
+        ssh_utils.get_files_stream(conn or ShellConn(), self.remote, files,
+                                   compress=compress)
+        return dict((name, open(path, "rb").read()) for name, path in files.items())
+
+    @test("test_get_files_stream")
+    def test_stream(self):
+        ok(self.get_files(self.data)) == self.data
+        # nothing is left on node
+        ok(sorted(os.listdir(self.remote))) == sorted(self.data)
+
+    @test("test_get_files_stream_compressed")
+    def test_compressed(self):
+        ok(self.get_files(self.data, compress=True)) == self.data
+
+    @test("test_get_files_stream_subset")
+    def test_subset(self):
+        ok(self.get_files(["a.json"])) == {"a.json": "{}\n"}
+        ok(os.listdir(self.local)) == ["res_a.json"]
+
+    @test("test_get_files_stream_local")
+    def test_local(self):
+        ok(self.get_files(self.data, conn=ssh_utils.Local())) == self.data
+
+    @test("test_get_files_stream_missing")
+    def test_missing(self):
+        with self.assertRaises(OSError):
+            self.get_files(["a.json", "missing.log"])
+
+        with self.assertRaises(OSError):
+            self.get_files(["missing.log"], compress=True)
+
+    @test("test_get_files_stream_not_a_file")
+    def test_not_a_file(self):
+        os.mkdir(os.path.join(self.remote, "subdir"))
+        with self.assertRaises(IOError):
+            self.get_files(["subdir"])
+
+
+if __name__ == '__main__':
+    main()
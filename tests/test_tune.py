@@ -0,0 +1,158 @@
+import unittest
+
+
+from oktest import ok, main, test
+
+
+from wally.suits.io import tune
+from wally.suits.io.fio_task_parser import FioJobSection
+
+
+class FakeNode(object):
+    def __init__(self, conn_id):
+        self.conn_id = conn_id
+
+    def get_conn_id(self):
+        return self.conn_id
+
+
+class FakeSSH(object):
+    "records commands, fails all commands if failed is set"
+    def __init__(self, out="", failed=False):
+        self.out = out
+        self.failed = failed
+        self.cmds = []
+
+    def __call__(self, cmd, nolog=False):
+        self.cmds.append(cmd)
+        if self.failed:
+            raise OSError("failed")
+        return self.out
+
+
+def make_section(rw, blocksize, **vals):
+    sec = FioJobSection("sec")
+    sec.vals['rw'] = rw
+    sec.vals['blocksize'] = blocksize
+    sec.vals.update(vals)
+    return sec
+
+
+class TunablesTest(unittest.TestCase):
+    @test("test_tune_read_tunables")
+    def test_read_tunables(self):
+        out = "vdb scheduler noop [deadline] cfq\n" + \
+              "vdb nr_requests 128\n" + \
+              "vdc scheduler none\n" + \
+              "vdc read_ahead_kb 4096\n\n"
+        rossh = FakeSSH(out)
+        res = tune.read_tunables(rossh, ['vdb', 'vdc'], ['scheduler', 'nr_requests'])
+
+        # scheduler without selected value is skipped
+        ok(res) == {'vdb': {'scheduler': 'deadline', 'nr_requests': '128'},
+                    'vdc': {'read_ahead_kb': '4096'}}
+        ok("vdb vdc" in rossh.cmds[0]) == True
+
+    @test("test_tune_write_tunables")
+    def test_write_tunables(self):
+        rossh = FakeSSH()
+        tune.write_tunables(rossh, {'vdb': {'nr_requests': '256', 'scheduler': 'noop',
+                                            'zzz': '1'}},
+                            use_sudo=False)
+
+        cmds = rossh.cmds[0].split(" && ")
+        # scheduler change resets nr_requests, unknown params go last
+        ok(cmds) == ["echo noop | tee /sys/block/vdb/queue/scheduler >/dev/null",
+                     "echo 256 | tee /sys/block/vdb/queue/nr_requests >/dev/null",
+                     "echo 1 | tee /sys/block/vdb/queue/zzz >/dev/null"]
+
+    @test("test_tune_write_nothing")
+    def test_write_nothing(self):
+        rossh = FakeSSH()
+        tune.write_tunables(rossh, {})
+        ok(rossh.cmds) == []
+
+    @test("test_tune_workload_class")
+    def test_workload_class(self):
+        ok(tune.get_workload_class(make_section('randwrite', '4k', direct='1', numjobs=16))) \
+            == 'rwd4k'
+        ok(tune.get_workload_class(make_section('read', '1m', sync='1'))) == 'srs1m'
+        # threads count doesn't change class
+        ok(tune.get_workload_class(make_section('randread', '4k', numjobs=1))) == \
+            tune.get_workload_class(make_section('randread', '4k', numjobs=64))
+
+
+class IOTuneTestTest(unittest.TestCase):
+    def make_test(self):
+        test_obj = tune.IOTuneTest.__new__(tune.IOTuneTest)
+        test_obj.fio_configs = [make_section('randread', '4k', direct='1', numjobs=1),
+                                make_section('randread', '4k', direct='1', numjobs=16),
+                                make_section('write', '1m', direct='1')]
+        test_obj.use_sudo = False
+        return test_obj
+
+    @test("test_tune_gains")
+    def test_gains(self):
+        test_obj = self.make_test()
+        baseline = {'bw': {0: 100, 1: 400, 2: 1000}}
+        record = {'bw': {0: 200, 1: 800, 2: 500}}
+
+        gains = test_obj.get_gains(record, baseline)
+        ok(sorted(gains)) == ['rrd4k', 'swd1m']
+        ok(abs(gains['rrd4k'] - 2.0)) < 1E-9
+        ok(abs(gains['swd1m'] - 0.5)) < 1E-9
+
+    @test("test_tune_gains_pruned")
+    def test_gains_pruned(self):
+        # pruned candidate has no results for part of rrd4k tests
+        test_obj = self.make_test()
+        baseline = {'bw': {0: 100, 1: 400, 2: 1000}}
+        record = {'bw': {0: 200, 2: 1100}}
+
+        gains = test_obj.get_gains(record, baseline)
+        ok(sorted(gains)) == ['swd1m']
+        ok(abs(gains['swd1m'] - 1.1)) < 1E-9
+
+    @test("test_tune_apply_rollback")
+    def test_apply_rollback(self):
+        test_obj = self.make_test()
+        node1, node2 = FakeNode("n1"), FakeNode("n2")
+        conns = {node1: FakeSSH(), node2: FakeSSH(failed=True)}
+        test_obj.original = {node1: {'vdb': {'scheduler': 'cfq', 'nr_requests': '128'}},
+                             node2: {'vdc': {'scheduler': 'cfq'}}}
+
+        orig_run_on_node = tune.run_on_node
+        tune.run_on_node = conns.get
+        try:
+            ok(test_obj.apply({'scheduler': 'noop'})) == False
+        finally:
+            tune.run_on_node = orig_run_on_node
+
+        # candidate is applied and then original settings are restored
+        ok(len(conns[node1].cmds)) == 2
+        ok("echo noop |" in conns[node1].cmds[0]) == True
+        ok("echo cfq |" in conns[node1].cmds[1]) == True
+        ok("echo 128 |" in conns[node1].cmds[1]) == True
+        ok(len(conns[node2].cmds)) == 2
+
+    @test("test_tune_apply")
+    def test_apply(self):
+        test_obj = self.make_test()
+        node = FakeNode("n1")
+        conn = FakeSSH()
+        test_obj.original = {node: {'vdb': {'scheduler': 'cfq', 'nr_requests': '128'}}}
+
+        orig_run_on_node = tune.run_on_node
+        tune.run_on_node = lambda _: conn
+        try:
+            ok(test_obj.apply({'nr_requests': '32', 'read_ahead_kb': '0'})) == True
+        finally:
+            tune.run_on_node = orig_run_on_node
+
+        # params, unsupported by device, aren't set, others are kept original
+        ok(conn.cmds) == ["echo cfq | tee /sys/block/vdb/queue/scheduler >/dev/null && " +
+                          "echo 32 | tee /sys/block/vdb/queue/nr_requests >/dev/null"]
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+import time
+import threading
+import unittest
+
+
+from oktest import ok, main, test
+
+
+from wally import utils
+
+
+class FanOutTest(unittest.TestCase):
+    @test("test_fan_out_order")
+    def test_order(self):
+        # later items finish first, results still are in items order
+        def func(idx):
+            time.sleep(0.01 * (10 - idx))
+            return idx * 2
+
+        ok(utils.fan_out(func, range(10), max_parallel=10)) == [idx * 2 for idx in range(10)]
+
+    @test("test_fan_out_empty")
+    def test_empty(self):
+        ok(utils.fan_out(lambda x: x, [])) == []
+
+    @test("test_fan_out_max_parallel")
+    def test_max_parallel(self):
+        lock = threading.Lock()
+        state = {'curr': 0, 'max': 0}
+
+        def func(_):
+            with lock:
+                state['curr'] += 1
+                state['max'] = max(state['max'], state['curr'])
+            time.sleep(0.02)
+            with lock:
+                state['curr'] -= 1
+
+        utils.fan_out(func, range(20), max_parallel=3)
+        ok(state['max']) <= 3
+        ok(state['max']) > 1
+
+    @test("test_fan_out_error")
+    def test_error(self):
+        called = []
+
+        def func(idx):
+            called.append(idx)
+            if idx == 1:
+                raise ValueError("failed {0}".format(idx))
+            return idx
+
+        with self.assertRaises(ValueError):
+            utils.fan_out(func, range(5), max_parallel=2)
+
+        # error doesn't cancel other calls
+        ok(sorted(called)) == range(5)
+
+    @test("test_fan_out_return_exceptions")
+    def test_return_exceptions(self):
+        def func(idx):
+            if idx % 2:
+                raise ValueError(str(idx))
+            return idx
+
+        res = utils.fan_out(func, range(4), return_exceptions=True)
+        ok(res[0]) == 0
+        ok(res[2]) == 2
+        ok(res[1]).is_a(ValueError)
+        ok(res[3]).is_a(ValueError)
+
+    @test("test_fan_out_timeout")
+    def test_timeout(self):
+        def func(tout):
+            time.sleep(tout)
+            return tout
+
+        begin = time.time()
+        res = utils.fan_out(func, [5, 0, 0, 0], max_parallel=1, timeout=1,
+                            return_exceptions=True)
+
+        ok(res[0]).is_a(utils.FanOutTimeout)
+        ok(res[1:]) == [0, 0, 0]
+        # hung call slot is given to next items
+        ok(time.time() - begin) < 4
+
+
+class ParseOSReleaseTest(unittest.TestCase):
+    @test("test_os_release_redhat")
+    def test_redhat(self):
+        data = 'NAME="CentOS Linux"\nID="centos"\nID_LIKE="rhel fedora"\n'
+        ok(utils.parse_os_release(data, 'x86_64')) == utils.os_release('redhat', None, 'x86_64')
+
+        data = 'ID=ol\nID_LIKE="fedora"\n'
+        ok(utils.parse_os_release(data, 'x86_64').distro) == 'redhat'
+
+    @test("test_os_release_ubuntu")
+    def test_ubuntu(self):
+        data = 'NAME="Ubuntu"\nVERSION="16.04.3 LTS (Xenial Xerus)"\nID=ubuntu\n' + \
+               'ID_LIKE=debian\nVERSION_CODENAME=xenial\nUBUNTU_CODENAME=xenial\n'
+        ok(utils.parse_os_release(data, 'x86_64')) == utils.os_release('ubuntu', 'xenial', 'x86_64')
+
+        # derivatives have own VERSION_CODENAME
+        data = 'ID=linuxmint\nID_LIKE=ubuntu\nUBUNTU_CODENAME=bionic\n'
+        ok(utils.parse_os_release(data, 'x86_64').release) == 'bionic'
+
+    @test("test_os_release_ubuntu_old")
+    def test_ubuntu_old(self):
+        data = 'NAME="Ubuntu"\nVERSION="14.04.5 LTS, Trusty Tahr"\nID=ubuntu\n'
+        ok(utils.parse_os_release(data, 'i686')) == utils.os_release('ubuntu', 'trusty', 'i686')
+
+        data = 'ID=debian\nVERSION="9"\n'
+        ok(utils.parse_os_release(data, 'x86_64')) == utils.os_release('ubuntu', None, 'x86_64')
+
+    @test("test_os_release_unknown")
+    def test_unknown(self):
+        ok(utils.parse_os_release('ID=arch\n', 'x86_64')) == None
+        ok(utils.parse_os_release('', 'x86_64')) == None
+
+
+if __name__ == '__main__':
+    main()
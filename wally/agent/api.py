@@ -0,0 +1,322 @@
+import os
+import io
+import json
+import base64
+import socket
+import struct
+import signal
+import tarfile
+import logging
+import threading
+
+import paramiko
+from concurrent.futures import Future, TimeoutError
+
+
+logger = logging.getLogger("wally.agent")
+
+
+AGENT_SOURCE = os.path.join(os.path.dirname(__file__), "server.py")
+
+
+class AgentConnection(object):
+    """
+    Client for node agent (wally/agent/server.py). All requests are
+    multiplexed over one long-lived ssh channel, any number of threads
+    can use single connection simultaneously.
+
+    conn:paramiko.SSHClient - connection to node
+    node:str - node id, for logging
+    exited:{int: int} - pid => exit code for processes,
+                        which was started by spawn and already finished
+    """
+    def __init__(self, conn, remote_path, node=None, python="python"):
+        self.node = node
+        self.channel = conn.get_transport().open_session()
+        self.channel.exec_command("{0} {1}".format(python, remote_path))
+
+        self.send_lock = threading.Lock()
+        self.pending_lock = threading.Lock()
+        self.pending = {}
+        self.next_id = 0
+        self.closed = False
+
+        self.exit_cond = threading.Condition()
+        self.exited = {}
+
+        self.reader = threading.Thread(target=self.read_loop,
+                                       name="agent-" + str(node))
+        self.reader.daemon = True
+        self.reader.start()
+
+    def recv_exact(self, size):
+        chunks = []
+        while size > 0:
+            chunk = self.channel.recv(min(size, 1024 * 1024))
+            if chunk == "":
+                return None
+            chunks.append(chunk)
+            size -= len(chunk)
+        return "".join(chunks)
+
+    def read_loop(self):
+        try:
+            while True:
+                header = self.recv_exact(4)
+                if header is None:
+                    break
+
+                data = self.recv_exact(struct.unpack("!I", header)[0])
+                if data is None:
+                    break
+
+                msg = json.loads(data)
+                if msg.get('event') == 'exit':
+                    with self.exit_cond:
+                        self.exited[msg['pid']] = msg['code']
+                        self.exit_cond.notify_all()
+                    continue
+
+                with self.pending_lock:
+                    future = self.pending.pop(msg['id'], None)
+
+                if future is not None:
+                    future.set_result(msg)
+        except (socket.error, paramiko.SSHException, EOFError) as exc:
+            logger.warning("Agent connection to {0} lost: {1!s}".format(self.node, exc))
+        finally:
+            self.closed = True
+
+            with self.pending_lock:
+                pending = self.pending.values()
+                self.pending = {}
+
+            for future in pending:
+                future.set_exception(
+                    paramiko.SSHException("Agent connection closed"))
+
+            with self.exit_cond:
+                self.exit_cond.notify_all()
+
+    def is_alive(self):
+        return not self.closed
+
+    def call_async(self, func, **params):
+        """
+        send request to node, returns Future, which would be
+        resolved to raw response message
+        """
+        if self.closed:
+            raise paramiko.SSHException("Agent connection closed")
+
+        future = Future()
+        with self.pending_lock:
+            req_id = self.next_id
+            self.next_id += 1
+            self.pending[req_id] = future
+
+        data = json.dumps({'id': req_id, 'func': func, 'params': params})
+
+        try:
+            with self.send_lock:
+                self.channel.sendall(struct.pack("!I", len(data)) + data)
+        except socket.error as exc:
+            with self.pending_lock:
+                self.pending.pop(req_id, None)
+            raise paramiko.SSHException(str(exc))
+
+        future.req_id = req_id
+        return future
+
+    def cancel(self, future):
+        "forget about request, response would be ignored"
+        with self.pending_lock:
+            self.pending.pop(future.req_id, None)
+
+    @classmethod
+    def get_result(cls, msg):
+        "extract result from response message or raise remote error"
+        if not msg['ok']:
+            if msg.get('errno') is not None:
+                raise IOError(msg['errno'], msg['error'])
+            raise OSError(msg['error'])
+        return msg['result']
+
+    def call(self, func, call_timeout=None, **params):
+        """
+        execute function on node and return result
+        raise IOError/OSError on remote error, paramiko.SSHException
+        if connection is lost
+        """
+        future = self.call_async(func, **params)
+
+        try:
+            msg = future.result(call_timeout)
+        except TimeoutError:
+            self.cancel(future)
+            raise OSError("Agent call {0} to {1} timeout".format(func, self.node))
+
+        return self.get_result(msg)
+
+    def run(self, cmd, timeout=60, stdin_data=None):
+        "returns (exit_code, output)"
+        if stdin_data is not None:
+            stdin_data = base64.b64encode(stdin_data)
+        res = self.call('run', call_timeout=timeout + 10, cmd=cmd,
+                        timeout=timeout, stdin_data=stdin_data)
+        return res['code'], base64.b64decode(res['out'])
+
+    def put(self, path, data, mode=None):
+        self.call('put', path=path, data=base64.b64encode(data), mode=mode)
+
+    def get(self, path):
+        return base64.b64decode(self.call('get', path=path))
+
+    def get_many(self, paths):
+        "read several files in one request, returns {path: data}"
+        res = self.call('get_many', paths=list(paths))
+        return dict((path, base64.b64decode(data)) for path, data in res.items())
+
+    def listdir(self, path):
+        return self.call('listdir', path=path)
+
+    def remove(self, paths, missing_ok=False):
+        "remove files, raise IOError for missing files, unless missing_ok is set"
+        self.call('remove', paths=list(paths), missing_ok=missing_ok)
+
+    def put_dir(self, localpath, remotepath):
+        "upload local directory in one request"
+        buff = io.BytesIO()
+        arch = tarfile.open(fileobj=buff, mode="w:gz")
+        try:
+            for name in os.listdir(localpath):
+                arch.add(os.path.join(localpath, name), name)
+        finally:
+            arch.close()
+        self.call('untar', path=remotepath, data=base64.b64encode(buff.getvalue()))
+
+    def spawn(self, cmd, out_file=None):
+        "start background process, returns pid"
+        return self.call('spawn', cmd=cmd, out_file=out_file)
+
+    def forget(self, pid):
+        "drop exit notification for finished process"
+        with self.exit_cond:
+            self.exited.pop(pid, None)
+
+    def is_running(self, pid):
+        with self.exit_cond:
+            if pid in self.exited:
+                return False
+        return self.call('proc_status', pid=pid)[0]
+
+    def wait_exit(self, pid, timeout):
+        """
+        wait for process exit notification, returns True if process
+        finished. Doesn't send any requests to node.
+        """
+        with self.exit_cond:
+            if pid not in self.exited and not self.closed:
+                self.exit_cond.wait(timeout)
+
+            if pid in self.exited:
+                return True
+
+            if self.closed:
+                raise paramiko.SSHException("Agent connection closed")
+
+        return False
+
+    def kill(self, pid, soft=True, use_sudo=False):
+        sig = signal.SIGTERM if soft else signal.SIGKILL
+        self.call('kill', pid=pid, sig=sig, use_sudo=use_sudo)
+
+    def close(self):
+        try:
+            self.channel.close()
+        except Exception:
+            pass
+
+
+class AgentFile(io.BytesIO):
+    "file, opened for writing over agent, content is send on close"
+    def __init__(self, agent, path):
+        io.BytesIO.__init__(self)
+        self.agent = agent
+        self.path = path
+
+    def close(self):
+        if not self.closed:
+            self.agent.put(self.path, self.getvalue())
+        io.BytesIO.close(self)
+
+
+class AgentStat(object):
+    def __init__(self, st):
+        self.st_mode = st['mode']
+        self.st_size = st['size']
+        self.st_mtime = st['mtime']
+
+
+class AgentSFTP(object):
+    "paramiko.SFTPClient subset, used by wally, on top of agent"
+    def __init__(self, agent):
+        self.agent = agent
+
+    def put(self, localfile, remfile):
+        with open(localfile, "rb") as fd:
+            self.agent.put(remfile, fd.read())
+
+    def get(self, remfile, localfile):
+        with open(localfile, "wb") as fd:
+            fd.write(self.agent.get(remfile))
+
+    def open(self, path, mode="r"):
+        if 'r' in mode:
+            return io.BytesIO(self.agent.get(path))
+        return AgentFile(self.agent, path)
+
+    def stat(self, path):
+        return AgentStat(self.agent.call('stat', path=path))
+
+    def mkdir(self, path, mode=0777):
+        self.agent.call('mkdir', path=path, mode=mode)
+
+    def chmod(self, path, mode):
+        self.agent.call('chmod', path=path, mode=mode)
+
+    def remove(self, path):
+        self.agent.remove([path])
+
+    def listdir(self, path="."):
+        return self.agent.listdir(path)
+
+    def copytree(self, src, dst):
+        self.agent.put_dir(src, dst)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, x, y, z):
+        return False
+
+
+def start_agent(conn, remote_path, node=None):
+    """
+    upload agent to node and start it
+    returns AgentConnection
+    """
+    sftp = conn.open_sftp()
+    try:
+        sftp.put(AGENT_SOURCE, remote_path)
+    finally:
+        sftp.close()
+
+    agent = AgentConnection(conn, remote_path, node=node)
+
+    # check that agent is alive
+    agent.call('ping', call_timeout=30)
+    return agent
@@ -0,0 +1,246 @@
+"""
+wally node agent. Started by controller over ssh once per node,
+serves requests from stdin and sends responses to stdout.
+
+Each message is 4 bytes big-endian length followed by json.
+Request - {"id": int, "func": str, "params": dict}
+Response - {"id": int, "ok": true, "result": any} or
+           {"id": int, "ok": false, "error": str, "errno": int}
+Event - {"id": null, "event": "exit", "pid": int, "code": int}
+
+Requests are processed in separated threads, so long running calls
+(run, wait) don't block other calls. Binary data is base64 encoded.
+"""
+import os
+import io
+import sys
+import time
+import json
+import errno
+import base64
+import struct
+import signal
+import tarfile
+import threading
+import traceback
+import subprocess
+
+
+stdin = getattr(sys.stdin, 'buffer', sys.stdin)
+stdout = getattr(sys.stdout, 'buffer', sys.stdout)
+write_lock = threading.Lock()
+
+children = {}
+children_lock = threading.Lock()
+
+
+def send(msg):
+    data = json.dumps(msg).encode('utf8')
+    with write_lock:
+        stdout.write(struct.pack("!I", len(data)) + data)
+        stdout.flush()
+
+
+def read_exact(size):
+    res = b""
+    while len(res) < size:
+        chunk = stdin.read(size - len(res))
+        if not chunk:
+            return None
+        res += chunk
+    return res
+
+
+def b64(data):
+    return base64.b64encode(data).decode('ascii')
+
+
+def rpc_ping():
+    return os.getpid()
+
+
+def rpc_time():
+    return time.time()
+
+
+def kill_group(pid):
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+def rpc_run(cmd, timeout=60, stdin_data=None):
+    # own process group - children should not keep stdout open after timeout
+    proc = subprocess.Popen(cmd, shell=True,
+                            stdin=subprocess.PIPE,
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT,
+                            preexec_fn=os.setsid)
+    timer = threading.Timer(timeout, kill_group, args=(proc.pid,))
+    timer.start()
+    try:
+        if stdin_data is not None:
+            stdin_data = base64.b64decode(stdin_data)
+        out, _ = proc.communicate(stdin_data)
+    finally:
+        timer.cancel()
+
+    return {'code': proc.returncode, 'out': b64(out)}
+
+
+def rpc_put(path, data, mode=None):
+    with open(path, "wb") as fd:
+        fd.write(base64.b64decode(data))
+    if mode is not None:
+        os.chmod(path, mode)
+
+
+def rpc_get(path):
+    with open(path, "rb") as fd:
+        return b64(fd.read())
+
+
+def rpc_get_many(paths):
+    "returns {path: data}, unreadable files are skipped"
+    res = {}
+    for path in paths:
+        try:
+            res[path] = rpc_get(path)
+        except (IOError, OSError):
+            pass
+    return res
+
+
+def rpc_listdir(path):
+    return os.listdir(path)
+
+
+def rpc_stat(path):
+    st = os.stat(path)
+    return {'mode': st.st_mode, 'size': st.st_size, 'mtime': st.st_mtime}
+
+
+def rpc_mkdir(path, mode=0o777, parents=False):
+    if parents:
+        if not os.path.isdir(path):
+            os.makedirs(path, mode)
+    else:
+        os.mkdir(path, mode)
+
+
+def rpc_chmod(path, mode):
+    os.chmod(path, mode)
+
+
+def rpc_remove(paths, missing_ok=False):
+    "remove files, missing files are errors, unless missing_ok is set"
+    for path in paths:
+        try:
+            os.unlink(path)
+        except OSError as exc:
+            if exc.errno != errno.ENOENT or not missing_ok:
+                raise
+
+
+def rpc_untar(path, data):
+    "extract gzipped tar archive into path"
+    rpc_mkdir(path, parents=True)
+    arch = tarfile.open(fileobj=io.BytesIO(base64.b64decode(data)), mode="r:gz")
+    try:
+        arch.extractall(path)
+    finally:
+        arch.close()
+
+
+def watch_child(proc):
+    code = proc.wait()
+    send({'id': None, 'event': 'exit', 'pid': proc.pid, 'code': code})
+
+
+def rpc_spawn(cmd, out_file=None):
+    "start background process, 'exit' event would be send on finish"
+    devnull = open(os.devnull, "rb")
+    out = open(out_file or os.devnull, "wb")
+    try:
+        # own process group - to be able to kill all process subtree
+        proc = subprocess.Popen(cmd, shell=True,
+                                stdin=devnull,
+                                stdout=out,
+                                stderr=subprocess.STDOUT,
+                                preexec_fn=os.setsid)
+    finally:
+        devnull.close()
+        out.close()
+
+    with children_lock:
+        children[proc.pid] = proc
+
+    th = threading.Thread(target=watch_child, args=(proc,))
+    th.daemon = True
+    th.start()
+    return proc.pid
+
+
+def rpc_proc_status(pid):
+    "returns [running, exit_code]"
+    with children_lock:
+        proc = children.get(pid)
+
+    if proc is not None:
+        code = proc.poll()
+        return [code is None, code]
+
+    # not our child, e.g. spawned by previous agent instance
+    return [os.path.exists("/proc/{0}".format(pid)), None]
+
+
+def rpc_kill(pid, sig=signal.SIGTERM, use_sudo=False):
+    "kill process group, started by spawn"
+    if use_sudo:
+        subprocess.call("sudo kill -{0} -- -{1} ; sudo kill -{0} {1}".format(sig, pid),
+                        shell=True)
+        return
+
+    for func, arg in ((os.killpg, pid), (os.kill, pid)):
+        try:
+            func(arg, sig)
+        except OSError as exc:
+            if exc.errno != errno.ESRCH:
+                raise
+
+
+def process_request(msg):
+    try:
+        func = globals()["rpc_" + msg['func']]
+        res = {'id': msg['id'], 'ok': True,
+               'result': func(**msg.get('params', {}))}
+    except Exception as exc:
+        res = {'id': msg['id'], 'ok': False,
+               'error': "{0}: {1}".format(type(exc).__name__, exc),
+               'errno': getattr(exc, 'errno', None),
+               'traceback': traceback.format_exc()}
+    send(res)
+
+
+def main(argv):
+    while True:
+        header = read_exact(4)
+        if header is None:
+            break
+
+        data = read_exact(struct.unpack("!I", header)[0])
+        if data is None:
+            break
+
+        msg = json.loads(data.decode('utf8'))
+        th = threading.Thread(target=process_request, args=(msg,))
+        th.daemon = True
+        th.start()
+
+    # controller disconnected, spawned processes are left running
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,309 @@
+"""
+Content addressed artifacts. Deployable files (fio binaries, sensors,
+tests scripts) are packed into bundles, identified by content hash.
+Bundle is unpacked on node into ARTIFACTS_DIR/<hash> only once and
+reused by all following deploys, including deploys from next runs.
+Nodes may download bundle from other nodes, instead of controller.
+"""
+import os
+import io
+import bz2
+import hashlib
+import logging
+import tarfile
+import threading
+
+from wally.utils import fan_out, FAN_OUT_LIMIT
+from wally.ssh_utils import run_over_ssh, Local
+
+
+logger = logging.getLogger("wally.artifacts")
+
+
+ARTIFACTS_DIR = "/tmp/wally_artifacts"
+PEER_PORT = 8902
+
+# nodes, which get bundle from controller, rest of nodes download
+# it from them. 0 - all nodes get bundles from controller
+peer_settings = {'seeds': 0, 'port': PEER_PORT}
+
+
+def set_peer_fan_out(seeds, port=PEER_PORT):
+    peer_settings['seeds'] = seeds
+    peer_settings['port'] = port
+
+
+class Bundle(object):
+    """
+    Set of files, deployed to nodes as one archive
+
+    name:str - bundle name, for logging
+    files:[(str, str, int, bool)] - (path in bundle, local path,
+                                     mode, decompress bz2 file)
+    """
+    def __init__(self, name):
+        self.name = name
+        self.files = []
+        self.lock = threading.Lock()
+        self._archive = None
+        self._digest = None
+
+    def add_file(self, arcname, path, mode=None, decompress=False):
+        if mode is None:
+            mode = os.stat(path).st_mode & 0777
+        self.files.append((arcname, path, mode, decompress))
+        return self
+
+    def add_dir(self, path, prefix=""):
+        "add all files from local folder, except python bytecode"
+        for root, dirs, fls in os.walk(path):
+            dirs.sort()
+            for fname in sorted(fls):
+                if fname.endswith(('.pyc', '.pyo')):
+                    continue
+                fpath = os.path.join(root, fname)
+                self.add_file(os.path.join(prefix, os.path.relpath(fpath, path)), fpath)
+        return self
+
+    def build(self):
+        with self.lock:
+            if self._archive is not None:
+                return
+
+            digest = hashlib.sha1()
+            buff = io.BytesIO()
+            arch = tarfile.open(fileobj=buff, mode="w:gz")
+            try:
+                for arcname, path, mode, decompress in sorted(self.files):
+                    with open(path, "rb") as fd:
+                        data = fd.read()
+
+                    if decompress:
+                        data = bz2.decompress(data)
+
+                    digest.update("{0}\0{1:o}\0{2}\0".format(arcname, mode, len(data)))
+                    digest.update(data)
+
+                    info = tarfile.TarInfo(arcname)
+                    info.size = len(data)
+                    info.mode = mode
+                    info.type = tarfile.REGTYPE
+                    arch.addfile(info, io.BytesIO(data))
+            finally:
+                arch.close()
+
+            self._digest = digest.hexdigest()
+            self._archive = buff.getvalue()
+
+    @property
+    def digest(self):
+        self.build()
+        return self._digest
+
+    @property
+    def archive(self):
+        self.build()
+        return self._archive
+
+    @property
+    def remote_path(self):
+        return os.path.join(ARTIFACTS_DIR, self.digest)
+
+    def __str__(self):
+        return "{0}({1})".format(self.name, self.digest[:8])
+
+
+def dir_bundle(name, path):
+    return Bundle(name).add_dir(path)
+
+
+INSTALL_CMD = "if [ -f {path}.ok ] ; then mkdir -p {dst} && cp -rp {path}/. {dst}/ && " + \
+              "echo INSTALLED ; fi"
+
+UNPACK_CMD = "mkdir -p {dir} && mv {arch}.$$ {arch} && " + \
+             "tmp=$(mktemp -d {dir}/unpack.XXXXXX) && tar xzf {arch} -C $tmp && " + \
+             "chmod 755 $tmp && ( mv -T $tmp {path} 2>/dev/null || rm -rf $tmp ) && " + \
+             "touch {path}.ok"
+
+UPLOAD_CMD = "mkdir -p {dir} && cat > {arch}.$$ && " + UNPACK_CMD
+
+FETCH_CMD = "mkdir -p {dir} && ( curl -sf --max-time 300 {url} || wget -q -T 60 -O - {url} ) " + \
+            "> {arch}.$$ && " + UNPACK_CMD
+
+# serves only one bundle archive and only on address, used by peers.
+# pid file is written after socket is bound, so its presence means
+# server is ready. Works with python 2 and 3, as nodes may have any
+PEER_SERVER_SCRIPT = """
+import os
+import sys
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+
+
+ip, port, path, pid_file = sys.argv[1], int(sys.argv[2]), sys.argv[3], sys.argv[4]
+url_path = "/" + os.path.basename(path)
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != url_path:
+            self.send_error(404)
+            return
+
+        with open(path, "rb") as fd:
+            data = fd.read()
+
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+server = Server((ip, port), Handler)
+with open(pid_file, "w") as fd:
+    fd.write(str(os.getpid()))
+server.serve_forever()
+"""
+
+SERVE_CMD = "if which python3 >/dev/null 2>&1 ; then P=python3 ; else P=python ; fi ; " + \
+            "mkdir -p {dir} && cat > {dir}/peer_server.py && rm -f {pid_file} && " + \
+            "( nohup timeout {timeout} $P {dir}/peer_server.py {ip} {port} {arch} {pid_file} " + \
+            ">/dev/null 2>&1 </dev/null & ) ; " + \
+            "for i in 1 2 3 4 5 6 7 8 9 10 ; do [ -f {pid_file} ] && exit 0 ; sleep 0.5 ; done ; " + \
+            "exit 1"
+
+STOP_SERVE_CMD = "if [ -f {pid_file} ] ; then kill $(cat {pid_file}) ; rm -f {pid_file} ; fi ; true"
+
+
+def get_cmd_params(bundle, **params):
+    params['dir'] = ARTIFACTS_DIR
+    params['path'] = bundle.remote_path
+    params['arch'] = bundle.remote_path + ".tar.gz"
+    return params
+
+
+def install(conn, bundle, dst, node=None):
+    """
+    copy bundle content into dst folder on node, if bundle is
+    already unpacked there. Returns False if bundle should be uploaded
+    """
+    cmd = INSTALL_CMD.format(**get_cmd_params(bundle, dst=dst))
+    return "INSTALLED" in run_over_ssh(conn, cmd, node=node, nolog=True)
+
+
+def upload(conn, bundle, node=None):
+    logger.debug("Uploading {0} to {1}".format(bundle, node))
+    cmd = UPLOAD_CMD.format(**get_cmd_params(bundle))
+    run_over_ssh(conn, cmd, stdin_data=bundle.archive, node=node, nolog=True)
+
+
+def deploy(conn, bundle, dst, node=None):
+    """
+    copy bundle content into dst folder on node, bundle is
+    uploaded only if node doesn't have it yet
+    """
+    if not install(conn, bundle, dst, node):
+        upload(conn, bundle, node)
+        if not install(conn, bundle, dst, node):
+            raise OSError("Bundle {0} is not found on {1} after upload".format(bundle, node))
+
+
+def fetch_from_peer(conn, bundle, dst, peer_ip, port, node=None):
+    url = "http://{0}:{1}/{2}.tar.gz".format(peer_ip, port, bundle.digest)
+    cmd = FETCH_CMD.format(**get_cmd_params(bundle, url=url))
+    run_over_ssh(conn, cmd, node=node, timeout=360, nolog=True)
+    if not install(conn, bundle, dst, node):
+        raise OSError("Bundle {0} is not found on {1} after fetch".format(bundle, node))
+
+
+def deploy_many(targets, bundle, dst, max_parallel=FAN_OUT_LIMIT, timeout=600):
+    """
+    deploy bundle to many nodes. If peer fan-out is enabled, only
+    seed nodes get bundle from controller, they serve it over http
+    to other nodes. Nodes, which failed to download bundle from
+    peer, get it from controller.
+
+    targets:[(conn, str, str)] - (connection, node ip, node id)
+    """
+    bundle.build()
+
+    def install_func(target):
+        conn, _, node = target
+        return install(conn, bundle, dst, node)
+
+    installed = fan_out(install_func, targets, max_parallel, timeout=timeout)
+    missing = [target for target, done in zip(targets, installed) if not done]
+
+    if len(missing) == 0:
+        return
+
+    def deploy_func(target):
+        conn, _, node = target
+        deploy(conn, bundle, dst, node)
+
+    seeds_count = peer_settings['seeds']
+    peers = [target for target in missing if not isinstance(target[0], Local)]
+
+    if seeds_count == 0 or len(peers) <= seeds_count:
+        fan_out(deploy_func, missing, max_parallel, timeout=timeout)
+        return
+
+    seeds = peers[:seeds_count]
+    rest = [target for target in missing if target not in seeds]
+    port = peer_settings['port']
+
+    logger.debug("Deploying {0} to {1} nodes via {2} seeds".format(bundle, len(missing),
+                                                                  len(seeds)))
+    fan_out(deploy_func, seeds, max_parallel, timeout=timeout)
+
+    pid_file = "{0}/peer_server_{1}.pid".format(ARTIFACTS_DIR, port)
+
+    def serve_func(target):
+        conn, ip, node = target
+        cmd = SERVE_CMD.format(**get_cmd_params(bundle, ip=ip, port=port,
+                                                timeout=timeout, pid_file=pid_file))
+        run_over_ssh(conn, cmd, stdin_data=PEER_SERVER_SCRIPT, node=node, nolog=True)
+
+    def stop_serve_func(target):
+        conn, _, node = target
+        run_over_ssh(conn, STOP_SERVE_CMD.format(pid_file=pid_file), node=node, nolog=True)
+
+    def fetch_func(idx_target):
+        idx, (conn, _, node) = idx_target
+        _, seed_ip, seed = serving[idx % len(serving)]
+        try:
+            fetch_from_peer(conn, bundle, dst, seed_ip, port, node)
+        except OSError as exc:
+            logger.warning("Failed to get {0} on {1} from {2}: {3!s}".format(
+                           bundle, node, seed, exc))
+            deploy(conn, bundle, dst, node)
+
+    try:
+        served = fan_out(serve_func, seeds, max_parallel, timeout=timeout,
+                         return_exceptions=True)
+        serving = []
+        for seed, res in zip(seeds, served):
+            if isinstance(res, Exception):
+                logger.warning("Can't serve {0} from {1}: {2!s}".format(bundle, seed[2], res))
+            else:
+                serving.append(seed)
+
+        if len(serving) == 0:
+            fan_out(deploy_func, rest, max_parallel, timeout=timeout)
+        else:
+            fan_out(fetch_func, list(enumerate(rest)), max_parallel, timeout=timeout)
+    finally:
+        fan_out(stop_serve_func, seeds, max_parallel, timeout=timeout,
+                return_exceptions=True)
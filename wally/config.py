@@ -54,6 +54,7 @@ def get_test_files(results_dir):
         results_storage='results',
         hwinfo_directory='hwinfo',
         hwreport_fname='hwinfo.txt',
+        facts_file='facts.yaml',
         raw_results='raw_results.yaml')
 
     res = dict((k, in_var_dir(v)) for k, v in res.items())
@@ -86,6 +87,8 @@ def load_config(file_name):
 
     results_storage = cfg.settings.get('results_storage', '/tmp')
     results_storage = os.path.abspath(results_storage)
+    # hardware info of nodes, shared by all runs
+    cfg.facts_cache_dir = os.path.join(results_storage, 'facts_cache')
 
     existing = file_name.startswith(results_storage)
 
@@ -3,7 +3,6 @@ import socket
 import logging
 from urlparse import urlparse
 
-import sshtunnel
 from paramiko import AuthenticationException
 
 
@@ -12,13 +11,12 @@ from wally.fuel_rest_api import (KeystoneAuth, get_cluster_id,
 from wally.utils import (parse_creds, check_input_param, StopTestError,
                          clean_resource, get_ip_for_target)
 from wally.ssh_utils import (run_over_ssh, connect, set_key_for_node,
-                             read_from_remote)
+                             read_from_remote, JumpHost, set_jump_host_for_node)
 
 from .node import Node
 
 
 logger = logging.getLogger("wally.discover")
-BASE_PF_PORT = 44006
 
 
 def discover_fuel_nodes(fuel_data, var_dir, discover_nodes=True):
@@ -51,8 +49,9 @@ def discover_fuel_nodes(fuel_data, var_dir, discover_nodes=True):
     fuel_host = urlparse(fuel_data['url']).hostname
     fuel_ip = socket.gethostbyname(fuel_host)
 
+    fuel_uri = "{0}@{1}".format(ssh_creds, fuel_host)
     try:
-        ssh_conn = connect("{0}@{1}".format(ssh_creds, fuel_host))
+        ssh_conn = connect(fuel_uri)
     except AuthenticationException:
         raise StopTestError("Wrong fuel credentials")
     except Exception:
@@ -67,18 +66,18 @@ def discover_fuel_nodes(fuel_data, var_dir, discover_nodes=True):
     nodes = []
     ips_ports = []
 
-    logger.info("Forwarding ssh ports from FUEL nodes to localhost")
-    fuel_usr, fuel_passwd = ssh_creds.split(":", 1)
+    # nodes are connected by channels over few connections to fuel master
+    jump_host = JumpHost(fuel_uri, fuel_data.get('jump_connections', 4), ssh_conn)
+    clean_resource(jump_host.close)
+
     ips = [str(fuel_node.get_ip(network)) for fuel_node in fuel_nodes]
-    port_fw = forward_ssh_ports(fuel_host, fuel_usr, fuel_passwd, ips)
     listen_ip = get_ip_for_target(fuel_host)
 
-    for port, fuel_node, ip in zip(port_fw, fuel_nodes, ips):
-        logger.debug(
-            "SSH port forwarding {0} => localhost:{1}".format(ip, port))
-
-        conn_url = "ssh://root@127.0.0.1:{0}".format(port)
-        set_key_for_node(('127.0.0.1', port), fuel_key)
+    for fuel_node, ip in zip(fuel_nodes, ips):
+        port = 22
+        conn_url = "ssh://root@{0}:{1}".format(ip, port)
+        set_key_for_node((ip, port), fuel_key)
+        set_jump_host_for_node((ip, port), jump_host)
 
         node = Node(conn_url, fuel_node['roles'])
         node.monitor_ip = listen_ip
@@ -116,15 +115,3 @@ def get_external_interface(conn, ip):
                 return curr_iface
     raise KeyError("Can't found interface for ip {0}".format(ip))
 
-
-def forward_ssh_ports(proxy_ip, proxy_user, proxy_passwd, ips):
-    for ip in ips:
-        tunnel = sshtunnel.open(
-                    (proxy_ip, 22),
-                    ssh_username=proxy_user,
-                    ssh_password=proxy_passwd,
-                    threaded=True,
-                    remote_bind_address=(ip, 22))
-        tunnel.__enter__()
-        clean_resource(tunnel.__exit__, None, None, None)
-        yield tunnel.local_bind_port
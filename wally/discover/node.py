@@ -12,6 +12,15 @@ class Node(object):
         self.monitor_ip = None
         self.os_vm_id = None
 
+        # remote_clock = local_clock + time_offset
+        self.time_offset = None
+
+        # {tool_name: remote_path} - tools, already deployed on node
+        self.tools = {}
+
+        # HWInfo, if hardware info was collected
+        self.hw_info = None
+
     def get_ip(self):
         if self.conn_url == 'local':
             return '127.0.0.1'
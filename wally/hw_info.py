@@ -1,15 +1,27 @@
 import re
-import xml.etree.ElementTree as ET
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
 
 from wally import ssh_utils, utils
 
 
+logger = logging.getLogger("wally")
+
+
 def get_data(rr, data):
     match_res = re.search("(?ims)" + rr, data)
     return match_res.group(0)
 
 
 class HWInfo(object):
+    STORED_FIELDS = ['hostname', 'cores', 'disks_info', 'disks_raw_info', 'net_info',
+                     'ram_size', 'sys_name', 'mb', 'raw', 'storage_controllers',
+                     'numa_nodes', 'devices_numa', 'os_info']
+
     def __init__(self):
         self.hostname = None
         self.cores = []
@@ -17,7 +29,7 @@ class HWInfo(object):
         # /dev/... devices
         self.disks_info = {}
 
-        # real disks on raid controller
+        # real disks on raid controller, not collected from sysfs
         self.disks_raw_info = {}
 
         # name => (speed, is_full_diplex, ip_addresses)
@@ -30,6 +42,42 @@ class HWInfo(object):
 
         self.storage_controllers = []
 
+        # numa node id => [cpu id]
+        self.numa_nodes = {}
+
+        # net or block device name => numa node id, for devices
+        # with known locality
+        self.devices_numa = {}
+
+        # utils.os_release or None
+        self.os_info = None
+
+        # info is loaded from facts cache
+        self.from_cache = False
+
+    def to_dict(self):
+        "returns json-serializable dict, see from_dict"
+        res = dict((name, getattr(self, name)) for name in self.STORED_FIELDS)
+        # json keys are strings
+        res['numa_nodes'] = dict((str(numa_id), cpus)
+                                 for numa_id, cpus in self.numa_nodes.items())
+        return res
+
+    @classmethod
+    def from_dict(cls, data):
+        res = cls()
+        for name in cls.STORED_FIELDS:
+            setattr(res, name, data[name])
+
+        res.cores = [tuple(item) for item in res.cores]
+        res.disks_info = dict((dev, tuple(info)) for dev, info in res.disks_info.items())
+        res.net_info = dict((name, tuple(info)) for name, info in res.net_info.items())
+        res.numa_nodes = dict((int(numa_id), cpus)
+                              for numa_id, cpus in res.numa_nodes.items())
+        if res.os_info is not None:
+            res.os_info = utils.os_release(*res.os_info)
+        return res
+
     def get_HDD_count(self):
         # SATA HDD COUNT, SAS 10k HDD COUNT, SAS SSD count, PCI-E SSD count
         return []
@@ -70,6 +118,14 @@ class HWInfo(object):
                 else:
                     res.append("    " + name)
 
+        if self.numa_nodes != {}:
+            res.append("NUMA nodes:")
+            for numa_id, cpus in sorted(self.numa_nodes.items()):
+                devs = [dev for dev, dev_numa_id in sorted(self.devices_numa.items())
+                        if dev_numa_id == numa_id]
+                res.append("    {0}: cpus {1} {2}".format(numa_id, format_cpu_list(cpus),
+                                                         " ".join(devs)))
+
         if self.storage_controllers != []:
             res.append("Disk controllers:")
             for descr in self.storage_controllers:
@@ -87,8 +143,6 @@ class HWInfo(object):
             res.append("Disks devices:")
             for dev, descr in sorted(self.disks_raw_info.items()):
                 res.append("    {0} {1}".format(dev, descr))
-        else:
-            res.append("Disks devices's: Failed to get info")
 
         if self.net_info != {}:
             res.append("Net adapters:")
@@ -101,265 +155,378 @@ class HWInfo(object):
 
 
 class SWInfo(object):
+    """
+    IO relevant system settings of node
+
+    kernel_version:str - uname -r
+    OS_version:utils.os_release - distro, release and arch
+    block:{str:{str:str}} - device => {queue param: value}
+    mounts:{str:(str, str, str)} - mount point => (device, fs type, options)
+    sysctl:{str:str} - vm sysctl name => value
+    cpu_governors:{str:int} - cpufreq governor => cores count
+    libvirt_version, qemu_version, ceph_version:str - None if not installed
+    """
     def __init__(self):
-        self.partitions = None
         self.kernel_version = None
-        self.fio_version = None
+        self.OS_version = None
+        self.block = {}
+        self.mounts = {}
+        self.sysctl = {}
+        self.cpu_governors = {}
         self.libvirt_version = None
-        self.kvm_version = None
         self.qemu_version = None
-        self.OS_version = None
         self.ceph_version = None
 
+    def get_facts(self):
+        "returns {fact name: str}, flat dict, which is stored and compared"
+        res = {'kernel': self.kernel_version}
 
-def get_sw_info(conn):
+        if self.OS_version is not None:
+            res['os'] = " ".join(str(val) for val in self.OS_version if val is not None)
+
+        for dev, params in self.block.items():
+            for param, val in params.items():
+                res["block.{0}.{1}".format(dev, param)] = val
+
+        for mpoint, (dev, fstype, opts) in self.mounts.items():
+            res["mount." + mpoint] = "{0} {1} {2}".format(dev, fstype, opts)
+
+        for name, val in self.sysctl.items():
+            res["sysctl." + name] = val
+
+        if len(self.cpu_governors) != 0:
+            res['cpu.governor'] = ", ".join(
+                "{0}*{1}".format(gov, count) if len(self.cpu_governors) > 1 else gov
+                for gov, count in sorted(self.cpu_governors.items()))
+
+        for name in ('libvirt', 'qemu', 'ceph'):
+            val = getattr(self, name + '_version')
+            if val is not None:
+                res[name] = val
+
+        return dict((name, val) for name, val in res.items() if val is not None)
+
+
+BLOCK_QUEUE_PARAMS = ['scheduler', 'nr_requests', 'read_ahead_kb', 'rq_affinity',
+                      'max_sectors_kb', 'rotational', 'nomerges', 'add_random']
+
+VM_SYSCTLS = ['dirty_ratio', 'dirty_background_ratio', 'dirty_bytes',
+              'dirty_background_bytes', 'dirty_expire_centisecs',
+              'dirty_writeback_centisecs', 'swappiness', 'vfs_cache_pressure']
+
+# virtual devices have no settings, which affect tests
+SKIP_BLOCK_DEVS = ('loop', 'ram', 'zram', 'nbd')
+
+SW_INFO_CMD = "echo '== kernel' ; uname -r ; " + \
+    "echo '== block' ; for dev in $(ls /sys/block) ; do for param in {params} ; do " + \
+    "if [ -f /sys/block/$dev/queue/$param ] ; then " + \
+    "echo $dev $param $(cat /sys/block/$dev/queue/$param) ; fi ; done ; done ; " + \
+    "echo '== mounts' ; cat /proc/mounts ; " + \
+    "echo '== sysctl' ; for name in {sysctls} ; do " + \
+    "if [ -f /proc/sys/vm/$name ] ; then echo $name $(cat /proc/sys/vm/$name) ; fi ; done ; " + \
+    "echo '== governor' ; cat /sys/devices/system/cpu/cpu*/cpufreq/scaling_governor " + \
+    "2>/dev/null ; " + \
+    "echo '== libvirt' ; virsh -v 2>/dev/null ; " + \
+    "echo '== qemu' ; qemu-system-x86_64 --version 2>/dev/null | head -n 1 ; " + \
+    "echo '== ceph' ; ceph --version 2>/dev/null ; true"
+
+
+def parse_sw_info(out):
+    "returns SWInfo for SW_INFO_CMD output"
     res = SWInfo()
-    res.OS_version = utils.get_os()
+    sections = {}
+    curr = None
+    for line in out.split("\n"):
+        if line.startswith("== "):
+            curr = sections.setdefault(line[3:].strip(), [])
+        elif curr is not None and line.strip() != "":
+            curr.append(line.strip())
+
+    if len(sections.get('kernel', [])) != 0:
+        res.kernel_version = sections['kernel'][0]
+
+    for line in sections.get('block', []):
+        items = line.split()
+        if len(items) < 3 or items[0].startswith(SKIP_BLOCK_DEVS):
+            continue
+
+        dev, param, vals = items[0], items[1], items[2:]
+        if param == 'scheduler':
+            # noop deadline [cfq]
+            selected = [val[1:-1] for val in vals if val.startswith('[')]
+            vals = selected if len(selected) != 0 else vals
+        res.block.setdefault(dev, {})[param] = vals[0]
+
+    for line in sections.get('mounts', []):
+        items = line.split()
+        if len(items) >= 4 and items[0].startswith('/dev/'):
+            res.mounts[items[1]] = (items[0], items[2], items[3])
+
+    for line in sections.get('sysctl', []):
+        items = line.split(None, 1)
+        if len(items) == 2:
+            res.sysctl["vm." + items[0]] = items[1]
+
+    for gov in sections.get('governor', []):
+        res.cpu_governors[gov] = res.cpu_governors.get(gov, 0) + 1
+
+    for name in ('libvirt', 'qemu', 'ceph'):
+        if len(sections.get(name, [])) != 0:
+            setattr(res, name + '_version', sections[name][0])
 
-    with conn.open_sftp() as sftp:
-        def get(fname):
-            try:
-                return ssh_utils.read_from_remote(sftp, fname)
-            except:
-                return None
+    return res
 
-        res.kernel_version = get('/proc/version')
-        res.partitions = get('/etc/mtab')
 
-    def rr(cmd):
-        try:
-            return ssh_utils.run_over_ssh(conn, cmd, nolog=True)
-        except:
-            return None
+def get_sw_info(conn):
+    def rr(cmd, **params):
+        return ssh_utils.run_over_ssh(conn, cmd, **params)
 
-    res.libvirt_version = rr("virsh -v")
-    res.qemu_version = rr("qemu-system-x86_64 --version")
-    res.ceph_version = rr("ceph --version")
+    cmd = SW_INFO_CMD.format(params=" ".join(BLOCK_QUEUE_PARAMS),
+                             sysctls=" ".join(VM_SYSCTLS))
+    res = parse_sw_info(rr(cmd, nolog=True))
+
+    try:
+        res.OS_version = utils.get_os(rr)
+    except Exception:
+        pass
 
     return res
 
 
+def diff_facts(facts1, facts2):
+    """
+    returns [(node, fact, val1, val2)] for facts, which differ between
+    two runs. facts1, facts2:{str:{str:str}} - node id => facts, as
+    stored by facts collecting stage. Values, missed in one of the runs,
+    are None
+    """
+    res = []
+    for node in sorted(set(facts1) | set(facts2)):
+        node_facts1 = facts1.get(node, {})
+        node_facts2 = facts2.get(node, {})
+        for name in sorted(set(node_facts1) | set(node_facts2)):
+            val1 = node_facts1.get(name)
+            val2 = node_facts2.get(name)
+            if val1 != val2:
+                res.append((node, name, val1, val2))
+    return res
+
+
 def get_network_info():
     pass
 
 
-def get_hw_info(conn):
-    res = HWInfo()
-    lshw_out = ssh_utils.run_over_ssh(conn, 'sudo lshw -xml 2>/dev/null',
-                                      nolog=True)
+def parse_cpu_list(data):
+    "'0-3,8' => [0, 1, 2, 3, 8]"
+    res = []
+    for part in data.strip().split(","):
+        if part == "":
+            continue
+        if "-" in part:
+            start, end = part.split("-")
+            res.extend(range(int(start), int(end) + 1))
+        else:
+            res.append(int(part))
+    return res
 
-    res.raw = lshw_out
-    lshw_et = ET.fromstring(lshw_out)
 
-    try:
-        res.hostname = lshw_et.find("node").attrib['id']
-    except:
-        pass
+def format_cpu_list(cpus):
+    "[0, 1, 2, 3, 8] => '0-3,8'"
+    res = []
+    for cpu in sorted(cpus):
+        if len(res) != 0 and res[-1][1] + 1 == cpu:
+            res[-1][1] = cpu
+        else:
+            res.append([cpu, cpu])
+
+    return ",".join(str(start) if start == end else "{0}-{1}".format(start, end)
+                    for start, end in res)
+
+
+NUMA_INFO_CMD = "for dr in /sys/devices/system/node/node[0-9]* ; do " + \
+                "echo node ${dr##*node} $(cat $dr/cpulist) ; done ; " + \
+                "for dr in /sys/class/net/* /sys/block/* ; do " + \
+                "if [ -f $dr/device/numa_node ] ; then " + \
+                "echo dev $(basename $dr) $(cat $dr/device/numa_node) ; fi ; done"
+
+
+def parse_numa_info(out):
+    "returns ({numa node id: [cpu id]}, {device: numa node id}) for NUMA_INFO_CMD output"
+    numa_nodes = {}
+    devices_numa = {}
+    for line in out.split("\n"):
+        items = line.split()
+        if len(items) == 3 and items[0] == 'node':
+            numa_nodes[int(items[1])] = parse_cpu_list(items[2])
+        elif len(items) == 3 and items[0] == 'dev' and int(items[2]) >= 0:
+            devices_numa[items[1]] = int(items[2])
+    return numa_nodes, devices_numa
+
+
+def get_numa_info(conn):
+    """
+    returns ({numa node id: [cpu id]}, {device: numa node id}) from sysfs.
+    Devices without known locality are skipped
+    """
+    return parse_numa_info(ssh_utils.run_over_ssh(conn, NUMA_INFO_CMD, nolog=True))
+
+
+DMI_FIELDS = ['sys_vendor', 'product_name', 'board_vendor', 'board_name', 'board_version']
+
+# virtual devices aren't reported as storage
+SKIP_DISKS = SKIP_BLOCK_DEVS + ('dm-', 'sr')
+
+HW_INFO_CMD = "echo '== hostname' ; hostname ; " + \
+    "echo '== dmi' ; for name in {dmi} ; do " + \
+    "echo $name $(cat /sys/class/dmi/id/$name 2>/dev/null) ; done ; " + \
+    "echo '== cpu' ; grep -E '^(processor|model name)' /proc/cpuinfo ; " + \
+    "echo '== mem' ; grep MemTotal /proc/meminfo ; " + \
+    "echo '== disks' ; for dr in /sys/block/* ; do " + \
+    "echo $(basename $dr) $(cat $dr/size) $(cat $dr/device/vendor 2>/dev/null) " + \
+    "$(cat $dr/device/model 2>/dev/null) ; done ; " + \
+    "echo '== storage' ; for dr in /sys/bus/pci/devices/* ; do " + \
+    "case $(cat $dr/class) in 0x01*) echo $(basename $dr) $(cat $dr/vendor) " + \
+    "$(cat $dr/device) $(basename $(readlink $dr/driver) 2>/dev/null) ;; esac ; done ; " + \
+    "echo '== net' ; for dr in /sys/class/net/* ; do if [ -e $dr/device ] ; then " + \
+    "echo $(basename $dr) $(cat $dr/operstate) $(cat $dr/speed 2>/dev/null) " + \
+    "$(cat $dr/duplex 2>/dev/null) ; fi ; done ; " + \
+    "echo '== numa' ; " + NUMA_INFO_CMD + " ; " + \
+    "echo '== os' ; " + utils.OS_INFO_CMD
+
+
+def parse_hw_info(out):
+    "returns HWInfo for HW_INFO_CMD output"
+    res = HWInfo()
+    res.raw = out
+
+    sections = {}
+    curr = None
+    for line in out.split("\n"):
+        if line.startswith("== "):
+            curr = sections.setdefault(line[3:].strip(), [])
+        elif curr is not None:
+            curr.append(line)
+
+    lines = dict((name, [line.strip() for line in sect if line.strip() != ""])
+                 for name, sect in sections.items())
+
+    if len(lines.get('hostname', [])) != 0:
+        res.hostname = lines['hostname'][0]
+
+    dmi = {}
+    for line in lines.get('dmi', []):
+        name, _, val = line.partition(" ")
+        if val.strip() not in ("", "To be filled by O.E.M.", "To Be Filled By O.E.M."):
+            dmi[name] = val.strip()
+
+    if 'sys_vendor' in dmi or 'product_name' in dmi:
+        res.sys_name = " ".join(dmi[name] for name in ('sys_vendor', 'product_name')
+                                if name in dmi)
+    if 'board_name' in dmi:
+        res.mb = " ".join(dmi[name] for name in ('board_vendor', 'board_name', 'board_version')
+                          if name in dmi)
+
+    # model => logical cpus count
+    models = []
+    counts = {}
+    model = None
+    for line in lines.get('cpu', []) + ['processor']:
+        name, _, val = line.partition(":")
+        name = name.strip()
+        if name == 'processor':
+            if model is not None:
+                if model not in counts:
+                    models.append(model)
+                counts[model] = counts.get(model, 0) + 1
+            model = "unknown"
+        elif name == 'model name':
+            model = " ".join(val.split())
+    res.cores = [(cpu_model, counts[cpu_model]) for cpu_model in models]
+
+    for line in lines.get('mem', []):
+        items = line.split()
+        if len(items) >= 2 and items[0] == 'MemTotal:':
+            res.ram_size = int(items[1]) * 1024
+
+    for line in lines.get('disks', []):
+        items = line.split()
+        if len(items) < 2 or items[0].startswith(SKIP_DISKS) or items[1] == '0':
+            continue
+        res.disks_info[items[0]] = (" ".join(items[2:]), int(items[1]) * 512)
+
+    for line in lines.get('storage', []):
+        items = line.split()
+        if len(items) >= 3:
+            driver = items[3] if len(items) > 3 else "no driver"
+            res.storage_controllers.append("{0}: {1} [{2}:{3}]".format(
+                items[0], driver, items[1][2:], items[2][2:]))
+
+    for line in lines.get('net', []):
+        items = line.split()
+        if len(items) < 2 or items[1] != 'up':
+            continue
+        speed = None
+        if len(items) > 2 and items[2].isdigit():
+            speed = items[2] + "Mbit/s"
+        dup = items[3] if len(items) > 3 else None
+        res.net_info[items[0]] = (speed, dup, [])
+
+    res.numa_nodes, res.devices_numa = parse_numa_info("\n".join(sections.get('numa', [])))
+
+    os_lines = sections.get('os', [])
+    if len(os_lines) != 0:
+        res.os_info = utils.parse_os_release("\n".join(os_lines[1:]), os_lines[0].strip())
 
-    try:
-        res.sys_name = (lshw_et.find("node/vendor").text + " " +
-                        lshw_et.find("node/product").text)
-        res.sys_name = res.sys_name.replace("(To be filled by O.E.M.)", "")
-        res.sys_name = res.sys_name.replace("(To be Filled by O.E.M.)", "")
-    except:
-        pass
+    return res
 
-    core = lshw_et.find("node/node[@id='core']")
-    if core is None:
-        return
 
-    try:
-        res.mb = " ".join(core.find(node).text
-                          for node in ['vendor', 'product', 'version'])
-    except:
-        pass
+# cheap probe, which is executed on each run. Collected info is reused,
+# while machine is not rebooted and devices set is not changed
+FACTS_PROBE_CMD = "cat /etc/machine-id 2>/dev/null || cat /var/lib/dbus/machine-id ; " + \
+                  "cat /proc/sys/kernel/random/boot_id ; ls /sys/block /sys/class/net"
 
-    for cpu in core.findall("node[@class='processor']"):
-        try:
-            model = cpu.find('product').text
-            threads_node = cpu.find("configuration/setting[@id='threads']")
-            if threads_node is None:
-                threads = 1
-            else:
-                threads = int(threads_node.attrib['value'])
-            res.cores.append((model, threads))
-        except:
-            pass
-
-    res.ram_size = 0
-    for mem_node in core.findall(".//node[@class='memory']"):
-        descr = mem_node.find('description')
-        try:
-            if descr is not None and descr.text == 'System Memory':
-                mem_sz = mem_node.find('size')
-                if mem_sz is None:
-                    for slot_node in mem_node.find("node[@class='memory']"):
-                        slot_sz = slot_node.find('size')
-                        if slot_sz is not None:
-                            assert slot_sz.attrib['units'] == 'bytes'
-                            res.ram_size += int(slot_sz.text)
-                else:
-                    assert mem_sz.attrib['units'] == 'bytes'
-                    res.ram_size += int(mem_sz.text)
-        except:
-            pass
+FACTS_CACHE_TTL = 24 * 3600
 
-    for net in core.findall(".//node[@class='network']"):
-        try:
-            link = net.find("configuration/setting[@id='link']")
-            if link.attrib['value'] == 'yes':
-                name = net.find("logicalname").text
-                speed_node = net.find("configuration/setting[@id='speed']")
 
-                if speed_node is None:
-                    speed = None
-                else:
-                    speed = speed_node.attrib['value']
+def get_hw_info(conn, cache_dir=None, cache_ttl=FACTS_CACHE_TTL):
+    """
+    collect node hardware info. If cache_dir is set, info is stored into
+    cache_dir/<machine-id>.json and reused for cache_ttl seconds, until
+    node is rebooted or block or net devices set is changed
+    """
+    if cache_dir is None or cache_ttl == 0:
+        return parse_hw_info(ssh_utils.run_over_ssh(conn, HW_INFO_CMD, nolog=True))
 
-                dup_node = net.find("configuration/setting[@id='duplex']")
-                if dup_node is None:
-                    dup = None
-                else:
-                    dup = dup_node.attrib['value']
+    probe = ssh_utils.run_over_ssh(conn, FACTS_PROBE_CMD, nolog=True)
+    machine_id, _, fingerprint = probe.strip().partition("\n")
+    machine_id = machine_id.strip()
+    fingerprint = hashlib.sha1(fingerprint).hexdigest()
+    cache_file = os.path.join(cache_dir, machine_id + ".json")
 
-                res.net_info[name] = (speed, dup, [])
-        except:
-            pass
+    if re.match(r"[0-9a-f]{32}$", machine_id) is None:
+        logger.debug("No machine-id, facts aren't cached")
+        return parse_hw_info(ssh_utils.run_over_ssh(conn, HW_INFO_CMD, nolog=True))
 
-    for controller in core.findall(".//node[@class='storage']"):
-        try:
-            description = getattr(controller.find("description"), 'text', "")
-            product = getattr(controller.find("product"), 'text', "")
-            vendor = getattr(controller.find("vendor"), 'text', "")
-            dev = getattr(controller.find("logicalname"), 'text', "")
-            if dev != "":
-                res.storage_controllers.append(
-                    "{0}: {1} {2} {3}".format(dev, description,
-                                              vendor, product))
-            else:
-                res.storage_controllers.append(
-                    "{0} {1} {2}".format(description,
-                                         vendor, product))
-        except:
-            pass
-
-    for disk in core.findall(".//node[@class='disk']"):
+    if os.path.exists(cache_file):
         try:
-            lname_node = disk.find('logicalname')
-            if lname_node is not None:
-                dev = lname_node.text.split('/')[-1]
-
-                if dev == "" or dev[-1].isdigit():
-                    continue
-
-                sz_node = disk.find('size')
-                assert sz_node.attrib['units'] == 'bytes'
-                sz = int(sz_node.text)
-                res.disks_info[dev] = ('', sz)
-            else:
-                description = disk.find('description').text
-                product = disk.find('product').text
-                vendor = disk.find('vendor').text
-                version = disk.find('version').text
-                serial = disk.find('serial').text
-
-                full_descr = "{0} {1} {2} {3} {4}".format(
-                    description, product, vendor, version, serial)
-
-                businfo = disk.find('businfo').text
-                res.disks_raw_info[businfo] = full_descr
-        except:
-            pass
+            with open(cache_file) as fd:
+                cached = json.load(fd)
+            if cached['fingerprint'] == fingerprint and \
+                    time.time() - cached['time'] < cache_ttl:
+                res = HWInfo.from_dict(cached['info'])
+                res.from_cache = True
+                return res
+        except (ValueError, KeyError, TypeError, IOError) as exc:
+            logger.warning("Broken facts cache file {0}: {1!s}".format(cache_file, exc))
+
+    res = parse_hw_info(ssh_utils.run_over_ssh(conn, HW_INFO_CMD, nolog=True))
+
+    # cloned nodes may share machine-id, each writes full file
+    tmp_file = "{0}.{1}.tmp".format(cache_file, threading.current_thread().ident)
+    with open(tmp_file, "w") as fd:
+        json.dump({'fingerprint': fingerprint,
+                   'time': time.time(),
+                   'info': res.to_dict()}, fd)
+    os.rename(tmp_file, cache_file)
 
     return res
-
-# import traceback
-# print ET.tostring(disk)
-# traceback.print_exc()
-
-# print get_hw_info(None)
-
-# def get_hw_info(conn):
-#     res = HWInfo(None)
-#     remote_run = functools.partial(ssh_utils.run_over_ssh, conn, nolog=True)
-
-#     # some data
-#     with conn.open_sftp() as sftp:
-#         proc_data = ssh_utils.read_from_remote(sftp, '/proc/cpuinfo')
-#         mem_data = ssh_utils.read_from_remote(sftp, '/proc/meminfo')
-
-#     # cpu info
-#     curr_core = {}
-#     for line in proc_data.split("\n"):
-#         if line.strip() == "":
-#             if curr_core != {}:
-#                 res.cores.append(curr_core)
-#                 curr_core = {}
-#         else:
-#             param, val = line.split(":", 1)
-#             curr_core[param.strip()] = val.strip()
-
-#     if curr_core != {}:
-#         res.cores.append(curr_core)
-
-#     # RAM info
-#     for line in mem_data.split("\n"):
-#         if line.startswith("MemTotal"):
-#             res.ram_size = int(line.split(":", 1)[1].split()[0]) * 1024
-#             break
-
-#     # HDD info
-#     for dev in remote_run('ls /dev').split():
-#         if dev[-1].isdigit():
-#             continue
-
-#         if dev.startswith('sd') or dev.startswith('hd'):
-#             model = None
-#             size = None
-
-#             for line in remote_run('sudo hdparm -I /dev/' + dev).split("\n"):
-#                 if "Model Number:" in line:
-#                     model = line.split(':', 1)[1]
-#                 elif "device size with M = 1024*1024" in line:
-#                     size = int(line.split(':', 1)[1].split()[0])
-#                     size *= 1024 ** 2
-
-#             res.disks_info[dev] = (model, size)
-
-#     # Network info
-#     separator = '*-network'
-#     net_info = remote_run('sudo lshw -class network')
-#     for net_dev_info in net_info.split(separator):
-#         if net_dev_info.strip().startswith("DISABLED"):
-#             continue
-
-#         if ":" not in net_dev_info:
-#             continue
-
-#         dev_params = {}
-#         for line in net_dev_info.split("\n"):
-#             line = line.strip()
-#             if ':' in line:
-#                 key, data = line.split(":", 1)
-#                 dev_params[key.strip()] = data.strip()
-
-#         if 'configuration' not in dev_params:
-#             print "!!!!!", net_dev_info
-#             continue
-
-#         conf = dev_params['configuration']
-#         if 'link=yes' in conf:
-#             if 'speed=' in conf:
-#                 speed = conf.split('speed=', 1)[1]
-#                 speed = speed.strip().split()[0]
-#             else:
-#                 speed = None
-
-#             if "duplex=" in conf:
-#                 dtype = conf.split("duplex=", 1)[1]
-#                 dtype = dtype.strip().split()[0]
-#             else:
-#                 dtype = None
-
-#             res.net_info[dev_params['logical name']] = (speed, dtype)
-#     return res
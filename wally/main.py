@@ -25,7 +25,7 @@ except ImportError:
 
 
 from wally.timeseries import SensorDatastore
-from wally import utils, run_test, pretty_yaml
+from wally import utils, run_test, pretty_yaml, service
 from wally.config import (load_config, setup_loggers,
                           get_test_files, save_run_params, load_run_params)
 
@@ -43,6 +43,11 @@ class Context(object):
         self.hw_info = []
         self.fuel_openstack_creds = None
 
+        # {conn_url: Node} - already connected nodes, shared between
+        # runs by service, None - don't reuse connections
+        self.nodes_cache = None
+        self.conn_monitor = None
+
 
 def get_stage_name(func):
     nm = get_func_name(func)
@@ -186,11 +191,157 @@ def parse_args(argv):
     test_parser.add_argument("comment", help="Test information")
     test_parser.add_argument("config_file", help="Yaml config file")
 
+    # ---------------------------------------------------------------------
+    serve_parser = subparsers.add_parser('serve', help='run campaigns queue service')
+    serve_parser.add_argument("-p", "--port", type=int, default=service.DEFAULT_PORT)
+    serve_parser.add_argument("--ip", default=service.DEFAULT_IP,
+                              help="Ip to listen on, use lab network ip to " +
+                                   "accept campaigns from other hosts")
+    serve_parser.add_argument("--token-file", default=service.DEFAULT_TOKEN_FILE,
+                              help="File with shared token, which submit requests " +
+                                   "must provide. Created with random token, if " +
+                                   "don't exists. Copy it to hosts, which submit " +
+                                   "campaigns")
+    serve_parser.add_argument("--max-parallel", type=int, default=1,
+                              help="Max campaigns to run at the same time, " +
+                                   "only 1 is supported now")
+
+    # ---------------------------------------------------------------------
+    submit_parser = subparsers.add_parser('submit', help='put tests into service queue')
+    submit_parser.add_argument("-u", "--url", default=service.DEFAULT_URL)
+    submit_parser.add_argument("--token-file", default=service.DEFAULT_TOKEN_FILE,
+                               help="File with service token")
+    submit_parser.add_argument("comment", help="Test information")
+    submit_parser.add_argument("config_file", help="Yaml config file")
+
+    # ---------------------------------------------------------------------
+    queue_parser = subparsers.add_parser('queue', help='show service queue')
+    queue_parser.add_argument("-u", "--url", default=service.DEFAULT_URL)
+
     # ---------------------------------------------------------------------
 
     return parser.parse_args(argv[1:])
 
 
+def prepare_test_config(config_file, comment):
+    cfg = load_config(config_file)
+    make_storage_dir_struct(cfg)
+    cfg.comment = comment
+    save_run_params(cfg)
+
+    with open(cfg.saved_config_file, 'w') as fd:
+        fd.write(pretty_yaml.dumps(cfg.__dict__))
+
+    cfg.keep_vm = False
+    cfg.no_tests = False
+    cfg.dont_discover_nodes = False
+
+    return cfg
+
+
+def get_test_stages(cfg):
+    stages = [
+        run_test.discover_stage
+    ]
+
+    stages.extend([
+        run_test.reuse_vms_stage,
+        log_nodes_statistic_stage,
+        run_test.save_nodes_stage,
+        run_test.connect_stage])
+
+    if cfg.settings.get('node_agent', True):
+        stages.append(run_test.deploy_agents_stage)
+
+    if cfg.settings.get('clock_sync', True):
+        stages.append(run_test.clock_sync_stage)
+
+    if cfg.settings.get('collect_info', True):
+        stages.append(run_test.collect_hw_info_stage)
+
+    if cfg.settings.get('collect_facts', True):
+        stages.append(run_test.collect_facts_stage)
+
+    stages.extend([
+        # deploy_sensors_stage,
+        run_test.run_tests_stage,
+        run_test.store_raw_results_stage,
+        # gather_sensors_stage
+    ])
+
+    return stages
+
+
+def get_report_stages(load_report=False):
+    report_stages = [run_test.console_report_stage]
+    if load_report:
+        report_stages.append(run_test.test_load_report_stage)
+    report_stages.append(run_test.html_report_stage)
+    return report_stages
+
+
+def run_stages(cfg, ctx, stages, report_stages):
+    for stage in stages:
+        ok = False
+        with log_stage(stage):
+            stage(cfg, ctx)
+            ok = True
+        if not ok:
+            break
+
+    exc, cls, tb = sys.exc_info()
+    for stage in ctx.clear_calls_stack[::-1]:
+        with log_stage(stage):
+            stage(cfg, ctx)
+
+    logger.debug("Start utils.cleanup")
+    for clean_func, args, kwargs in utils.iter_clean_func():
+        with log_stage(clean_func):
+            clean_func(*args, **kwargs)
+
+    if exc is None:
+        for report_stage in report_stages:
+            with log_stage(report_stage):
+                report_stage(cfg, ctx)
+
+    logger.info("All info stored into " + cfg.results_dir)
+
+    if exc is None and ok:
+        logger.info("Tests finished successfully")
+        return 0
+    else:
+        logger.error("Tests are failed. See detailed error above")
+        return 1
+
+
+def run_campaign(config_file, comment, nodes_cache=None):
+    """
+    run all test stages for config file in current process,
+    used by service to run queued campaigns
+    returns (results_dir, exit_code)
+    """
+    cfg = prepare_test_config(config_file, comment)
+
+    ctx = Context()
+    ctx.results = {}
+    ctx.sensors_data = SensorDatastore()
+    ctx.nodes_cache = nodes_cache
+
+    fh = logging.FileHandler(cfg.log_file)
+    log_format = '%(asctime)s - %(levelname)8s - %(name)-15s - %(message)s'
+    fh.setFormatter(logging.Formatter(log_format, datefmt="%H:%M:%S"))
+    fh.setLevel(logging.DEBUG)
+    logging.getLogger('wally').addHandler(fh)
+
+    try:
+        logger.info("All info would be stored into " + cfg.results_dir)
+        code = run_stages(cfg, ctx, get_test_stages(cfg), get_report_stages())
+        return cfg.results_dir, code
+    finally:
+        logging.getLogger('wally').removeHandler(fh)
+        fh.close()
+
+
 def main(argv):
     if faulthandler is not None:
         faulthandler.register(signal.SIGUSR1, all_threads=True)
@@ -204,33 +355,8 @@ def main(argv):
     ctx.sensors_data = SensorDatastore()
 
     if opts.subparser_name == 'test':
-        cfg = load_config(opts.config_file)
-        make_storage_dir_struct(cfg)
-        cfg.comment = opts.comment
-        save_run_params(cfg)
-
-        with open(cfg.saved_config_file, 'w') as fd:
-            fd.write(pretty_yaml.dumps(cfg.__dict__))
-
-        stages = [
-            run_test.discover_stage
-        ]
-
-        stages.extend([
-            run_test.reuse_vms_stage,
-            log_nodes_statistic_stage,
-            run_test.save_nodes_stage,
-            run_test.connect_stage])
-
-        if cfg.settings.get('collect_info', True):
-            stages.append(run_test.collect_hw_info_stage)
-
-        stages.extend([
-            # deploy_sensors_stage,
-            run_test.run_tests_stage,
-            run_test.store_raw_results_stage,
-            # gather_sensors_stage
-        ])
+        cfg = prepare_test_config(opts.config_file, opts.comment)
+        stages = get_test_stages(cfg)
 
         cfg.keep_vm = opts.keep_vm
         cfg.no_tests = opts.no_tests
@@ -255,13 +381,42 @@ def main(argv):
         y = run_test.load_data_from_path(opts.data_path2)
         print(run_test.IOPerfTest.format_diff_for_console(
             [x['io'][0], y['io'][0]]))
+
+        facts1 = run_test.load_facts(opts.data_path1)
+        facts2 = run_test.load_facts(opts.data_path2)
+        if facts1 is None or facts2 is None:
+            print("No environment facts stored for one of the runs")
+        else:
+            print(run_test.format_facts_diff(facts1, facts2))
+        return 0
+
+    elif opts.subparser_name == 'serve':
+        str_level = opts.log_level if opts.log_level is not None else 'INFO'
+        setup_loggers(getattr(logging, str_level))
+
+        # campaigns run in threads of one process and share process wide
+        # state - cleanup stack, 'wally' logger handlers, ssh sessions and
+        # jump hosts, so concurrent campaigns would close each other
+        # resources and mix logs
+        if opts.max_parallel != 1:
+            logger.error("Parallel campaigns aren't supported, use --max-parallel 1")
+            return 1
+
+        token = service.get_token(opts.token_file, create=True)
+        service.serve(run_campaign, token, opts.port, opts.max_parallel, opts.ip)
+        return 0
+
+    elif opts.subparser_name == 'submit':
+        token = service.get_token(opts.token_file)
+        print(service.submit(opts.url, token, opts.config_file, opts.comment))
+        return 0
+
+    elif opts.subparser_name == 'queue':
+        print(service.format_queue(service.get_queue(opts.url)))
         return 0
 
     if not opts.no_report:
-        report_stages.append(run_test.console_report_stage)
-        if opts.load_report:
-            report_stages.append(run_test.test_load_report_stage)
-        report_stages.append(run_test.html_report_stage)
+        report_stages = get_report_stages(opts.load_report)
 
     if opts.log_level is not None:
         str_level = opts.log_level
@@ -271,34 +426,4 @@ def main(argv):
     setup_loggers(getattr(logging, str_level), cfg.log_file)
     logger.info("All info would be stored into " + cfg.results_dir)
 
-    for stage in stages:
-        ok = False
-        with log_stage(stage):
-            stage(cfg, ctx)
-            ok = True
-        if not ok:
-            break
-
-    exc, cls, tb = sys.exc_info()
-    for stage in ctx.clear_calls_stack[::-1]:
-        with log_stage(stage):
-            stage(cfg, ctx)
-
-    logger.debug("Start utils.cleanup")
-    for clean_func, args, kwargs in utils.iter_clean_func():
-        with log_stage(clean_func):
-            clean_func(*args, **kwargs)
-
-    if exc is None:
-        for report_stage in report_stages:
-            with log_stage(report_stage):
-                report_stage(cfg, ctx)
-
-    logger.info("All info stored into " + cfg.results_dir)
-
-    if exc is None:
-        logger.info("Tests finished successfully")
-        return 0
-    else:
-        logger.error("Tests are failed. See detailed error above")
-        return 1
+    return run_stages(cfg, ctx, stages, report_stages)
@@ -6,6 +6,7 @@ import functools
 import contextlib
 import collections
 
+import texttable
 from yaml import load as _yaml_load
 
 try:
@@ -16,21 +17,23 @@ except ImportError:
 
 from concurrent.futures import ThreadPoolExecutor
 
-from wally.hw_info import get_hw_info
+from wally.hw_info import get_hw_info, get_sw_info, diff_facts, FACTS_CACHE_TTL
 from wally.config import get_test_files
 from wally.discover import discover, Node
-from wally import pretty_yaml, utils, report, ssh_utils, start_vms
+from wally import pretty_yaml, utils, report, ssh_utils, start_vms, artifacts
 from wally.sensors_utils import with_sensors_util, sensors_info_util
 
 from wally.suits.mysql import MysqlTest
 from wally.suits.itest import TestConfig
-from wally.suits.io.fio import IOPerfTest
+from wally.suits.io.fio import IOPerfTest, stop_fio_servers
+from wally.suits.io.tune import IOTuneTest
 from wally.suits.postgres import PgBenchTest
 from wally.suits.omgbench import OmgTest
 
 
 TOOL_TYPE_MAPPER = {
     "io": IOPerfTest,
+    "io_tune": IOTuneTest,
     "pgbench": PgBenchTest,
     "mysql": MysqlTest,
     "omg": OmgTest,
@@ -40,11 +43,17 @@ TOOL_TYPE_MAPPER = {
 logger = logging.getLogger("wally")
 
 
-def connect_all(nodes, spawned_node=False):
+def get_max_parallel(cfg):
+    "max count of nodes, which stage process simultaneously"
+    return cfg.settings.get('max_parallel_nodes', utils.FAN_OUT_LIMIT)
+
+
+def connect_all(nodes, spawned_node=False, max_parallel=utils.FAN_OUT_LIMIT):
     """
     Connect to all nodes, log errors
     nodes:[Node] - list of nodes
     spawned_node:bool - whenever nodes is newly spawned VM
+    max_parallel:int - max simultaneous connection attempts
     """
 
     logger.info("Connecting to nodes")
@@ -71,9 +80,15 @@ def connect_all(nodes, spawned_node=False):
             logger.error(msg)
             raise utils.StopTestError(msg)
 
-    with ThreadPoolExecutor(32) as pool:
-        for node, conn in zip(nodes, pool.map(connect_ext, urls)):
-            node.connection = conn
+    conns = utils.fan_out(connect_ext, urls, max_parallel,
+                          timeout=conn_timeout + 30,
+                          return_exceptions=True)
+
+    for node, conn in zip(nodes, conns):
+        if isinstance(conn, utils.FanOutTimeout):
+            logger.error("During connect to {0}: {1!s}".format(node.conn_url, conn))
+            conn = None
+        node.connection = conn
 
     failed_testnodes = []
     failed_nodes = []
@@ -98,15 +113,80 @@ def connect_all(nodes, spawned_node=False):
         logger.info("All nodes connected successfully")
 
 
+def deploy_agents_stage(cfg, ctx):
+    """
+    start node agent on all connected nodes. Nodes, where agent
+    can't be started, are used over plain ssh
+    """
+    def deploy(node):
+        try:
+            ssh_utils.deploy_agent(node.connection, node.get_conn_id())
+            return True
+        except Exception as exc:
+            logger.warning("Can't start agent on node {0}, plain ssh would be used: {1!s}"
+                           .format(node.get_conn_id(), exc))
+            return False
+
+    nodes = [node for node in ctx.nodes if node.conn_url != 'local']
+    deployed = sum(utils.fan_out(deploy, nodes, get_max_parallel(cfg)))
+
+    logger.info("Node agent started on {0} of {1} nodes".format(deployed, len(nodes)))
+
+
+def clock_sync_stage(cfg, ctx):
+    """
+    estimate clock offset for all connected nodes, offsets are used
+    to start tests simultaneously and to put nodes data on common timeline
+    """
+    def get_offset(node):
+        try:
+            offset, rtt = ssh_utils.get_time_offset(node.connection,
+                                                    node=node.get_conn_id())
+            node.time_offset = offset
+            return offset, rtt
+        except Exception as exc:
+            logger.warning("Can't get clock offset for node {0}: {1!s}".format(
+                           node.get_conn_id(), exc))
+            return None
+
+    offsets = utils.fan_out(get_offset, ctx.nodes, get_max_parallel(cfg),
+                            timeout=60, return_exceptions=True)
+    offsets = [None if isinstance(offset, Exception) else offset
+               for offset in offsets]
+
+    for node, offset_rtt in zip(ctx.nodes, offsets):
+        if offset_rtt is not None:
+            logger.debug("Node {0} clock offset {1:.4f}s rtt {2:.4f}s".format(
+                         node.get_conn_id(), *offset_rtt))
+
+    valid = [offset for offset, _ in filter(None, offsets)]
+    if len(valid) != 0:
+        logger.info("Max clock skew between nodes is {0:.3f}s".format(
+                    max(valid) - min(valid)))
+
+
 def collect_hw_info_stage(cfg, ctx):
     if os.path.exists(cfg['hwreport_fname']):
         msg = "{0} already exists. Skip hw info"
         logger.info(msg.format(cfg['hwreport_fname']))
         return
 
-    with ThreadPoolExecutor(32) as pool:
-        connections = (node.connection for node in ctx.nodes)
-        ctx.hw_info.extend(pool.map(get_hw_info, connections))
+    cache_ttl = cfg.settings.get('facts_cache_ttl', FACTS_CACHE_TTL)
+    utils.mkdirs_if_unxists(cfg.facts_cache_dir)
+
+    def get_hw_info_th(conn):
+        return get_hw_info(conn, cfg.facts_cache_dir, cache_ttl)
+
+    connections = [node.connection for node in ctx.nodes]
+    ctx.hw_info.extend(utils.fan_out(get_hw_info_th, connections,
+                                     get_max_parallel(cfg), timeout=300))
+
+    cached = sum(1 for info in ctx.hw_info if info.from_cache)
+    logger.debug("Hardware info for {0} of {1} nodes is taken from cache {2}".format(
+                 cached, len(ctx.hw_info), cfg.facts_cache_dir))
+
+    for node, info in zip(ctx.nodes, ctx.hw_info):
+        node.hw_info = info
 
     with open(cfg['hwreport_fname'], 'w') as hwfd:
         for node, info in zip(ctx.nodes, ctx.hw_info):
@@ -118,7 +198,7 @@ def collect_hw_info_stage(cfg, ctx):
             if info.hostname is not None:
                 fname = os.path.join(
                     cfg.hwinfo_directory,
-                    info.hostname + "_lshw.xml")
+                    info.hostname + "_facts.txt")
 
                 with open(fname, "w") as fd:
                     fd.write(info.raw)
@@ -126,6 +206,59 @@ def collect_hw_info_stage(cfg, ctx):
     logger.debug("Raw hardware info in " + cfg['hwinfo_directory'] + " folder")
 
 
+def collect_facts_stage(cfg, ctx):
+    """
+    store IO relevant system settings of all nodes (block queues,
+    mounts, vm sysctls, cpu governor, kernel) into facts file
+    """
+    if os.path.exists(cfg.facts_file):
+        logger.info("{0} already exists. Skip facts".format(cfg.facts_file))
+        return
+
+    nodes = [node for node in ctx.nodes if node.connection is not None]
+    infos = utils.fan_out(get_sw_info, [node.connection for node in nodes],
+                          get_max_parallel(cfg), timeout=300,
+                          return_exceptions=True)
+
+    facts = {}
+    for node, info in zip(nodes, infos):
+        if isinstance(info, Exception):
+            logger.warning("Failed to collect facts from {0}: {1!s}".format(
+                           node.get_conn_id(), info))
+            continue
+        facts[node.get_conn_id()] = info.get_facts()
+
+    with open(cfg.facts_file, "w") as fd:
+        fd.write(pretty_yaml.dumps(facts))
+
+    logger.info("Environment facts stored in " + cfg.facts_file)
+
+
+def load_facts(results_dir):
+    "returns node id => facts, None if run has no facts"
+    fname = get_test_files(results_dir)['facts_file']
+    if not os.path.exists(fname):
+        return None
+    return yaml_load(open(fname).read())
+
+
+def format_facts_diff(facts1, facts2):
+    diff = diff_facts(facts1, facts2)
+    if len(diff) == 0:
+        return "Environment facts are the same"
+
+    tab = texttable.Texttable(max_width=200)
+    tab.set_deco(tab.HEADER | tab.VLINES | tab.BORDER)
+    tab.header(["Node", "Fact", "Value_1", "Value_2"])
+    tab.set_cols_align(["l", "l", "l", "l"])
+    tab.set_cols_dtype(["t", "t", "t", "t"])
+    for node, name, val1, val2 in diff:
+        tab.add_row([node, name,
+                     "-" if val1 is None else val1,
+                     "-" if val2 is None else val2])
+    return tab.draw()
+
+
 @contextlib.contextmanager
 def suspend_vm_nodes_ctx(unused_nodes):
     pausable_nodes_ids = [node.os_vm_id for node in unused_nodes
@@ -167,6 +300,138 @@ def generate_result_dir_name(results, name, params):
     return os.path.join(results, dir_name)
 
 
+def get_test_groups(test_nodes, vm_count, groups_cfg):
+    """
+    split test nodes into disjoint groups of vm_count nodes
+    groups_cfg:{str:Any} - 'groups' section of test config
+    returns [[Node]]
+    """
+    if vm_count == 'all':
+        return [test_nodes]
+
+    count = groups_cfg.get('count', 1)
+
+    if count == 1:
+        return [test_nodes[:vm_count]]
+
+    if count == 'auto':
+        count = len(test_nodes) // vm_count
+
+    groups = [test_nodes[idx * vm_count: (idx + 1) * vm_count]
+              for idx in range(count)]
+    groups = [group for group in groups if len(group) == vm_count]
+
+    if len(groups) != count:
+        logger.warning("Only {0} groups of {1} nodes can be created, instead of {2}".format(
+                       len(groups), vm_count, count))
+
+    return groups
+
+
+def save_sensor_data(cfg, sensor_data, t_start, t_end, suffix=""):
+    if sensor_data is None:
+        return
+
+    fname = "{0}_{1}{2}.csv".format(int(t_start), int(t_end), suffix)
+    fpath = os.path.join(cfg.sensor_storage, fname)
+
+    with open(fpath, "w") as fd:
+        fd.write("\n\n".join(sensor_data))
+
+
+def run_test_group(cfg, name, params, test_nodes, sens_nodes, results_path,
+                   other_nodes=None):
+    """
+    Run one test on a group of test nodes
+    sens_nodes:[Node] - nodes to collect sensors data from during test
+    other_nodes:[Node] - not test nodes, which test exclusively uses
+    """
+    with sensors_info_util(cfg, sens_nodes) as sensor_data:
+        test_cls = TOOL_TYPE_MAPPER[name]
+
+        remote_dir = cfg.default_test_local_folder.format(name=name)
+
+        test_cfg = TestConfig(test_cls.__name__,
+                              params=params,
+                              test_uuid=cfg.run_uuid,
+                              nodes=test_nodes,
+                              log_directory=results_path,
+                              remote_dir=remote_dir,
+                              other_nodes=other_nodes)
+
+        t_start = time.time()
+        res = test_cls(test_cfg).run()
+        t_end = time.time()
+
+    save_sensor_data(cfg, sensor_data, t_start, t_end,
+                     "_" + os.path.basename(results_path))
+    return res
+
+
+def run_test_groups(cfg, name, params, groups, not_test_nodes):
+    """
+    Run the same test on several disjoint groups of test nodes.
+    Groups are executed concurrently, unless groups.isolation is 'exclusive'.
+    Each group may get own test params (e.g. FILENAME in separated pool)
+    from groups.params list
+    """
+    groups_cfg = params.get('groups', {})
+    isolation = groups_cfg.get('isolation', 'exclusive')
+
+    if isolation not in ('exclusive', 'shared'):
+        msg = "Unknown groups isolation policy {0!r}".format(isolation)
+        logger.error(msg)
+        raise utils.StopTestError(msg)
+
+    if isolation == 'exclusive' or len(groups) == 1:
+        max_parallel = 1
+    else:
+        max_parallel = groups_cfg.get('max_parallel', len(groups))
+
+    group_params = groups_cfg.get('params', [])
+    tasks = []
+
+    for idx, group_nodes in enumerate(groups):
+        curr_params = params.copy()
+        if idx < len(group_params):
+            curr_params['params'] = params.get('params', {}).copy()
+            curr_params['params'].update(group_params[idx])
+
+        results_path = generate_result_dir_name(cfg.results_storage, name, curr_params)
+        if len(groups) != 1:
+            results_path += "_g{0}".format(idx)
+        utils.mkdirs_if_unxists(results_path)
+
+        # not test nodes are monitored by common sensors window
+        # if groups are executed concurrently. Test may affect them
+        # (e.g. drop caches on storage nodes) only if groups are
+        # executed one by one
+        if max_parallel == 1:
+            sens_nodes = group_nodes + not_test_nodes
+            other_nodes = not_test_nodes
+        else:
+            sens_nodes = group_nodes
+            other_nodes = []
+
+        tasks.append((curr_params, group_nodes, sens_nodes, results_path, other_nodes))
+
+    def run_group(task):
+        return run_test_group(cfg, name, *task)
+
+    if max_parallel == 1:
+        return map(run_group, tasks)
+
+    logger.info("Running {0} test groups, {1} in parallel".format(len(groups), max_parallel))
+    with sensors_info_util(cfg, not_test_nodes) as sensor_data:
+        t_start = time.time()
+        with ThreadPoolExecutor(max_parallel) as pool:
+            results = list(pool.map(run_group, tasks))
+        t_end = time.time()
+
+    save_sensor_data(cfg, sensor_data, t_start, t_end)
+    return results
+
+
 def run_tests(cfg, test_block, nodes):
     """
     Run test from test block
@@ -197,18 +462,15 @@ def run_tests(cfg, test_block, nodes):
 
         for vm_count in vm_limits:
             # select test nodes
-            if vm_count == 'all':
-                curr_test_nodes = test_nodes
-                unused_nodes = []
-            else:
-                curr_test_nodes = test_nodes[:vm_count]
-                unused_nodes = test_nodes[vm_count:]
+            groups = get_test_groups(test_nodes, vm_count, params.get('groups', {}))
+            groups = [group for group in groups if len(group) != 0]
 
-            if 0 == len(curr_test_nodes):
+            if 0 == len(groups):
                 continue
 
-            results_path = generate_result_dir_name(cfg.results_storage, name, params)
-            utils.mkdirs_if_unxists(results_path)
+            curr_test_nodes = sum(groups, [])
+            unused_nodes = [node for node in test_nodes
+                            if node not in curr_test_nodes]
 
             # suspend all unused virtual nodes
             if cfg.settings.get('suspend_unused_vms', True):
@@ -225,41 +487,55 @@ def run_tests(cfg, test_block, nodes):
                                  len(resumable_nodes_ids)))
                     start_vms.unpause(resumable_nodes_ids)
 
-                sens_nodes = curr_test_nodes + not_test_nodes
-                with sensors_info_util(cfg, sens_nodes) as sensor_data:
-                    test_cls = TOOL_TYPE_MAPPER[name]
-
-                    remote_dir = cfg.default_test_local_folder.format(name=name)
-
-                    test_cfg = TestConfig(test_cls.__name__,
-                                          params=params,
-                                          test_uuid=cfg.run_uuid,
-                                          nodes=test_nodes,
-                                          log_directory=results_path,
-                                          remote_dir=remote_dir)
+                results.extend(run_test_groups(cfg, name, params,
+                                               groups, not_test_nodes))
 
-                    t_start = time.time()
-                    res = test_cls(test_cfg).run()
-                    t_end = time.time()
+        yield name, results
 
-            # save sensor data
-            if sensor_data is not None:
-                fname = "{0}_{1}.csv".format(int(t_start), int(t_end))
-                fpath = os.path.join(cfg.sensor_storage, fname)
 
-                with open(fpath, "w") as fd:
-                    fd.write("\n\n".join(sensor_data))
+def reuse_connections(nodes, nodes_cache):
+    """
+    take connections and deployed tools info from already connected nodes
+    returns list of nodes, which still need to be connected
+    """
+    not_connected = []
+    for node in nodes:
+        cached = nodes_cache.get(node.conn_url)
+        if cached is not None and ssh_utils.is_alive(cached.connection):
+            node.connection = cached.connection
+            node.time_offset = cached.time_offset
+            node.tools = cached.tools
+        else:
+            not_connected.append(node)
 
-            results.append(res)
+    if len(nodes) != len(not_connected):
+        logger.info("Reuse {0} connections".format(len(nodes) - len(not_connected)))
 
-        yield name, results
+    return not_connected
 
 
 def connect_stage(cfg, ctx):
     ctx.clear_calls_stack.append(disconnect_stage)
-    connect_all(ctx.nodes)
+
+    if ctx.nodes_cache is not None:
+        connect_all(reuse_connections(ctx.nodes, ctx.nodes_cache),
+                    max_parallel=get_max_parallel(cfg))
+    else:
+        connect_all(ctx.nodes, max_parallel=get_max_parallel(cfg))
+
     ctx.nodes = [node for node in ctx.nodes if node.connection is not None]
 
+    # 0 - all nodes get artifacts from controller
+    artifacts.set_peer_fan_out(cfg.settings.get('artifacts_peer_seeds', 0),
+                               cfg.settings.get('artifacts_peer_port', artifacts.PEER_PORT))
+
+    interval = cfg.settings.get('conn_check_interval', 30)
+    if interval:
+        ctx.conn_monitor = ssh_utils.ConnectionsMonitor(
+            [node.connection for node in ctx.nodes], interval,
+            cfg.settings.get('conn_check_max_failures', 3))
+        ctx.conn_monitor.start()
+
 
 def discover_stage(cfg, ctx):
     """
@@ -473,7 +749,7 @@ def run_tests_stage(cfg, ctx):
 
         with vm_ctx as new_nodes:
             if len(new_nodes) != 0:
-                connect_all(new_nodes, True)
+                connect_all(new_nodes, True, get_max_parallel(cfg))
 
             if not cfg.no_tests:
                 for test_group in tests:
@@ -509,11 +785,29 @@ def clear_enviroment(cfg, ctx):
 
 
 def disconnect_stage(cfg, ctx):
-    ssh_utils.close_all_sessions()
+    if ctx.conn_monitor is not None:
+        ctx.conn_monitor.stop()
+        ctx.conn_monitor = None
+
+    # fio servers are started by io tests once per run
+    stop_fio_servers([node for node in ctx.nodes if node.connection is not None],
+                     get_max_parallel(cfg))
+
+    # sessions of other runs may be opened in service mode
+    if ctx.nodes_cache is None:
+        ssh_utils.close_all_sessions()
 
     for node in ctx.nodes:
+        stats = ssh_utils.get_stats(node.connection)
+        if stats is not None:
+            logger.debug("Connection to {0}: {1}".format(node.get_conn_id(), stats))
+
         if node.connection is not None:
-            node.connection.close()
+            if ctx.nodes_cache is not None:
+                # keep connection open for next run
+                ctx.nodes_cache[node.conn_url] = node
+            else:
+                node.connection.close()
 
 
 def store_raw_results_stage(cfg, ctx):
@@ -544,6 +838,8 @@ def console_report_stage(cfg, ctx):
                 rep = MysqlTest.format_for_console(data)
             elif tp == 'omg':
                 rep = OmgTest.format_for_console(data)
+            elif tp == 'io_tune':
+                rep = IOTuneTest.format_for_console(data)
             else:
                 logger.warning("Can't generate text report for " + tp)
                 continue
@@ -4,9 +4,9 @@ import json
 import logging
 import contextlib
 
-from concurrent.futures import ThreadPoolExecutor
-
-from wally.ssh_utils import (copy_paths, run_over_ssh,
+from wally.utils import fan_out, FAN_OUT_LIMIT
+from wally.artifacts import dir_bundle, deploy_many
+from wally.ssh_utils import (run_over_ssh_many, open_sftp,
                              save_to_remote, read_from_remote)
 
 
@@ -15,80 +15,115 @@ logger = logging.getLogger("wally.sensors")
 
 class SensorConfig(object):
     def __init__(self, conn, url, sensors, source_id,
-                 monitor_url=None):
+                 monitor_url=None, time_offset=None):
         self.conn = conn
         self.url = url
         self.sensors = sensors
         self.source_id = source_id
         self.monitor_url = monitor_url
+        self.time_offset = time_offset
+
+
+def rebase_csv_time(data, time_offset):
+    """
+    move time column of sensors csv data from node clock to local clock
+    """
+    res = []
+    header_expected = False
+    for line in data.split("\n"):
+        if line.strip() == 'NEW_DATA':
+            header_expected = True
+        elif header_expected:
+            header_expected = False
+        elif line.strip() != "":
+            tm, rest = (line + ",").split(",", 1)
+            line = str(int(round(float(tm) - time_offset))) + "," + rest[:-1]
+        res.append(line)
+    return "\n".join(res)
+
+
+def run_on_all(cmds, timeout=60):
+    """
+    run commands on nodes simultaneously, raise first error
+    cmds:[(SensorConfig, str)] - list of (node config, command)
+    """
+    tasks = [(node_sensor_config.conn, cmd, node_sensor_config.url)
+             for node_sensor_config, cmd in cmds]
+    results = run_over_ssh_many(tasks, timeout=timeout)
+
+    for res in results:
+        if isinstance(res, Exception):
+            raise res
+
+    return results
 
 
 @contextlib.contextmanager
-def with_sensors(sensor_configs, remote_path):
-    paths = {os.path.dirname(__file__):
-             os.path.join(remote_path, "sensors")}
+def with_sensors(sensor_configs, remote_path, max_parallel=FAN_OUT_LIMIT):
     config_remote_path = os.path.join(remote_path, "conf.json")
 
-    def deploy_sensors(node_sensor_config):
-        # check that path already exists
-        copy_paths(node_sensor_config.conn, paths)
-        with node_sensor_config.conn.open_sftp() as sftp:
+    def save_config(node_sensor_config):
+        with open_sftp(node_sensor_config.conn) as sftp:
             sensors_config = node_sensor_config.sensors.copy()
             sensors_config['source_id'] = node_sensor_config.source_id
             save_to_remote(sftp, config_remote_path,
                            json.dumps(sensors_config))
 
-    def remove_sensors(node_sensor_config):
-        run_over_ssh(node_sensor_config.conn,
-                     "rm -rf {0}".format(remote_path),
-                     node=node_sensor_config.url, timeout=10)
-
     logger.debug("Installing sensors on {0} nodes".format(len(sensor_configs)))
-    with ThreadPoolExecutor(max_workers=32) as executor:
-        list(executor.map(deploy_sensors, sensor_configs))
-        try:
-            yield
-        finally:
-            list(executor.map(remove_sensors, sensor_configs))
+    targets = [(node_sensor_config.conn,
+                node_sensor_config.url.rsplit(":", 1)[0],
+                node_sensor_config.url)
+               for node_sensor_config in sensor_configs]
+    deploy_many(targets, dir_bundle("sensors", os.path.dirname(__file__)),
+                os.path.join(remote_path, "sensors"), max_parallel, timeout=300)
+    fan_out(save_config, sensor_configs, max_parallel, timeout=300)
+    try:
+        yield
+    finally:
+        cmd = "rm -rf {0}".format(remote_path)
+        run_on_all([(node_sensor_config, cmd) for node_sensor_config in sensor_configs],
+                   timeout=10)
 
 
 @contextlib.contextmanager
-def sensors_info(sensor_configs, remote_path):
+def sensors_info(sensor_configs, remote_path, max_parallel=FAN_OUT_LIMIT):
     config_remote_path = os.path.join(remote_path, "conf.json")
 
-    def start_sensors(node_sensor_config):
+    def start_sensors():
         cmd_templ = 'env PYTHONPATH="{0}" python -m ' + \
                     "sensors.main -d start -u {1} {2}"
 
-        cmd = cmd_templ.format(remote_path,
-                               node_sensor_config.monitor_url,
-                               config_remote_path)
+        run_on_all([(node_sensor_config,
+                     cmd_templ.format(remote_path,
+                                      node_sensor_config.monitor_url,
+                                      config_remote_path))
+                    for node_sensor_config in sensor_configs])
 
-        run_over_ssh(node_sensor_config.conn, cmd,
-                     node=node_sensor_config.url)
-
-    def stop_and_gather_data(node_sensor_config):
+    def stop_sensors():
         cmd = 'env PYTHONPATH="{0}" python -m sensors.main -d stop'
         cmd = cmd.format(remote_path)
-        run_over_ssh(node_sensor_config.conn, cmd,
-                     node=node_sensor_config.url)
+        run_on_all([(node_sensor_config, cmd) for node_sensor_config in sensor_configs])
         # some magic
         time.sleep(1)
 
+    def gather_data(node_sensor_config):
         assert node_sensor_config.monitor_url.startswith("csvfile://")
 
         res_path = node_sensor_config.monitor_url.split("//", 1)[1]
-        with node_sensor_config.conn.open_sftp() as sftp:
+        with open_sftp(node_sensor_config.conn) as sftp:
             res = read_from_remote(sftp, res_path)
 
+        if node_sensor_config.time_offset:
+            res = rebase_csv_time(res, node_sensor_config.time_offset)
+
         return res
 
     results = []
 
     logger.debug("Starting sensors on {0} nodes".format(len(sensor_configs)))
-    with ThreadPoolExecutor(max_workers=32) as executor:
-        list(executor.map(start_sensors, sensor_configs))
-        try:
-            yield results
-        finally:
-            results.extend(executor.map(stop_and_gather_data, sensor_configs))
+    start_sensors()
+    try:
+        yield results
+    finally:
+        stop_sensors()
+        results.extend(fan_out(gather_data, sensor_configs, max_parallel, timeout=300))
@@ -2,9 +2,7 @@ import os.path
 import logging
 import contextlib
 
-from concurrent.futures import ThreadPoolExecutor
-
-from wally import ssh_utils
+from wally import ssh_utils, utils
 from wally.sensors.api import (with_sensors, sensors_info, SensorConfig)
 
 
@@ -31,7 +29,8 @@ def get_sensors_config_for_nodes(cfg, nodes, remote_path):
                                         node.get_conn_id(),
                                         collect_cfg,
                                         source_id=node.get_conn_id(),
-                                        monitor_url=receiver_url)
+                                        monitor_url=receiver_url,
+                                        time_offset=node.time_offset)
                 sensors_configs.append(sens_cfg)
 
     return monitored_nodes, sensors_configs, source2roles_map
@@ -41,19 +40,11 @@ PID_FILE = "/tmp/sensors.pid"
 
 
 def clear_old_sensors(sensors_configs):
-    def stop_sensors(sens_cfg):
-        with sens_cfg.conn.open_sftp() as sftp:
-            try:
-                pid = ssh_utils.read_from_remote(sftp, PID_FILE)
-                pid = int(pid.strip())
-                ssh_utils.run_over_ssh(sens_cfg.conn,
-                                       "kill -9 " + str(pid))
-                sftp.remove(PID_FILE)
-            except:
-                pass
+    cmd = "if [ -f {0} ] ; then kill -9 $(cat {0}) ; rm -f {0} ; fi".format(PID_FILE)
+    tasks = [(sens_cfg.conn, cmd, sens_cfg.url) for sens_cfg in sensors_configs]
 
-    with ThreadPoolExecutor(32) as pool:
-        list(pool.map(stop_sensors, sensors_configs))
+    # errors are ignored - sensors may be not running
+    ssh_utils.run_over_ssh_many(tasks, timeout=10, nolog=True)
 
 
 @contextlib.contextmanager
@@ -77,7 +68,8 @@ def sensors_info_util(cfg, nodes):
                                      cfg.sensors_remote_path)
 
     clear_old_sensors(sensors_configs)
-    ctx = sensors_info(sensors_configs, cfg.sensors_remote_path)
+    max_parallel = cfg.settings.get('max_parallel_nodes', utils.FAN_OUT_LIMIT)
+    ctx = sensors_info(sensors_configs, cfg.sensors_remote_path, max_parallel)
     try:
         res = ctx.__enter__()
         yield res
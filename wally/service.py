@@ -0,0 +1,413 @@
+import os
+import json
+import time
+import hmac
+import uuid
+import errno
+import urllib2
+import logging
+import threading
+import BaseHTTPServer
+import SocketServer
+
+import texttable
+
+from wally.config import load_config
+from wally.utils import sec_to_str
+from wally.suits.io import fio
+from wally.suits.io.fio_task_parser import fio_cfg_compile, execution_time
+
+
+logger = logging.getLogger("wally.service")
+
+
+DEFAULT_PORT = 8901
+DEFAULT_URL = "http://127.0.0.1:{0}".format(DEFAULT_PORT)
+DEFAULT_IP = "127.0.0.1"
+DEFAULT_TOKEN_FILE = "~/.wally/service_token"
+
+
+class Campaign(object):
+    """
+    Test run, submitted to service
+
+    config_file:str - path to yaml config on service host
+    comment:str - test information
+    resources:set(str) - nodes and pools, which campaign uses
+    estimated_time:int - expected run time in seconds, None - unknown
+    status:str - queued, running, done, failed, canceled
+    """
+    def __init__(self, config_file, comment, resources, estimated_time):
+        self.id = str(uuid.uuid4())[:8]
+        self.config_file = config_file
+        self.comment = comment
+        self.resources = resources
+        self.estimated_time = estimated_time
+        self.status = 'queued'
+        self.submit_time = time.time()
+        self.start_time = None
+        self.end_time = None
+        self.results_dir = None
+        self.eta = None
+
+    def get_yamable(self):
+        return dict((name, val) for name, val in self.__dict__.items()
+                    if name != 'resources')
+
+
+def get_campaign_resources(cfg):
+    """
+    returns set of resources, which campaign needs exclusively:
+    explicit nodes, discovered clusters and 'settings.reserve' list,
+    which may contains any extra names like storage pools
+    """
+    res = set()
+
+    for url in cfg.get('explicit_nodes', {}):
+        res.add("node:" + url)
+
+    discover = cfg.get('discover')
+    if discover is not None:
+        for cluster in discover.split(","):
+            cluster = cluster.strip()
+            if cluster.startswith('fuel'):
+                cluster = "fuel:" + cfg.clouds['fuel']['openstack_env']
+            res.add("cluster:" + cluster)
+
+    for name in cfg.settings.get('reserve', []):
+        res.add(str(name))
+
+    return res
+
+
+def estimate_campaign_time(cfg):
+    """
+    rough estimation of campaign execution time, only io tests are counted
+    """
+    total = 0
+    tests = []
+    for group in cfg.get('tests', []):
+        key, config = group.items()[0]
+        if key == 'start_test_nodes':
+            tests.extend(config.get('tests', []))
+        else:
+            tests.append(group)
+
+    for test_block in tests:
+        for name, params in test_block.items():
+            if name != 'io':
+                continue
+
+            fname = params['cfg']
+            if '/' not in fname and '.' not in fname:
+                fname = os.path.join(os.path.dirname(fio.__file__), fname + '.cfg')
+
+            limits = params.get('node_limit', 1)
+            limits_count = len(limits) if isinstance(limits, (list, tuple)) else 1
+
+            sections = fio_cfg_compile(open(fname).read(), fname, params.get('params', {}))
+            total += sum(map(execution_time, sections)) * limits_count
+
+    # +10% - is a rough estimation for additional operations
+    return int(total * 1.1)
+
+
+class CampaignsQueue(object):
+    """
+    Queue of campaigns. Campaigns are started in submission order,
+    campaign can't start while other running campaign uses any of its
+    resources. Connections to nodes are kept between campaigns.
+    """
+    def __init__(self, run_func, max_parallel=1):
+        self.run_func = run_func
+        self.max_parallel = max_parallel
+        self.campaigns = []
+        self.cond = threading.Condition()
+        self.nodes_cache = {}
+        self.stopped = False
+
+    def submit(self, config_file, comment):
+        config_file = os.path.abspath(config_file)
+        cfg = load_config(config_file)
+
+        try:
+            estimated_time = estimate_campaign_time(cfg)
+        except Exception as exc:
+            logger.warning("Can't estimate execution time for {0}: {1!s}".format(
+                           config_file, exc))
+            estimated_time = None
+
+        campaign = Campaign(config_file, comment,
+                            get_campaign_resources(cfg),
+                            estimated_time)
+
+        with self.cond:
+            self.campaigns.append(campaign)
+            self.cond.notify_all()
+
+        logger.info("Campaign {0} for {1} queued".format(campaign.id, config_file))
+        return campaign
+
+    def cancel(self, campaign_id):
+        with self.cond:
+            for campaign in self.campaigns:
+                if campaign.id == campaign_id and campaign.status == 'queued':
+                    campaign.status = 'canceled'
+                    return True
+        return False
+
+    def get_running(self):
+        return [campaign for campaign in self.campaigns
+                if campaign.status == 'running']
+
+    def get_next(self):
+        "get first queued campaign, which can be started right now"
+        running = self.get_running()
+        if len(running) >= self.max_parallel:
+            return None
+
+        busy = set()
+        for campaign in running:
+            busy.update(campaign.resources)
+
+        for campaign in self.campaigns:
+            if campaign.status == 'queued':
+                if len(campaign.resources & busy) == 0:
+                    return campaign
+                # keep submission order for campaigns with shared resources
+                busy.update(campaign.resources)
+
+        return None
+
+    def update_eta(self):
+        "should be called with self.cond locked"
+        now = time.time()
+        slots = []
+
+        for campaign in self.get_running():
+            if campaign.estimated_time is None:
+                slots.append(now)
+            else:
+                slots.append(max(now, campaign.start_time + campaign.estimated_time))
+            campaign.eta = slots[-1]
+
+        slots.extend([now] * (self.max_parallel - len(slots)))
+
+        for campaign in self.campaigns:
+            if campaign.status == 'queued':
+                slots.sort()
+                slots[0] += campaign.estimated_time or 0
+                campaign.eta = slots[0]
+
+    def get_state(self):
+        with self.cond:
+            self.update_eta()
+            return [campaign.get_yamable() for campaign in self.campaigns]
+
+    def run_campaign(self, campaign):
+        logger.info("Start campaign {0}: {1}".format(campaign.id, campaign.config_file))
+        try:
+            campaign.results_dir, code = self.run_func(campaign.config_file,
+                                                       campaign.comment,
+                                                       self.nodes_cache)
+            status = 'done' if code == 0 else 'failed'
+        except Exception:
+            logger.exception("During campaign {0}".format(campaign.id))
+            status = 'failed'
+
+        with self.cond:
+            campaign.status = status
+            campaign.end_time = time.time()
+            self.cond.notify_all()
+
+        logger.info("Campaign {0} {1}".format(campaign.id, status))
+
+    def run(self):
+        while True:
+            with self.cond:
+                campaign = self.get_next()
+                while campaign is None and not self.stopped:
+                    self.cond.wait(1)
+                    campaign = self.get_next()
+
+                if self.stopped:
+                    return
+
+                campaign.status = 'running'
+                campaign.start_time = time.time()
+
+            th = threading.Thread(target=self.run_campaign, args=(campaign,),
+                                  name="campaign-" + campaign.id)
+            th.daemon = True
+            th.start()
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+
+
+class ThreadedHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def get_token(token_file, create=False):
+    """
+    returns shared service token from token_file. If file don't exists
+    and create is set - new random token is stored to it, readable only
+    by owner
+    """
+    token_file = os.path.expanduser(token_file)
+    try:
+        with open(token_file) as fd:
+            token = fd.read().strip()
+    except IOError as exc:
+        if exc.errno != errno.ENOENT or not create:
+            raise
+    else:
+        if token == "":
+            raise ValueError("Token file {0} is empty".format(token_file))
+        return token
+
+    token_dir = os.path.dirname(token_file)
+    if token_dir != "" and not os.path.isdir(token_dir):
+        os.makedirs(token_dir, 0o700)
+
+    token = os.urandom(16).encode("hex")
+    fd = os.open(token_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "w") as token_fd:
+        token_fd.write(token + "\n")
+    return token
+
+
+def get_auth_header(token):
+    return {'Authorization': 'Token ' + token}
+
+
+def make_handler(queue, token):
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        def check_auth(self):
+            "campaigns run commands on lab nodes, so only token owners can change queue"
+            auth = self.headers.getheader('authorization', '')
+            if auth.startswith('Token ') and hmac.compare_digest(auth[6:].strip(), token):
+                return True
+            self.send_json(401, {'error': 'Wrong or no auth token'})
+            return False
+
+        def send_json(self, code, data):
+            body = json.dumps(data)
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path.rstrip('/') in ('', '/campaigns'):
+                self.send_json(200, queue.get_state())
+            elif self.path.startswith('/campaigns/'):
+                campaign_id = self.path.split('/')[2]
+                for campaign in queue.get_state():
+                    if campaign['id'] == campaign_id:
+                        self.send_json(200, campaign)
+                        return
+                self.send_json(404, {'error': 'No such campaign'})
+            else:
+                self.send_json(404, {'error': 'Unknown path'})
+
+        def do_POST(self):
+            if not self.check_auth():
+                return
+
+            if self.path.rstrip('/') != '/campaigns':
+                self.send_json(404, {'error': 'Unknown path'})
+                return
+
+            try:
+                ln = int(self.headers.getheader('content-length', 0))
+                params = json.loads(self.rfile.read(ln))
+                campaign = queue.submit(params['config_file'],
+                                        params.get('comment', ''))
+            except Exception as exc:
+                logger.exception("During campaign submission")
+                self.send_json(400, {'error': str(exc)})
+                return
+
+            self.send_json(200, campaign.get_yamable())
+
+        def do_DELETE(self):
+            if not self.check_auth():
+                return
+
+            if not self.path.startswith('/campaigns/'):
+                self.send_json(404, {'error': 'Unknown path'})
+            elif queue.cancel(self.path.split('/')[2]):
+                self.send_json(200, {})
+            else:
+                self.send_json(409, {'error': 'Campaign is not in queue'})
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    return Handler
+
+
+def serve(run_func, token, port=DEFAULT_PORT, max_parallel=1, ip=DEFAULT_IP):
+    """
+    run campaigns queue with http api on ip:port. Queue can be read by
+    anyone, who can reach the port, while submit and cancel requests
+    must have 'Authorization: Token <token>' header
+    """
+    queue = CampaignsQueue(run_func, max_parallel)
+    server = ThreadedHTTPServer((ip, port), make_handler(queue, token))
+
+    th = threading.Thread(target=server.serve_forever, name="http")
+    th.daemon = True
+    th.start()
+
+    logger.info("Wally service listening on {0}:{1}".format(ip, port))
+
+    try:
+        queue.run()
+    except KeyboardInterrupt:
+        logger.info("Stopping service")
+    finally:
+        queue.stop()
+        server.shutdown()
+
+
+def submit(url, token, config_file, comment):
+    data = json.dumps({'config_file': os.path.abspath(config_file),
+                       'comment': comment})
+    headers = get_auth_header(token)
+    headers['Content-Type'] = 'application/json'
+    req = urllib2.Request(url.rstrip('/') + '/campaigns', data, headers)
+    campaign = json.loads(urllib2.urlopen(req).read())
+    return "Campaign {0} queued".format(campaign['id'])
+
+
+def get_queue(url):
+    return json.loads(urllib2.urlopen(url.rstrip('/') + '/campaigns').read())
+
+
+def format_queue(campaigns):
+    tab = texttable.Texttable(max_width=200)
+    tab.set_deco(tab.HEADER | tab.VLINES | tab.BORDER)
+    tab.header(["Id", "Status", "Config", "Comment", "ETA", "Results"])
+
+    now = time.time()
+    for campaign in campaigns:
+        if campaign['status'] in ('queued', 'running') and campaign['eta'] is not None:
+            eta = time.strftime("%H:%M:%S", time.localtime(campaign['eta']))
+            eta += " (" + sec_to_str(max(0, int(campaign['eta'] - now))) + ")"
+        else:
+            eta = '-'
+
+        tab.add_row([campaign['id'],
+                     campaign['status'],
+                     campaign['config_file'],
+                     campaign['comment'],
+                     eta,
+                     campaign['results_dir'] or '-'])
+
+    return tab.draw()
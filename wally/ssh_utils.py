@@ -1,18 +1,24 @@
 import re
 import time
+import base64
+import contextlib
 import errno
 import random
+import select
 import socket
 import shutil
 import logging
 import os.path
 import getpass
+import tarfile
 import StringIO
 import threading
 import subprocess
 
 import paramiko
 
+from wally.agent.api import AgentSFTP, AgentConnection, start_agent
+
 
 logger = logging.getLogger("wally")
 
@@ -75,6 +81,178 @@ class Local(object):
 
 
 NODE_KEYS = {}
+AGENT_REMOTE_PATH = "/tmp/wally_agent.py"
+
+# transport settings, tuned for bulk transfers
+KEEPALIVE_INTERVAL = 10
+SSH_WINDOW_SIZE = 16 * 1024 * 1024
+SSH_MAX_PACKET_SIZE = 32 * 1024
+FAST_CIPHERS = ('aes128-ctr', 'aes128-gcm@openssh.com', 'aes256-ctr')
+
+
+def prefer_fast_ciphers():
+    "put fast ciphers first in paramiko negotiation list"
+    ciphers = getattr(paramiko.Transport, '_preferred_ciphers', None)
+    if ciphers is not None:
+        fast = [name for name in FAST_CIPHERS if name in ciphers]
+        paramiko.Transport._preferred_ciphers = \
+            tuple(fast + [name for name in ciphers if name not in fast])
+
+
+prefer_fast_ciphers()
+
+
+class ConnStats(object):
+    """
+    per connection counters
+
+    commands:int - executed commands count
+    bytes_sent:int - bytes, send to socket, including ssh overhead
+    bytes_recv:int - bytes, received from socket
+    reconnects:int - transparent reconnects count
+    """
+    def __init__(self):
+        self.commands = 0
+        self.bytes_sent = 0
+        self.bytes_recv = 0
+        self.reconnects = 0
+
+    def __str__(self):
+        return "commands={0} sent={1} recv={2} reconnects={3}".format(
+            self.commands, self.bytes_sent, self.bytes_recv, self.reconnects)
+
+
+class CountingSocket(object):
+    "socket proxy, which counts transferred bytes"
+    def __init__(self, sock, stats):
+        self.sock = sock
+        self.stats = stats
+
+    def send(self, data, *args):
+        res = self.sock.send(data, *args)
+        self.stats.bytes_sent += res
+        return res
+
+    def sendall(self, data, *args):
+        self.sock.sendall(data, *args)
+        self.stats.bytes_sent += len(data)
+
+    def recv(self, size, *args):
+        data = self.sock.recv(size, *args)
+        self.stats.bytes_recv += len(data)
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+
+def get_stats(conn):
+    "returns ConnStats for connection or None for local/foreign connections"
+    return getattr(conn, 'wally_stats', None)
+
+
+def count_command(conn):
+    stats = get_stats(conn)
+    if stats is not None:
+        stats.commands += 1
+
+
+def tune_transport(transport):
+    transport.set_keepalive(KEEPALIVE_INTERVAL)
+    # used for all new channels, including sftp
+    transport.default_window_size = SSH_WINDOW_SIZE
+    transport.default_max_packet_size = SSH_MAX_PACKET_SIZE
+
+
+class JumpHost(object):
+    """
+    pool of ssh connections to jump host (e.g. fuel master).
+    Connections to nodes behind it are opened as direct-tcpip
+    channels, spread over pool connections
+
+    uri:str - jump host connection uri
+    pool_size:int - max connections to jump host
+    """
+    def __init__(self, uri, pool_size=4, first_conn=None):
+        self.uri = uri
+        self.pool_size = pool_size
+        self.conns = [] if first_conn is None else [first_conn]
+        self.next_conn = 0
+        self.lock = threading.Lock()
+
+    def get_conn(self):
+        with self.lock:
+            self.conns = [conn for conn in self.conns if is_alive(conn)]
+            if len(self.conns) < self.pool_size:
+                self.conns.append(connect(self.uri))
+                return self.conns[-1]
+
+            self.next_conn = (self.next_conn + 1) % len(self.conns)
+            return self.conns[self.next_conn]
+
+    def open_channel(self, host, port):
+        transport = self.get_conn().get_transport()
+        return transport.open_channel('direct-tcpip', (host, port), ('127.0.0.1', 0))
+
+    def close(self):
+        with self.lock:
+            for conn in self.conns:
+                conn.close()
+            self.conns = []
+
+
+JUMP_HOSTS = {}
+
+
+def set_jump_host_for_node(host_port, jump_host):
+    "connections to host_port would be opened over jump_host:JumpHost"
+    JUMP_HOSTS[host_port] = jump_host
+
+
+def open_socket(creds, timeout, stats):
+    jump_host = JUMP_HOSTS.get((creds.host, int(creds.port)))
+    if jump_host is not None:
+        sock = jump_host.open_channel(creds.host, int(creds.port))
+    else:
+        sock = socket.create_connection((creds.host, int(creds.port)), timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    return CountingSocket(sock, stats)
+
+
+def get_agent(conn):
+    "returns alive node agent for connection or None"
+    agent = getattr(conn, 'wally_agent', None)
+    if agent is not None and agent.is_alive():
+        return agent
+    return None
+
+
+def deploy_agent(conn, node=None):
+    """
+    start node agent, all following run_over_ssh/open_sftp/BGSSHTask
+    calls for this connection would go through it
+    """
+    if isinstance(conn, Local):
+        return None
+
+    old_agent = getattr(conn, 'wally_agent', None)
+    if old_agent is not None:
+        if old_agent.is_alive():
+            return old_agent
+        old_agent.close()
+
+    conn.wally_agent = None
+    conn.wally_agent = start_agent(conn, AGENT_REMOTE_PATH, node=node)
+    return conn.wally_agent
+
+
+def open_sftp(conn):
+    ensure_connected(conn)
+    agent = get_agent(conn)
+    if agent is not None:
+        return AgentSFTP(agent)
+    return conn.open_sftp()
 
 
 def exists(sftp, path):
@@ -110,6 +288,14 @@ def ssh_connect(creds, conn_timeout=60, reuse_conn=None):
     else:
         ssh = reuse_conn
 
+    stats = get_stats(ssh)
+    if stats is None:
+        stats = ssh.wally_stats = ConnStats()
+        ssh.wally_lock = threading.RLock()
+
+    # used for transparent reconnect
+    ssh.wally_creds = creds
+
     etime = time.time() + conn_timeout
 
     while True:
@@ -118,9 +304,11 @@ def ssh_connect(creds, conn_timeout=60, reuse_conn=None):
             c_tcp_timeout = min(tcp_timeout, tleft)
 
             if paramiko.__version_info__ >= (1, 15, 2):
-                banner_timeout = {'banner_timeout': min(banner_timeout, tleft)}
+                connect_params = {'banner_timeout': min(banner_timeout, tleft)}
             else:
-                banner_timeout = {}
+                connect_params = {}
+
+            connect_params['sock'] = open_socket(creds, c_tcp_timeout, stats)
 
             if creds.passwd is not None:
                 ssh.connect(creds.host,
@@ -130,7 +318,7 @@ def ssh_connect(creds, conn_timeout=60, reuse_conn=None):
                             port=creds.port,
                             allow_agent=False,
                             look_for_keys=False,
-                            **banner_timeout)
+                            **connect_params)
             elif creds.key_file is not None:
                 ssh.connect(creds.host,
                             username=creds.user,
@@ -138,7 +326,7 @@ def ssh_connect(creds, conn_timeout=60, reuse_conn=None):
                             key_filename=creds.key_file,
                             look_for_keys=False,
                             port=creds.port,
-                            **banner_timeout)
+                            **connect_params)
             elif (creds.host, creds.port) in NODE_KEYS:
                 ssh.connect(creds.host,
                             username=creds.user,
@@ -146,7 +334,7 @@ def ssh_connect(creds, conn_timeout=60, reuse_conn=None):
                             pkey=NODE_KEYS[(creds.host, creds.port)],
                             look_for_keys=False,
                             port=creds.port,
-                            **banner_timeout)
+                            **connect_params)
             else:
                 key_file = os.path.expanduser('~/.ssh/id_rsa')
                 ssh.connect(creds.host,
@@ -155,7 +343,9 @@ def ssh_connect(creds, conn_timeout=60, reuse_conn=None):
                             key_filename=key_file,
                             look_for_keys=False,
                             port=creds.port,
-                            **banner_timeout)
+                            **connect_params)
+
+            tune_transport(ssh.get_transport())
             return ssh
         except paramiko.PasswordRequiredException:
             raise
@@ -255,13 +445,13 @@ def put_dir_recursively(sftp, localpath, remotepath, preserve_perm=True):
 
 
 def delete_file(conn, path):
-    sftp = conn.open_sftp()
+    sftp = open_sftp(conn)
     sftp.remove(path)
     sftp.close()
 
 
 def copy_paths(conn, paths):
-    sftp = conn.open_sftp()
+    sftp = open_sftp(conn)
     try:
         for src, dst in paths.items():
             try:
@@ -364,7 +554,181 @@ def reconnect(conn, uri, **params):
 
     creds = parse_ssh_uri(uri)
     creds.port = int(creds.port)
-    return ssh_connect(creds, reuse_conn=conn, **params)
+    return restore_connection(conn, creds, **params)
+
+
+def restore_connection(conn, creds, **params):
+    "reconnect existing connection, agent is restarted if it was used"
+    conn = ssh_connect(creds, reuse_conn=conn, **params)
+    get_stats(conn).reconnects += 1
+
+    # agent channel is lost together with old transport
+    if getattr(conn, 'wally_agent', None) is not None:
+        node = conn.wally_agent.node
+        conn.wally_agent.close()
+        conn.wally_agent = None
+        try:
+            deploy_agent(conn, node)
+        except Exception as exc:
+            logger.warning("Can't restart agent on {0}: {1!s}".format(node, exc))
+
+    return conn
+
+
+def is_alive(conn):
+    if isinstance(conn, Local):
+        return True
+
+    transport = conn.get_transport()
+    return transport is not None and transport.is_active()
+
+
+def probe_connection(conn, timeout=30):
+    "check that node really responds, not only that transport is open"
+    if not is_alive(conn):
+        return False
+
+    try:
+        agent = get_agent(conn)
+        if agent is not None:
+            agent.call('ping', call_timeout=timeout)
+        else:
+            run_over_ssh(conn, "true", timeout=timeout, nolog=True)
+        return True
+    except (OSError, IOError, paramiko.SSHException):
+        return False
+
+
+# id(connection) => amount of BGSSHTask, running over it. Probe of busy
+# node may fail just because node is loaded by test, such connections
+# are never closed by probe - only dead transport is restored
+busy_conns_lock = threading.Lock()
+busy_conns = {}
+
+
+def mark_busy(conn):
+    with busy_conns_lock:
+        busy_conns[id(conn)] = busy_conns.get(id(conn), 0) + 1
+
+
+def mark_idle(conn):
+    with busy_conns_lock:
+        cnt = busy_conns.pop(id(conn), 0) - 1
+        if cnt > 0:
+            busy_conns[id(conn)] = cnt
+
+
+def is_busy(conn):
+    with busy_conns_lock:
+        return id(conn) in busy_conns
+
+
+def ensure_connected(conn, probe=False, conn_timeout=30):
+    """
+    transparently reconnect dead connection
+    probe:bool - check connection with request, not only transport state
+    returns True if connection is usable
+    """
+    creds = getattr(conn, 'wally_creds', None)
+    if isinstance(conn, Local) or creds is None:
+        return True
+
+    if is_alive(conn) and (not probe or is_busy(conn)):
+        return True
+
+    with conn.wally_lock:
+        if probe:
+            if probe_connection(conn):
+                return True
+            conn.close()
+        elif is_alive(conn):
+            # reconnected by other thread
+            return True
+
+        logger.warning("Connection to {0} is lost, reconnecting".format(creds.host))
+        try:
+            restore_connection(conn, creds, conn_timeout=conn_timeout)
+            return True
+        except Exception as exc:
+            logger.error("Can't reconnect to {0}: {1!s}".format(creds.host, exc))
+            return False
+
+
+monitor_pause_lock = threading.Lock()
+monitor_pause = [0]
+
+
+@contextlib.contextmanager
+def pause_monitoring():
+    """
+    stop ConnectionsMonitor probes while block is executed, e.g.
+    during test run, when probes disturb the test and slow
+    responses of loaded nodes can be taken as dead connection
+    """
+    with monitor_pause_lock:
+        monitor_pause[0] += 1
+    try:
+        yield
+    finally:
+        with monitor_pause_lock:
+            monitor_pause[0] -= 1
+
+
+def is_monitoring_paused():
+    with monitor_pause_lock:
+        return monitor_pause[0] != 0
+
+
+class ConnectionsMonitor(threading.Thread):
+    """
+    background health check for connections, dead connections
+    are reconnected before they are needed by tests.
+
+    conns:[connection] - connections to check
+    interval:int - seconds between checks
+    max_failures:int - connection is reconnected only after this
+                       amount of consecutive failed probes
+    failures:{id(connection): int} - current failed probes count
+    """
+    def __init__(self, conns, interval=30, max_failures=3):
+        threading.Thread.__init__(self, name="conn-monitor")
+        self.daemon = True
+        self.conns = conns
+        self.interval = interval
+        self.max_failures = max_failures
+        self.failures = {}
+        self.stop_event = threading.Event()
+
+    def check(self, conn):
+        if isinstance(conn, Local) or getattr(conn, 'wally_creds', None) is None:
+            return
+
+        if is_busy(conn) or probe_connection(conn):
+            self.failures.pop(id(conn), None)
+            return
+
+        fails = self.failures.get(id(conn), 0) + 1
+        if fails < self.max_failures:
+            logger.debug("Probe of connection to {0} failed {1} time(s)"
+                         .format(conn.wally_creds.host, fails))
+            self.failures[id(conn)] = fails
+            return
+
+        self.failures.pop(id(conn), None)
+        ensure_connected(conn, probe=True)
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            for conn in self.conns:
+                if self.stop_event.is_set() or is_monitoring_paused():
+                    break
+                try:
+                    self.check(conn)
+                except Exception:
+                    logger.exception("During connection check")
+
+    def stop(self):
+        self.stop_event.set()
 
 
 def connect(uri, **params):
@@ -382,14 +746,38 @@ all_sessions = {}
 
 
 class BGSSHTask(object):
+    """
+    background task on node. If node agent is available - process is
+    started by agent and exit is reported by it, otherwise
+    screen + ps/ls polling is used.
+
+    agent:AgentConnection - agent, used to control process or None
+    own_pid:bool - process was spawned by current agent and it would
+                   report process exit. False after reconnect - new
+                   agent only can check /proc/<pid>
+    """
     CHECK_RETRY = 5
 
     def __init__(self, node, use_sudo):
         self.node = node
         self.pid = None
         self.use_sudo = use_sudo
+        self.agent = None
+        self.own_pid = False
+        self.busy = False
 
     def start(self, orig_cmd, **params):
+        ensure_connected(self.node.connection)
+        mark_busy(self.node.connection)
+        self.busy = True
+
+        self.agent = get_agent(self.node.connection)
+        if self.agent is not None:
+            count_command(self.node.connection)
+            self.pid = self.agent.spawn(orig_cmd)
+            self.own_pid = True
+            return
+
         uniq_name = 'test'
         cmd = "screen -S {0} -d -m {1}".format(uniq_name, orig_cmd)
         run_over_ssh(self.node.connection, cmd,
@@ -409,10 +797,31 @@ class BGSSHTask(object):
         if self.pid is None:
             self.pid = -1
 
+    def refresh_agent(self):
+        """
+        should be called after reconnect - agent, which spawned process,
+        is closed together with old transport and new one doesn't know
+        this pid, so process state is polled via /proc since now
+        """
+        agent = get_agent(self.node.connection)
+        if agent is not self.agent:
+            self.agent = agent
+            self.own_pid = False
+
+    def release(self):
+        "task isn't controlled anymore, connection can be probed again"
+        if self.busy:
+            self.busy = False
+            mark_idle(self.node.connection)
+
     def check_running(self):
         assert self.pid is not None
         if -1 == self.pid:
             return False
+
+        if self.agent is not None:
+            return self.agent.is_running(self.pid)
+
         try:
             run_over_ssh(self.node.connection,
                          "ls /proc/{0}".format(self.pid),
@@ -425,14 +834,24 @@ class BGSSHTask(object):
         assert self.pid is not None
         if self.pid == -1:
             return True
+
+        if self.agent is not None:
+            try:
+                self.agent.kill(self.pid, soft=soft, use_sudo=self.use_sudo)
+                return True
+            except OSError:
+                return False
+
         try:
+            # kill children first - otherwise fio survives its bash wrapper
             if soft:
-                cmd = "kill {0}"
+                cmd = "pkill -P {0} ; kill {0}"
             else:
-                cmd = "kill -9 {0}"
+                cmd = "pkill -9 -P {0} ; kill -9 {0}"
 
             if self.use_sudo:
-                cmd = "sudo " + cmd
+                cmd = cmd.replace("pkill", "sudo pkill")
+                cmd = cmd.replace("; kill", "; sudo kill")
 
             run_over_ssh(self.node.connection,
                          cmd.format(self.pid), nolog=True)
@@ -440,40 +859,80 @@ class BGSSHTask(object):
         except OSError:
             return False
 
-    def wait(self, soft_timeout, timeout):
+    def stop(self):
+        self.kill()
+        time.sleep(1)
+        if self.check_running():
+            self.kill(soft=False)
+
+    def sleep_till_exit(self, seconds):
+        "sleep up to seconds, returns True if task is finished"
+        if self.agent is not None and self.own_pid:
+            if self.agent.wait_exit(self.pid, seconds):
+                self.agent.forget(self.pid)
+                return True
+            return False
+
+        time.sleep(seconds)
+        return not self.check_running()
+
+    def wait(self, soft_timeout, timeout, stop_check=None):
+        """
+        wait till task finished
+        stop_check:callable - returns True if task should be killed
+                              immediatelly, e.g. test is aborted
+        returns False if task was killed
+        """
         end_of_wait_time = timeout + time.time()
         soft_end_of_wait_time = soft_timeout + time.time()
 
-        # time_till_check = random.randint(5, 10)
-        time_till_check = 2
+        if stop_check is None:
+            stop_check = lambda: False
 
-        # time_till_first_check = random.randint(2, 6)
+        time_till_check = 2
         time_till_first_check = 2
-        time.sleep(time_till_first_check)
-        if not self.check_running():
+
+        if self.sleep_till_exit(time_till_first_check):
             return True
 
-        while self.check_running() and time.time() < soft_end_of_wait_time:
-            # time.sleep(soft_end_of_wait_time - time.time())
-            time.sleep(time_till_check)
+        while time.time() < soft_end_of_wait_time:
+            if stop_check():
+                self.stop()
+                return False
+
+            if self.sleep_till_exit(time_till_check):
+                return True
 
         while end_of_wait_time > time.time():
-            time.sleep(time_till_check)
-            if not self.check_running():
+            if stop_check():
                 break
-        else:
-            self.kill()
-            time.sleep(1)
-            if self.check_running():
-                self.kill(soft=False)
-            return False
-        return True
+
+            if self.sleep_till_exit(time_till_check):
+                return True
+
+        self.stop()
+        return False
 
 
 def run_over_ssh(conn, cmd, stdin_data=None, timeout=60,
                  nolog=False, node=None):
     "should be replaces by normal implementation, with select"
 
+    ensure_connected(conn)
+    count_command(conn)
+
+    agent = get_agent(conn)
+    if agent is not None:
+        if not nolog:
+            logger.debug("SSH:{0} Exec {1!r}".format(node, cmd))
+
+        code, output = agent.run(cmd, timeout=timeout, stdin_data=stdin_data)
+        if code != 0:
+            templ = "SSH:{0} Cmd {1!r} failed with code {2}. Output: {3}"
+            raise OSError(templ.format(node, cmd, code, output))
+
+        return output
+
     if isinstance(conn, Local):
         if not nolog:
             logger.debug("SSH:local Exec {0!r}".format(cmd))
@@ -513,20 +972,21 @@ def run_over_ssh(conn, cmd, stdin_data=None, timeout=60,
 
         session.settimeout(1)
         session.shutdown_write()
-        output = ""
+        output = []
 
         while True:
             try:
-                ndata = session.recv(1024)
-                output += ndata
+                ndata = session.recv(64 * 1024)
                 if "" == ndata:
                     break
+                output.append(ndata)
             except socket.timeout:
                 pass
 
             if time.time() - stime > timeout:
-                raise OSError(output + "\nExecution timeout")
+                raise OSError("".join(output) + "\nExecution timeout")
 
+        output = "".join(output)
         code = session.recv_exit_status()
     finally:
         found = False
@@ -545,6 +1005,193 @@ def run_over_ssh(conn, cmd, stdin_data=None, timeout=60,
     return output
 
 
+def run_over_ssh_many(tasks, timeout=60, max_parallel=256, nolog=False):
+    """
+    execute commands on many nodes from current thread, without
+    thread per node. ssh channels are polled, agent requests are
+    send asynchronously.
+
+    tasks:[(conn, cmd, node)]
+    timeout:int - per command timeout
+    max_parallel:int - max commands running simultaneously
+
+    returns list of commands outputs in tasks order, failed
+    commands get OSError instance instead of output
+    """
+    templ = "SSH:{0} Cmd {1!r} failed with code {2}. Output: {3}"
+    results = [None] * len(tasks)
+    queue = list(enumerate(tasks))[::-1]
+
+    # idx => [start_time, session or None, future or None, output chunks]
+    active = {}
+    by_fd = {}
+    poller = select.poll()
+
+    def finish(idx, res):
+        stime, session, future, output = active.pop(idx)
+        if session is not None:
+            fd = session.fileno()
+            poller.unregister(fd)
+            del by_fd[fd]
+            session.close()
+        results[idx] = res
+
+    while len(queue) != 0 or len(active) != 0:
+        while len(queue) != 0 and len(active) < max_parallel:
+            idx, (conn, cmd, node) = queue.pop()
+
+            if not nolog:
+                logger.debug("SSH:{0} Exec {1!r}".format(node, cmd))
+
+            if isinstance(conn, Local):
+                try:
+                    results[idx] = run_over_ssh(conn, cmd, timeout=timeout,
+                                                nolog=True, node=node)
+                except OSError as exc:
+                    results[idx] = exc
+                continue
+
+            try:
+                ensure_connected(conn)
+                count_command(conn)
+                agent = get_agent(conn)
+                if agent is not None:
+                    future = agent.call_async('run', cmd=cmd, timeout=timeout)
+                    active[idx] = [time.time(), None, future, []]
+                else:
+                    session = conn.get_transport().open_session()
+                    session.set_combine_stderr(True)
+                    session.exec_command(cmd)
+                    session.shutdown_write()
+                    active[idx] = [time.time(), session, None, []]
+                    by_fd[session.fileno()] = idx
+                    poller.register(session.fileno(), select.POLLIN)
+            except (socket.error, paramiko.SSHException) as exc:
+                results[idx] = OSError(templ.format(node, cmd, None, exc))
+
+        for fd, _ in poller.poll(100):
+            idx = by_fd[fd]
+            session = active[idx][1]
+            data = session.recv(64 * 1024)
+            if data != "":
+                active[idx][3].append(data)
+                continue
+
+            conn, cmd, node = tasks[idx]
+            code = session.recv_exit_status()
+            output = "".join(active[idx][3])
+            if code != 0:
+                finish(idx, OSError(templ.format(node, cmd, code, output)))
+            else:
+                finish(idx, output)
+
+        if len(by_fd) == 0 and len(active) != 0:
+            time.sleep(0.1)
+
+        now = time.time()
+        for idx, (stime, session, future, output) in active.items():
+            conn, cmd, node = tasks[idx]
+            if future is not None and future.done():
+                try:
+                    res = AgentConnection.get_result(future.result())
+                    code, output = res['code'], res['out']
+                    if code != 0:
+                        output = base64.b64decode(output)
+                        finish(idx, OSError(templ.format(node, cmd, code, output)))
+                    else:
+                        finish(idx, base64.b64decode(output))
+                except (IOError, OSError, paramiko.SSHException) as exc:
+                    finish(idx, OSError(templ.format(node, cmd, None, exc)))
+            elif now - stime > timeout + (10 if future is not None else 0):
+                finish(idx, OSError("".join(output) + "\nExecution timeout"))
+
+    return results
+
+
+def get_files_stream(conn, folder, files, compress=False, timeout=600, node=None):
+    """
+    download files from remote folder as tar stream over one channel.
+    Files are written directly to local paths as data arrives, no
+    archives are created on node or locally.
+
+    files:{str: str} - remote file name in folder => local path
+    compress:bool - compress stream with gzip -1 on node
+    """
+    if isinstance(conn, Local):
+        for fname, local_path in files.items():
+            shutil.copyfile(os.path.join(folder, fname), local_path)
+        return
+
+    cmd = "cd {0} && tar cf - {1}".format(folder, " ".join(sorted(files)))
+    if compress:
+        cmd = "set -o pipefail ; " + cmd + " | gzip -1"
+        cmd = "bash -c '{0}'".format(cmd)
+
+    ensure_connected(conn)
+    count_command(conn)
+
+    logger.debug("SSH:{0} Exec {1!r}".format(node, cmd))
+    session = conn.get_transport().open_session()
+    received = set()
+    try:
+        session.settimeout(timeout)
+        session.exec_command(cmd)
+        session.shutdown_write()
+
+        stream = session.makefile('rb')
+        arch = tarfile.open(fileobj=stream, mode='r|gz' if compress else 'r|')
+        for member in arch:
+            if member.name in files and member.isfile():
+                src = arch.extractfile(member)
+                with open(files[member.name], "wb") as dst:
+                    shutil.copyfileobj(src, dst, 1024 * 1024)
+                received.add(member.name)
+        arch.close()
+
+        code = session.recv_exit_status()
+        err = session.recv_stderr(64 * 1024) if session.recv_stderr_ready() else ""
+    except (socket.timeout, tarfile.TarError) as exc:
+        raise OSError("SSH:{0} Failed to get files from {1}: {2!s}".format(node, folder, exc))
+    finally:
+        session.close()
+
+    if code != 0:
+        templ = "SSH:{0} Cmd {1!r} failed with code {2}. Output: {3}"
+        raise OSError(templ.format(node, cmd, code, err))
+
+    missing = set(files) - received
+    if len(missing) != 0:
+        raise IOError("SSH:{0} Files {1} not found in {2}".format(
+                      node, ",".join(sorted(missing)), folder))
+
+
+def get_time_offset(conn, samples=5, node=None):
+    """
+    estimate clock offset of remote node, NTP-style
+    returns (offset, rtt) - remote_time = local_time + offset
+    sample with minimal round trip time is used
+    """
+    if isinstance(conn, Local):
+        return 0.0, 0.0
+
+    best = None
+    for _ in range(samples):
+        t1 = time.time()
+        out = run_over_ssh(conn, "date +%s.%N", nolog=True, node=node)
+        t2 = time.time()
+
+        try:
+            remote_time = float(out.strip())
+        except ValueError:
+            raise OSError("Can't parse remote time {0!r}".format(out))
+
+        rtt = t2 - t1
+        if best is None or rtt < best[1]:
+            best = (remote_time - (t1 + t2) / 2, rtt)
+
+    return best
+
+
 def close_all_sessions():
     with all_sessions_lock:
         for session in all_sessions.values():
@@ -0,0 +1,318 @@
+"""
+Block device statistic sampler, executed on test node by io test as
+'python diskstats.py ARGS' in background, while fio is running.
+Doesn't depend on wally, controller imports it to load logs.
+
+Counters from /proc/diskstats for devices, which hold test files, and
+all their slaves (lvm, md, dm-crypt) are stored every INTERVAL ms into
+binary log. Log starts with one line json header, followed by fixed
+size records of native doubles: monotonic time in seconds and FIELDS
+for each device in header order. Sampler stops on SIGTERM/SIGINT.
+
+usage: diskstats.py INTERVAL_MS LOG_FILE TEST_FILE [TEST_FILE ...]
+"""
+import os
+import sys
+import json
+import stat
+import time
+import array
+import signal
+
+
+MAGIC = "wally-diskstats"
+VERSION = 1
+
+# field name => column in /proc/diskstats line
+FIELDS = (('read_ios', 3),
+          ('read_sectors', 5),
+          ('read_ticks', 6),
+          ('write_ios', 7),
+          ('write_sectors', 9),
+          ('write_ticks', 10),
+          ('in_flight', 11),
+          ('io_ticks', 12),
+          ('time_in_queue', 13))
+
+FIELD_NAMES = [name for name, _ in FIELDS]
+
+
+def get_monotonic():
+    "returns function, which returns monotonic time in seconds"
+    if hasattr(time, 'monotonic'):
+        return time.monotonic
+
+    try:
+        import ctypes
+
+        class timespec(ctypes.Structure):
+            _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+        librt = ctypes.CDLL('librt.so.1', use_errno=True)
+        clock_gettime = librt.clock_gettime
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+        CLOCK_MONOTONIC = 1
+
+        def monotonic():
+            ts = timespec()
+            if clock_gettime(CLOCK_MONOTONIC, ctypes.pointer(ts)) != 0:
+                raise OSError(ctypes.get_errno(), "clock_gettime failed")
+            return ts.tv_sec + ts.tv_nsec * 1E-9
+
+        monotonic()
+        return monotonic
+    except (ImportError, OSError, AttributeError):
+        # elapsed time in clock ticks, good enough for 100ms samples
+        return lambda: os.times()[4]
+
+
+def get_devices(path):
+    """
+    returns names of block devices, which hold path -
+    device itself first and then all its slaves
+    """
+    st = os.stat(path)
+    dev = st.st_rdev if stat.S_ISBLK(st.st_mode) else st.st_dev
+    sys_path = os.path.realpath("/sys/dev/block/{0}:{1}".format(os.major(dev), os.minor(dev)))
+
+    res = []
+    stack = [sys_path]
+    while len(stack) != 0:
+        sys_path = stack.pop()
+        name = os.path.basename(sys_path)
+        if name in res:
+            continue
+        res.append(name)
+
+        slaves_dir = os.path.join(sys_path, "slaves")
+        if os.path.isdir(slaves_dir):
+            for slave in sorted(os.listdir(slaves_dir), reverse=True):
+                stack.append(os.path.realpath(os.path.join(slaves_dir, slave)))
+
+    return res
+
+
+class Sampler(object):
+    """
+    Write diskstats samples into binary log
+
+    devices:[str] - devices names, as in /proc/diskstats
+    interval:float - sampling interval in seconds
+    test_files:[str] - test files, stored into header, if set
+    test_devices:[str] - devices, which hold test_files, one per file
+    """
+    def __init__(self, devices, log_file, interval, test_files=None, test_devices=None):
+        self.devices = devices
+        self.log_file = log_file
+        self.interval = interval
+        self.test_files = test_files
+        self.test_devices = test_devices
+        self.monotonic = get_monotonic()
+        self.running = True
+
+    def get_header(self):
+        header = {'magic': MAGIC,
+                  'version': VERSION,
+                  'interval': self.interval,
+                  'devices': self.devices,
+                  'fields': FIELD_NAMES,
+                  'byteorder': sys.byteorder,
+                  'start_time': time.time(),
+                  'start_mono': self.monotonic()}
+        if self.test_files is not None:
+            header['test_files'] = self.test_files
+            header['test_devices'] = self.test_devices
+        return header
+
+    def sample(self, fd):
+        "returns record for current counters"
+        fd.seek(0)
+        found = {}
+        for line in fd.read().split("\n"):
+            items = line.split()
+            if len(items) >= 14 and items[2] in self.devices:
+                found[items[2]] = items
+
+        rec = array.array('d', [self.monotonic()])
+        for dev in self.devices:
+            items = found.get(dev)
+            if items is None:
+                rec.extend([0.0] * len(FIELDS))
+            else:
+                rec.extend([float(items[pos]) for _, pos in FIELDS])
+        return rec
+
+    def stop(self, *args):
+        self.running = False
+
+    def run(self, should_stop=None):
+        "sample till stop() called or should_stop() returns True"
+        stats_fd = open("/proc/diskstats")
+        try:
+            with open(self.log_file, "wb") as fd:
+                fd.write((json.dumps(self.get_header()) + "\n").encode('ascii'))
+                next_time = self.monotonic()
+                while self.running:
+                    rec = self.sample(stats_fd)
+                    fd.write(rec.tostring() if hasattr(rec, 'tostring') else rec.tobytes())
+                    # log may be read at any moment, when sampler is killed
+                    fd.flush()
+
+                    next_time += self.interval
+                    while self.running:
+                        if should_stop is not None and should_stop():
+                            self.running = False
+                            break
+
+                        sleep_time = next_time - self.monotonic()
+                        if sleep_time <= 0:
+                            break
+                        time.sleep(min(sleep_time, 0.1))
+        finally:
+            stats_fd.close()
+
+
+def make_sampler(test_files, log_file, interval):
+    "returns Sampler for devices, which hold test files"
+    devices = []
+    test_devices = []
+    for test_file in test_files:
+        file_devices = get_devices(test_file)
+        test_devices.append(file_devices[0])
+        devices.extend(dev for dev in file_devices if dev not in devices)
+    return Sampler(devices, log_file, interval, test_files, test_devices)
+
+
+def get_test_devices(header):
+    """
+    returns [(test file, device)] - devices, which hold test files.
+    Old logs have no test files, test device is the first one
+    """
+    if 'test_files' in header:
+        return list(zip(header['test_files'], header['test_devices']))
+    return [(None, header['devices'][0])]
+
+
+def load_log(fname):
+    """
+    returns (header, data), data is array of doubles, which holds
+    all records one by one. See get_series to select values
+    """
+    with open(fname, "rb") as fd:
+        header = json.loads(fd.readline().decode('ascii'))
+        body = fd.read()
+
+    if header.get('magic') != MAGIC or header.get('version') != VERSION:
+        raise ValueError("{0} isn't a diskstats log".format(fname))
+
+    rec_len = 1 + len(header['devices']) * len(header['fields'])
+    rec_size = rec_len * array.array('d').itemsize
+    # last record may be partially written, if sampler was killed
+    body = body[:len(body) - len(body) % rec_size]
+
+    data = array.array('d')
+    if hasattr(data, 'frombytes'):
+        data.frombytes(body)
+    else:
+        data.fromstring(body)
+
+    if header['byteorder'] != sys.byteorder:
+        data.byteswap()
+
+    return header, data
+
+
+def get_series(header, data, fields, device=None):
+    """
+    returns (times, values) - times of samples in seconds from the first
+    one and sum of fields values for device (test device by default)
+    """
+    if device is None:
+        device = header['devices'][0]
+
+    nfields = len(header['fields'])
+    rec_len = 1 + len(header['devices']) * nfields
+    dev_pos = 1 + header['devices'].index(device) * nfields
+
+    times = data[::rec_len]
+    start = times[0] if len(times) != 0 else 0.0
+    times = [tm - start for tm in times]
+
+    vals = None
+    for field in fields:
+        fvals = data[dev_pos + header['fields'].index(field)::rec_len]
+        if vals is None:
+            vals = list(fvals)
+        else:
+            vals = [v1 + v2 for v1, v2 in zip(vals, fvals)]
+
+    return times, vals
+
+
+def get_rate_series(header, data, fields, device=None):
+    """
+    returns [(end time, rate per second)] for counters fields,
+    sum of fields changes between samples divided by time between them
+    """
+    times, vals = get_series(header, data, fields, device)
+    res = []
+    for idx in range(1, len(times)):
+        dtime = times[idx] - times[idx - 1]
+        if dtime > 0:
+            res.append((times[idx], (vals[idx] - vals[idx - 1]) / dtime))
+    return res
+
+
+def split_log(fname, parts):
+    """
+    split log into several logs by time ranges
+
+    parts:[(str, float, float)] - (log file, begin, end), begin and
+          end are seconds from the first sample
+    """
+    header, data = load_log(fname)
+    rec_len = 1 + len(header['devices']) * len(header['fields'])
+    times = data[::rec_len]
+    start = times[0] if len(times) != 0 else 0.0
+
+    for part_fname, begin, end in parts:
+        part_header = dict(header)
+        # data is converted to native order by load_log
+        part_header['byteorder'] = sys.byteorder
+
+        if len(times) == 0:
+            # sampler was killed before first record, parts are header-only
+            part = data[:0]
+        else:
+            # keep previous sample, so counters changes are known for all range
+            first = 0
+            while first + 1 < len(times) and times[first + 1] - start <= begin:
+                first += 1
+
+            last = first
+            while last < len(times) and times[last] - start <= end:
+                last += 1
+
+            part_header['start_time'] = header['start_time'] + times[first] - start
+            part_header['start_mono'] = times[first]
+            part = data[first * rec_len:last * rec_len]
+
+        with open(part_fname, "wb") as fd:
+            fd.write((json.dumps(part_header) + "\n").encode('ascii'))
+            fd.write(part.tostring() if hasattr(part, 'tostring') else part.tobytes())
+
+
+def main(argv):
+    interval = float(argv[1]) / 1000
+    log_file = argv[2]
+    test_files = argv[3:]
+
+    sampler = make_sampler(test_files, log_file, interval)
+    signal.signal(signal.SIGTERM, sampler.stop)
+    signal.signal(signal.SIGINT, sampler.stop)
+    sampler.run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -1,12 +1,11 @@
 import re
 import time
 import json
-import stat
-import random
 import shutil
 import os.path
 import logging
 import datetime
+import threading
 import functools
 import subprocess
 import collections
@@ -18,14 +17,23 @@ from paramiko.ssh_exception import SSHException
 from concurrent.futures import ThreadPoolExecutor, wait
 
 import wally
+from wally import artifacts
 from wally.pretty_yaml import dumps
+from wally.hw_info import get_numa_info, format_cpu_list, SKIP_DISKS
 from wally.statistic import round_3_digit, data_property, average
-from wally.utils import ssize2b, sec_to_str, StopTestError, Barrier, get_os
-from wally.ssh_utils import (save_to_remote, read_from_remote, BGSSHTask, reconnect)
-
+from wally.utils import (ssize2b, b2ssize, sec_to_str, StopTestError, Barrier, get_os,
+                         TaksFinished, fan_out, clean_resource)
+from wally.ssh_utils import (save_to_remote, read_from_remote, BGSSHTask, reconnect,
+                             Local, open_sftp, get_agent, ensure_connected,
+                             get_files_stream, run_over_ssh_many, parse_ssh_uri,
+                             pause_monitoring, JUMP_HOSTS)
+
+from . import diskstats
 from .fio_task_parser import (execution_time, fio_cfg_compile,
                               get_test_summary, get_test_summary_tuple,
-                              get_test_sync_mode, FioJobSection)
+                              get_test_sync_mode, FioJobSection, FioJobBatch,
+                              is_batch_compatible, device_label, split_by_devices,
+                              get_job_device)
 
 from ..itest import (TimeSeriesValue, PerfTest, TestResults,
                      run_on_node, TestConfig, MeasurementMatrix)
@@ -68,11 +76,54 @@ def load_fio_log_file(fname):
     return TimeSeriesValue(vals)
 
 
+def parse_fio_json(data):
+    """
+    parse fio json output. It may starts with fio messages and contains
+    several status reports, if fio was started with --status-interval,
+    the last one is the final report
+    """
+    decoder = json.JSONDecoder()
+    pos = data.index('{')
+    while True:
+        res, pos = decoder.raw_decode(data, pos)
+        pos = data.find('{', pos)
+        if pos == -1:
+            return res
+
+
 READ_IOPS_DISCSTAT_POS = 3
 WRITE_IOPS_DISCSTAT_POS = 7
 
 
+def load_diskstats_file(fname):
+    """
+    returns (iops:sys series, {test file label: iops:sys series}) from
+    binary diskstats log, see diskstats.py. First is summ for all test
+    devices, per file series are empty for logs of previous versions
+    """
+    header, data = diskstats.load_log(fname)
+    fields = ('read_ios', 'write_ios')
+    test_devices = diskstats.get_test_devices(header)
+
+    per_dev = {}
+    for test_file, dev in test_devices:
+        if dev not in per_dev:
+            per_dev[dev] = diskstats.get_rate_series(header, data, fields, dev)
+
+    series = per_dev.values()
+    total = [(tm, sum(rates[idx][1] for rates in series))
+             for idx, (tm, _) in enumerate(series[0])]
+
+    per_label = {}
+    for test_file, dev in test_devices:
+        if test_file is not None:
+            per_label[device_label(test_file)] = TimeSeriesValue(per_dev[dev])
+
+    return TimeSeriesValue(total), per_label
+
+
 def load_sys_log_file(ftype, fname):
+    "text diskstats logs, collected by previous versions once per second"
     assert ftype == 'iops'
     pval = None
     with open(fname) as fd:
@@ -85,10 +136,26 @@ def load_sys_log_file(ftype, fname):
                 iops.append(cval - pval)
             pval = cval
 
-    vals = [(idx * 1000, val) for idx, val in enumerate(iops)]
+    # seconds from fio start, as in fio logs
+    vals = [(idx + 1, val) for idx, val in enumerate(iops)]
     return TimeSeriesValue(vals)
 
 
+def align_to_common_start(res, start_times):
+    """
+    fio logs contains offsets from fio start on each node. Drop head
+    of series from nodes, which started earlier than the latest one,
+    so same index in all series corresponds to the same time
+    start_times:{conn_id: float} - fio start time in controller clock
+    """
+    common_start = max(start_times.values())
+    for ftype, per_node in res.items():
+        for conn_id, series in per_node.items():
+            delta = common_start - start_times.get(conn_id, common_start)
+            if delta > 0:
+                per_node[conn_id] = [ts.skip(delta) for ts in series]
+
+
 def load_test_results(folder, run_num):
     res = {}
     params = None
@@ -96,8 +163,11 @@ def load_test_results(folder, run_num):
     fn = os.path.join(folder, str(run_num) + '_params.yaml')
     params = yaml.load(open(fn).read())
 
+    # device label => {type: {conn_id: [series]}}, for multi-device tests
+    dev_res = {}
+
     conn_ids_set = set()
-    rr = r"{0}_(?P<conn_id>.*?)_(?P<type>[^_.]*)\.\d+\.log$".format(run_num)
+    rr = r"{0}_(?P<conn_id>.*?)_(?P<type>[^_.]*)\.\d+(\.(?P<dev>[^.]+))?\.log$".format(run_num)
     for fname in os.listdir(folder):
         rm = re.match(rr, fname)
         if rm is None:
@@ -113,6 +183,10 @@ def load_test_results(folder, run_num):
         ts = load_fio_log_file(os.path.join(folder, fname))
         res.setdefault(ftype, {}).setdefault(conn_id, []).append(ts)
 
+        if rm.group('dev') is not None:
+            dev_res.setdefault(rm.group('dev'), {}).setdefault(ftype, {}) \
+                .setdefault(conn_id, []).append(ts)
+
         conn_ids_set.add(conn_id)
 
     rr = r"{0}_(?P<conn_id>.*?)_(?P<type>[^_.]*)\.sys\.log$".format(run_num)
@@ -133,30 +207,56 @@ def load_test_results(folder, run_num):
 
         conn_ids_set.add(conn_id)
 
+    rr = r"{0}_(?P<conn_id>.*?)_diskstats\.bin$".format(run_num)
+    for fname in os.listdir(folder):
+        rm = re.match(rr, fname)
+        if rm is None:
+            continue
+
+        conn_id = rm.group('conn_id').replace('_', ':')
+        ts, per_dev = load_diskstats_file(os.path.join(folder, fname))
+        res.setdefault("iops:sys", {}).setdefault(conn_id, []).append(ts)
+
+        for label, dev_ts in per_dev.items():
+            if label in dev_res:
+                dev_res[label].setdefault("iops:sys", {})[conn_id] = [dev_ts]
+
+        conn_ids_set.add(conn_id)
+
     mm_res = {}
 
     if len(res) == 0:
         raise ValueError("No data was found")
 
-    for key, data in res.items():
-        conn_ids = sorted(conn_ids_set)
+    if params.get('start_times') is not None:
+        align_to_common_start(res, params['start_times'])
+        for dev_data in dev_res.values():
+            align_to_common_start(dev_data, params['start_times'])
+
+    conn_ids = sorted(conn_ids_set)
+
+    def to_matrix(data):
         awail_ids = [conn_id for conn_id in conn_ids if conn_id in data]
-        matr = [data[conn_id] for conn_id in awail_ids]
-        mm_res[key] = MeasurementMatrix(matr, awail_ids)
+        return MeasurementMatrix([data[conn_id] for conn_id in awail_ids], awail_ids)
+
+    for key, data in res.items():
+        mm_res[key] = to_matrix(data)
+
+    dev_mm_res = {}
+    for label, dev_data in dev_res.items():
+        dev_mm_res[label] = dict((key, to_matrix(data)) for key, data in dev_data.items())
 
     raw_res = {}
     for conn_id in conn_ids:
-        fn = os.path.join(folder, "{0}_{1}_rawres.json".format(run_num, conn_id_s))
-
-        # remove message hack
-        fc = "{" + open(fn).read().split('{', 1)[1]
-        raw_res[conn_id] = json.loads(fc)
+        fname = "{0}_{1}_rawres.json".format(run_num, conn_id.replace(":", "_"))
+        raw_res[conn_id] = parse_fio_json(open(os.path.join(folder, fname)).read())
 
     fio_task = FioJobSection(params['name'])
     fio_task.vals.update(params['vals'])
 
     config = TestConfig('io', params, None, params['nodes'], folder, None)
-    return FioRunResult(config, fio_task, mm_res, raw_res, params['intervals'], run_num)
+    return FioRunResult(config, fio_task, mm_res, raw_res, params['intervals'], run_num,
+                        dev_mm_res)
 
 
 class Attrmapper(object):
@@ -249,8 +349,11 @@ class FioRunResult(TestResults):
     ts_results: {str: MeasurementMatrix[TimeSeriesValue]}
     raw_result: ????
     run_interval:(float, float) - test tun time, used for sensors
+    devices_ts:{str: {str: MeasurementMatrix[TimeSeriesValue]}} - device
+               label => ts_results for this device, multi-device tests only
     """
-    def __init__(self, config, fio_task, ts_results, raw_result, run_interval, idx):
+    def __init__(self, config, fio_task, ts_results, raw_result, run_interval, idx,
+                 devices_ts=None):
 
         self.name = fio_task.name.rsplit("_", 1)[0]
         self.fio_task = fio_task
@@ -270,21 +373,48 @@ class FioRunResult(TestResults):
                "iops": self.iops,
                "iops:sys": self.iops_sys}
 
+        self.devices_ts = devices_ts or {}
+
         self.sensors_data = None
         self._pinfo = None
         TestResults.__init__(self, config, res, raw_result, run_interval)
 
-    def get_params_from_fio_report(self):
-        nodes = self.bw.connections_ids
+    def devices(self):
+        "returns labels of devices for multi-device test, empty list otherwise"
+        return sorted(self.devices_ts)
 
-        iops = [self.raw_result[node]['jobs'][0]['mixed']['iops'] for node in nodes]
-        total_ios = [self.raw_result[node]['jobs'][0]['mixed']['total_ios'] for node in nodes]
-        runtime = [self.raw_result[node]['jobs'][0]['mixed']['runtime'] / 1000 for node in nodes]
-        flt_iops = [float(ios) / rtime for ios, rtime in zip(total_ios, runtime)]
+    def get_node_jobs(self, node, device=None):
+        "returns fio reports for node jobs, for all devices by default"
+        jobs = self.raw_result[node]['jobs']
+        if device is None:
+            return jobs
+        return [job for job in jobs if get_job_device(job) == device]
 
-        bw = [self.raw_result[node]['jobs'][0]['mixed']['bw'] for node in nodes]
-        total_bytes = [self.raw_result[node]['jobs'][0]['mixed']['io_bytes'] for node in nodes]
-        flt_bw = [float(tbytes) / rtime for tbytes, rtime in zip(total_bytes, runtime)]
+    def get_params_from_fio_report(self, device=None):
+        """
+        returns per node values from fio reports, for multi-device test
+        values are summs for all node devices or for one device
+        """
+        nodes = self.bw.connections_ids
+        iops = []
+        flt_iops = []
+        bw = []
+        flt_bw = []
+
+        for node in nodes:
+            node_iops = node_flt_iops = node_bw = node_flt_bw = 0
+            for job in self.get_node_jobs(node, device):
+                mixed = job['mixed']
+                runtime = mixed['runtime'] / 1000
+                node_iops += mixed['iops']
+                node_bw += mixed['bw']
+                node_flt_iops += float(mixed['total_ios']) / runtime
+                node_flt_bw += float(mixed['io_bytes']) / runtime
+
+            iops.append(node_iops)
+            flt_iops.append(node_flt_iops)
+            bw.append(node_bw)
+            flt_bw.append(node_flt_bw)
 
         return {'iops': iops,
                 'flt_iops': flt_iops,
@@ -418,6 +548,408 @@ class FioRunResult(TestResults):
         return pinfo
 
 
+class DiskStatsSampler(object):
+    """
+    Collect diskstats for devices, which hold test files, into local
+    binary log in a background thread. Remote nodes run the same
+    sampler as separated process, see diskstats.py
+    """
+    def __init__(self, test_files, log_file, interval=1.0):
+        self.sampler = diskstats.make_sampler(test_files, log_file, interval)
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.sampler.run, name="diskstats")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.sampler.stop()
+        if self.thread is not None:
+            self.thread.join()
+
+
+class TestRunState(object):
+    """
+    State of one test attempt, shared between all node threads
+
+    barrier:Barrier - used to start test simultaneously on all nodes
+    straggler_timeout:int - how long to wait for rest of nodes after
+                            first one finished test, None - forever
+    abort_reason:str - why test was aborted, None if test is running
+    failed:{str:Exception} - nodes, which failed this test
+    stragglers:{str:Exception} - nodes, killed after straggler timeout,
+                                 test isn't aborted due to them
+    start_time:float - scheduled fio start time, in controller clock
+    stopped:bool - test was stopped by abort rules and shouldn't be retried
+    progress:FioProgress - live fio status, None if it's not collected
+    """
+    def __init__(self, nodes_count, straggler_timeout=None):
+        self.barrier = Barrier(nodes_count)
+        self.straggler_timeout = straggler_timeout
+        self.lock = threading.Lock()
+        self.abort_reason = None
+        self.first_finish_time = None
+        self.start_time = None
+        self.failed = {}
+        self.stragglers = {}
+        self.stopped = False
+        self.progress = None
+
+    def get_start_time(self, lead):
+        """
+        common test start time in controller clock, it's selected
+        by first node passed barrier, rest of nodes get the same value
+        """
+        with self.lock:
+            if self.start_time is None:
+                self.start_time = time.time() + lead
+            return self.start_time
+
+    def node_failed(self, conn_id, exc):
+        with self.lock:
+            self.failed[conn_id] = exc
+            if self.abort_reason is None:
+                self.abort_reason = "node {0} failed: {1!s}".format(conn_id, exc)
+        self.barrier.exit()
+
+    def node_straggled(self, conn_id, exc):
+        "node was killed by straggler timeout, rest of nodes already finished test"
+        with self.lock:
+            self.stragglers[conn_id] = exc
+
+    def stop(self, reason):
+        "stop test on all nodes due to abort rule"
+        with self.lock:
+            if self.abort_reason is None:
+                self.abort_reason = reason
+                self.stopped = True
+        self.barrier.exit()
+
+    def node_finished(self):
+        with self.lock:
+            if self.first_finish_time is None:
+                self.first_finish_time = time.time()
+
+    def is_aborted(self):
+        return self.abort_reason is not None
+
+    def is_straggler_deadline(self):
+        if self.straggler_timeout is None or self.first_finish_time is None:
+            return False
+        return time.time() - self.first_finish_time > self.straggler_timeout
+
+    def should_stop(self):
+        return self.is_aborted() or self.is_straggler_deadline()
+
+
+class TestStoppedError(StopTestError):
+    "test was stopped by progress abort rules"
+    pass
+
+
+class StragglerKilled(RuntimeError):
+    "fio on node was killed after straggler timeout"
+    pass
+
+
+def stop_local_fio(proc, term_timeout=5):
+    "terminate local fio, kill it if it's still running after term_timeout seconds"
+    # sudo forwards SIGTERM to fio, but not SIGKILL
+    proc.terminate()
+    end_time = time.time() + term_timeout
+    while proc.poll() is None and time.time() < end_time:
+        time.sleep(0.1)
+
+    if proc.poll() is None:
+        proc.kill()
+    proc.wait()
+
+
+def get_job_lat_ms(job):
+    "average completion latency from fio json job report"
+    mixed = job['mixed']
+    if 'clat_ns' in mixed:
+        return mixed['clat_ns']['mean'] / 1E6
+    return mixed['clat']['mean'] / 1E3
+
+
+class FioProgress(object):
+    """
+    Live fio status. fio is started with --status-interval and its
+    json output file is streamed from nodes while test is running.
+    Each status report is checked against abort rules, if any rule
+    fires test is stopped on all nodes via run_state
+
+    rules:{str: float} - abort rules:
+        min_iops - node iops below this value
+        collapse - node iops fall below this part of its peak iops
+        divergence - max node iops / min node iops above this value
+        max_errors - errors count on node above this value
+        grace - seconds to ignore throughput rules after start,
+                by default ramp time + two status intervals
+    throughput_rules:bool - check min_iops, collapse and divergence rules
+    stats:{str: (float, float, float)} - node => current iops, bw, lat
+    """
+    def __init__(self, name, run_state, status_interval, rules,
+                 ramp_time=0, throughput_rules=True):
+        self.name = name
+        self.run_state = run_state
+        self.status_interval = status_interval
+        self.rules = rules
+        self.grace = rules.get('grace', ramp_time + 2 * status_interval)
+        self.throughput_rules = throughput_rules
+
+        self.lock = threading.Lock()
+        self.stopped = False
+        self.channels = []
+        self.threads = []
+
+        self.buffers = {}
+        self.first_report = {}
+        self.prev = {}
+        self.peak = {}
+        self.stats = {}
+        self.last_log_time = time.time()
+
+    def start_thread(self, func, *args):
+        th = threading.Thread(target=func, args=args)
+        th.daemon = True
+        th.start()
+        self.threads.append(th)
+
+    def follow_remote(self, node, path):
+        "stream fio output file from node over separated ssh channel"
+        chan = node.connection.get_transport().open_session()
+        chan.exec_command("tail -c +1 -F {0} 2>/dev/null".format(path))
+        self.channels.append(chan)
+        self.start_thread(self.read_channel, node.get_conn_id(), chan)
+
+    def read_channel(self, conn_id, chan):
+        try:
+            while not self.stopped:
+                data = chan.recv(65536)
+                if data == "":
+                    break
+                self.feed(conn_id, data)
+        except Exception as exc:
+            if not self.stopped:
+                logger.warning("Progress stream from %s failed: %s", conn_id, exc)
+
+    def follow_local(self, conn_id, path):
+        self.start_thread(self.read_local, conn_id, path)
+
+    def read_local(self, conn_id, path):
+        pos = 0
+        while not self.stopped:
+            if os.path.exists(path):
+                with open(path) as fd:
+                    fd.seek(pos)
+                    data = fd.read()
+                pos += len(data)
+                if data != "":
+                    self.feed(conn_id, data)
+            time.sleep(0.5)
+
+    def stop(self):
+        self.stopped = True
+        for chan in self.channels:
+            try:
+                chan.close()
+            except Exception:
+                pass
+
+        for th in self.threads:
+            th.join(5)
+
+    def feed(self, conn_id, data):
+        "parse all complete status reports from stream"
+        buff = self.buffers.get(conn_id, "") + data
+        decoder = json.JSONDecoder()
+
+        while True:
+            pos = buff.find('{')
+            if pos == -1:
+                buff = ""
+                break
+
+            try:
+                report, end = decoder.raw_decode(buff, pos)
+            except ValueError:
+                # report is not complete yet
+                buff = buff[pos:]
+                break
+
+            buff = buff[end:]
+            try:
+                self.on_report(conn_id, report['jobs'])
+            except (KeyError, TypeError, ZeroDivisionError) as exc:
+                logger.debug("Can't process fio status from %s: %s", conn_id, exc)
+
+        self.buffers[conn_id] = buff
+
+    def on_report(self, conn_id, jobs):
+        total_ios = sum(job['mixed']['total_ios'] for job in jobs)
+        io_bytes = sum(job['mixed']['io_bytes'] for job in jobs)
+        runtime = max(job['mixed']['runtime'] for job in jobs) / 1000.0
+        active = [job for job in jobs if job['mixed']['total_ios'] > 0]
+        lat = get_job_lat_ms(active[-1]) if len(active) != 0 else 0.0
+        errors = sum(max(job.get('total_err', 0), 1 if job.get('error') else 0)
+                     for job in jobs)
+
+        with self.lock:
+            now = time.time()
+            self.first_report.setdefault(conn_id, now)
+            prev = self.prev.get(conn_id)
+            self.prev[conn_id] = (total_ios, io_bytes, runtime)
+
+            if prev is None or runtime <= prev[2]:
+                return
+
+            dtime = runtime - prev[2]
+            iops = (total_ios - prev[0]) / dtime
+            self.stats[conn_id] = (iops, (io_bytes - prev[1]) / dtime, lat)
+            self.peak[conn_id] = max(self.peak.get(conn_id, 0), iops)
+
+            reason = self.check_rules(conn_id, now, errors)
+
+            if now - self.last_log_time >= self.status_interval:
+                self.last_log_time = now
+                logger.info("%s: %s", self.name, self.format_stats())
+
+        if reason is not None:
+            reason = "test {0} stopped: {1}".format(self.name, reason)
+            logger.error(reason)
+            self.run_state.stop(reason)
+
+    def format_stats(self):
+        items = []
+        for conn_id, (iops, bw, lat) in sorted(self.stats.items()):
+            items.append("{0} {1} iops {2}B/s {3:.2f}ms".format(
+                         conn_id, int(iops), b2ssize(int(bw)), lat))
+        return " | ".join(items)
+
+    def check_rules(self, conn_id, now, errors):
+        "returns abort reason or None"
+        max_errors = self.rules.get('max_errors')
+        if max_errors is not None and errors > max_errors:
+            return "node {0} reports {1} errors".format(conn_id, errors)
+
+        if not self.throughput_rules or now - self.first_report[conn_id] < self.grace:
+            return None
+
+        iops = self.stats[conn_id][0]
+        min_iops = self.rules.get('min_iops')
+        if min_iops is not None and iops < min_iops:
+            return "node {0} iops {1} < {2}".format(conn_id, int(iops), min_iops)
+
+        collapse = self.rules.get('collapse')
+        if collapse is not None and iops < self.peak[conn_id] * collapse:
+            return "node {0} iops collapsed to {1} from {2}".format(
+                conn_id, int(iops), int(self.peak[conn_id]))
+
+        divergence = self.rules.get('divergence')
+        if divergence is not None and len(self.stats) > 1:
+            all_iops = [stat[0] for stat in self.stats.values()]
+            if min(all_iops) > 0 and max(all_iops) / min(all_iops) > divergence:
+                return "nodes iops diverged: {0}".format(self.format_stats())
+
+        return None
+
+
+PREFILL_SCRIPT = os.path.join(os.path.dirname(__file__), "prefill.py")
+DISKSTATS_SCRIPT = os.path.join(os.path.dirname(__file__), "diskstats.py")
+SETTLE_CACHES_SCRIPT = os.path.join(os.path.dirname(__file__), "settle_caches.py")
+REDUCE_LOGS_SCRIPT = os.path.join(os.path.dirname(__file__), "reduce_logs.py")
+REDUCED_LOGS_SUMMARY = "log_summary.json"
+
+# name, read only, size, partitions, holders, mounts+swaps and fs signature, if any
+DISCOVER_DEVICES_CMD = "for dr in /sys/block/* ; do dev=$(basename $dr) ; " + \
+    "echo $dev $(cat $dr/ro) $(cat $dr/size) $(ls $dr | grep -c \"^$dev\") " + \
+    "$(ls $dr/holders | wc -l) $(cat /proc/mounts /proc/swaps | grep -c \"^/dev/$dev\") " + \
+    "$(lsblk -d -n -o FSTYPE /dev/$dev 2>/dev/null) ; done"
+
+
+fio_bundles = {}
+fio_bundles_lock = threading.Lock()
+
+
+def choose_file_size(ram_size, space, cache_size, factor, min_size, max_usage):
+    """
+    size test file to be factor times larger than all caches in front
+    of device, so page and controller caches can't hold noticeable part
+    of it. returns (size, max possible size, rationale), sizes are
+    in bytes, aligned to GiB
+    """
+    gb = 1024 ** 3
+    limit = int(space * max_usage) // gb * gb
+    need = factor * (ram_size + cache_size)
+    rationale = "{0} x (RAM {1}B + cache {2}B) = {3}B".format(factor,
+                                                             b2ssize(ram_size),
+                                                             b2ssize(cache_size),
+                                                             b2ssize(need))
+    if need < min_size:
+        need = min_size
+        rationale += ", raised to min {0}B".format(b2ssize(min_size))
+
+    need = -(-need // gb) * gb
+
+    if need > limit:
+        rationale += ", limited by {0}% of {1}B space".format(int(max_usage * 100),
+                                                             b2ssize(space))
+        size = limit
+    else:
+        size = need
+
+    if size <= 0:
+        raise StopTestError("No space for test file: " + rationale)
+
+    return size, limit, rationale
+
+
+def get_io_scripts_bundle():
+    "node side helpers, started by test from tests folder"
+    with fio_bundles_lock:
+        if DISKSTATS_SCRIPT not in fio_bundles:
+            bundle = artifacts.Bundle("io_scripts")
+            bundle.add_file("diskstats.py", DISKSTATS_SCRIPT, mode=0644)
+            fio_bundles[DISKSTATS_SCRIPT] = bundle
+        return fio_bundles[DISKSTATS_SCRIPT]
+
+
+def get_fio_bundle(fio_path):
+    "bundle with prebuild fio binary, shared by all nodes with the same os"
+    with fio_bundles_lock:
+        if fio_path not in fio_bundles:
+            bundle = artifacts.Bundle("fio")
+            bundle.add_file("fio", fio_path, mode=0755, decompress=True)
+            fio_bundles[fio_path] = bundle
+        return fio_bundles[fio_path]
+
+
+# fio server is shared by all io tests of the run, so pid file
+# is kept out of tests folders, which are cleaned between tests
+FIO_SERVER_PID_FILE = "/tmp/wally_fio_server.pid"
+
+
+def stop_fio_servers(nodes, max_parallel=256):
+    "stop fio servers, started by io tests in fio_server mode"
+    tasks = []
+    for node in nodes:
+        pid_file = node.tools.pop('fio_server', None)
+        if pid_file is not None and node.connection is not None:
+            cmd = "kill $(cat {0}) || sudo -n kill $(cat {0}) ; " + \
+                  "rm -f {0} || sudo -n rm -f {0}"
+            tasks.append((node.connection, cmd.format(pid_file), node.get_conn_id()))
+
+    if len(tasks) != 0:
+        logger.debug("Stopping fio servers on {0} nodes".format(len(tasks)))
+        for (_, _, conn_id), res in zip(tasks, run_over_ssh_many(tasks, max_parallel=max_parallel,
+                                                                 nolog=True)):
+            if isinstance(res, OSError):
+                logger.warning("Can't stop fio server on {0}: {1!s}".format(conn_id, res))
+
+
 class IOPerfTest(PerfTest):
     tcp_conn_timeout = 30
     max_pig_timeout = 5
@@ -444,22 +976,159 @@ class IOPerfTest(PerfTest):
             logger.warning("prefill_files option is depricated. Use force_prefill instead")
 
         self.force_prefill = get('force_prefill', False)
+
+        # files are filled by one fio run with prefill_jobs jobs per file.
+        # Filled files are recorded in manifest on node, so next
+        # runs don't need to verify them
+        self.prefill_jobs = get('prefill_jobs', 4)
+        self.prefill_iodepth = get('prefill_iodepth', 16)
+        self.prefill_manifest = get('prefill_manifest', "/tmp/wally_prefill.json")
         self.config_params = get('params', {}).copy()
 
+        # if TEST_FILE_SIZE isn't set or is 'auto' file size is chosen
+        # as file_size_factor * (node RAM + cache_size), where cache_size
+        # is a hint for caches, which wally can't detect (raid controller,
+        # storage side cache). Size is limited by max_space_usage part of
+        # device/free fs space. See choose_file_size
+        self.file_size_factor = get('file_size_factor', 4)
+        self.cache_size = ssize2b(get('cache_size', 0))
+        self.min_file_size = ssize2b(get('min_file_size', '1G'))
+        self.max_space_usage = get('max_space_usage', 0.9)
+        self.file_size_info = None
+
         self.io_py_remote = self.join_remote("agent.py")
         self.results_file = self.join_remote("results.json")
         self.pid_file = self.join_remote("pid")
         self.task_file = self.join_remote("task.cfg")
         self.sh_file = self.join_remote("cmd.sh")
         self.err_out_file = self.join_remote("fio_err_out")
-        self.io_log_file = self.join_remote("io_log.txt")
+        self.io_log_file = self.join_remote("diskstats.bin")
+        self.diskstats_remote = self.join_remote("diskstats.py")
         self.exit_code_file = self.join_remote("exit_code")
+        self.start_time_file = self.join_remote("start_time")
 
         self.max_latency = get("max_lat", None)
         self.min_bw_per_thread = get("min_bw", None)
 
         self.use_sudo = get("use_sudo", True)
 
+        # node would be excluded from the rest of tests after this
+        # amount of failures, None - never exclude nodes
+        self.max_node_failures = get("max_node_failures", None)
+
+        # kill test on nodes, which still runs fio after
+        # this amount of seconds since first node finished
+        self.straggler_timeout = get("straggler_timeout", None)
+
+        # start fio on all nodes at the same moment, using nodes clock
+        # offsets. Lead time should be enough to launch fio on all nodes
+        self.sync_start = get("sync_start", True)
+        self.sync_start_lead = get("sync_start_lead", 5)
+
+        # connection to node may be restored during test this amount
+        # of times, after that node run fails
+        self.max_reconnects = get("max_reconnects", 5)
+        self.reconnect_delay = get("reconnect_delay", 10)
+
+        # compress results stream with gzip -1 on node, useful for
+        # slow links and big latency/iops logs
+        self.compress_results = get("compress_results", False)
+
+        # upload task for next test and collect results of previous one
+        # while current test is running. Results traffic may disturb
+        # measurements - collect_during_tests=False postpones downloads
+        # till all tests are finished
+        self.pipeline = get("pipeline", False)
+        self.collect_during_tests = get("collect_during_tests", True)
+
+        # run up to this amount of consecutive compatible tests by one
+        # fio process, to cut per-run overhead for short tests
+        self.batch = get("batch", 1)
+
+        if self.batch > 1 and self.pipeline:
+            logger.warning("pipeline option is ignored in batch mode")
+            self.pipeline = False
+
+        # start 'fio --server' on nodes once and run each test on all
+        # nodes by one fio client process on this host. Nodes should be
+        # directly reachable on fio_server_port and local fio should
+        # have the same version as fio on nodes
+        self.fio_server = get("fio_server", False)
+        self.fio_server_port = get("fio_server_port", 8765)
+        self.fio_client = get("fio_client", "fio")
+        self.fio_client_version = None
+
+        if self.fio_server and self.pipeline:
+            logger.warning("pipeline option is ignored in fio_server mode")
+            self.pipeline = False
+
+        # stream fio status every status_interval seconds from nodes,
+        # show it on console and stop test early if any of abort_rules
+        # fires. See FioProgress for rules description
+        self.status_interval = get("status_interval", None)
+        self.abort_rules = get("abort_rules", {})
+
+        # one fio client process runs test on all nodes, it can only be
+        # killed as a whole and reports no live status, see run_client
+        if self.fio_server:
+            for opt in ("straggler_timeout", "status_interval", "max_node_failures"):
+                if getattr(self, opt) is not None:
+                    logger.warning("{0} option is ignored in fio_server mode".format(opt))
+            self.straggler_timeout = None
+            self.status_interval = None
+            self.max_node_failures = None
+
+        # average fio logs over reduce_logs ms windows on nodes and
+        # download only reduced logs and summary. Raw logs are kept
+        # on nodes in raw_logs_dir if keep_raw_logs is set.
+        # log_compression is passed to fio to limit logs memory usage
+        self.reduce_logs = get("reduce_logs", None)
+        self.keep_raw_logs = get("keep_raw_logs", False)
+        self.raw_logs_dir = get("raw_logs_dir", "/tmp/wally_raw_logs")
+        self.log_compression = get("log_compression", None)
+
+        # /proc/diskstats sampling interval for iops:sys series, ms
+        self.diskstats_interval = get("diskstats_interval", 1000)
+
+        # before each test sync, wait till dirty pages are written back
+        # and drop page cache on test nodes and not test nodes with
+        # settle_caches_roles roles, so test doesn't inherit cache
+        # state from previous one. See settle_caches.py
+        self.settle_caches = get("settle_caches", False)
+        self.settle_caches_roles = get("settle_caches_roles", ['ceph-osd', 'storage'])
+        self.drop_caches = get("drop_caches", True)
+        self.max_dirty = ssize2b(get("max_dirty", "64M"))
+        self.settle_timeout = get("settle_timeout", 300)
+
+        # pin fio threads to cores of one numa node - pin_numa_node or,
+        # if it's 'auto', the node, local to test device or to NIC.
+        # cpus_allowed_policy=split gives each thread own core.
+        # pin_numa_mem also binds memory, fio should be built with libnuma
+        self.cpu_pinning = get("cpu_pinning", False)
+        self.pin_numa_node = get("pin_numa_node", "auto")
+        self.pin_numa_mem = get("pin_numa_mem", False)
+
+        # conn_id => {fio option: value}
+        self.node_pinning = {}
+
+        # test several devices per node by one fio run instead of
+        # FILENAME: each test is executed on all devices simultaneously,
+        # results are collected and reported per device and per node.
+        # List of devices, 'auto' - all unused whole disks (no partitions,
+        # holders, mounts and fs signatures) or {node ip or conn id or
+        # 'default': list or 'auto'}. Nodes, not listed in dict, test FILENAME
+        self.test_devices = get("test_devices", None)
+
+        # conn_id => [device path]
+        self.node_devices = {}
+
+        # conn_id => utils.os_release
+        self.node_os = {}
+
+        self.active_nodes = self.config.nodes[:]
+        self.node_failures = collections.Counter()
+        self.excluded_nodes = {}
+
         self.raw_cfg = open(self.config_fname).read()
         self.fio_configs = None
 
@@ -478,96 +1147,134 @@ class IOPerfTest(PerfTest):
         pass
 
     # size is megabytes
-    def check_prefill_required(self, rossh, fname, size, num_blocks=16):
-        try:
-            with rossh.connection.open_sftp() as sftp:
-                fstats = sftp.stat(fname)
-
-            if stat.S_ISREG(fstats.st_mode) and fstats.st_size < size * 1024 ** 2:
-                return True
-        except EnvironmentError:
-            return True
-
-        cmd = 'python -c "' + \
-              "import sys;" + \
-              "fd = open('{0}', 'rb');" + \
-              "fd.seek({1});" + \
-              "data = fd.read(1024); " + \
-              "sys.stdout.write(data + ' ' * ( 1024 - len(data)))\" | md5sum"
-
+    def run_prefill_script(self, rossh, action, files, num_blocks=16):
+        "run prefill.py on node, files:{str: int} - file name => size in MiB"
+        args = " ".join("{0}:{1}".format(fname, size) for fname, size in sorted(files.items()))
+        cmd = "python - {0} {1} {2} {3}".format(action, self.prefill_manifest, num_blocks, args)
         if self.use_sudo:
             cmd = "sudo " + cmd
+        return rossh(cmd, stdin_data=open(PREFILL_SCRIPT).read(), nolog=True)
 
-        zero_md5 = '0f343b0931126a20f133d67c2b018a3b'
-        bsize = size * (1024 ** 2)
-        offsets = [random.randrange(bsize - 1024) for _ in range(num_blocks)]
-        offsets.append(bsize - 1024)
-        offsets.append(0)
-
-        for offset in offsets:
-            data = rossh(cmd.format(fname, offset), nolog=True)
-
-            md = ""
-            for line in data.split("\n"):
-                if "unable to resolve" not in line:
-                    md = line.split()[0].strip()
-                    break
-
-            if len(md) != 32:
-                logger.error("File data check is failed - " + data)
-                return True
-
-            if zero_md5 == md:
-                return True
+    def check_prefill_required(self, rossh, files):
+        """
+        check all test files on node by one remote call
+        returns {fname: reason} for files, which need to be filled
+        """
+        out = self.run_prefill_script(rossh, 'check', files)
 
-        return False
+        # skip sudo messages, like 'unable to resolve host'
+        res = json.loads(out[out.index('{'):])
+        return dict((fname, reason) for fname, reason in res.items() if reason is not None)
 
-    def prefill_test_files(self, rossh, files, force=False):
+    def get_prefill_cmd(self, files):
+        """
+        one fio run fills all files in parallel, each file is
+        splitted into prefill_jobs ranges
+        """
         if self.use_system_fio:
-            cmd_templ = "fio "
+            cmd = "fio"
         else:
-            cmd_templ = "{0}/fio ".format(self.config.remote_dir)
+            cmd = "{0}/fio".format(self.config.remote_dir)
 
         if self.use_sudo:
-            cmd_templ = "sudo " + cmd_templ
+            cmd = "sudo " + cmd
+
+        cmd += " --direct=1 --bs=4m --rw=write --ioengine=libaio" + \
+               " --iodepth={0}".format(self.prefill_iodepth)
 
-        cmd_templ += "--name=xxx --filename={0} --direct=1" + \
-                     " --bs=4m --size={1}m --rw=write"
+        job_templ = " --name=fill{0} --filename={1} --numjobs={2} --size={3}m" + \
+                    " --offset_increment={3}m"
+        tail_templ = " --name=fill{0}_tail --filename={1} --offset={2}m --size={3}m"
 
-        ssize = 0
+        for idx, (fname, size) in enumerate(sorted(files.items())):
+            numjobs = max(1, min(self.prefill_jobs, size // 4))
+            job_size = size // numjobs
+            cmd += job_templ.format(idx, fname, numjobs, job_size)
 
+            if job_size * numjobs != size:
+                cmd += tail_templ.format(idx, fname, job_size * numjobs,
+                                         size - job_size * numjobs)
+        return cmd
+
+    def prefill_test_files(self, node, rossh, files, fill_pool, force=False):
+        """
+        check files and start filling ones, which need it, in fill_pool
+        returns Future or None if nothing to fill
+        """
         if force:
             logger.info("File prefilling is forced")
+            to_fill = dict(files)
+        else:
+            reasons = self.check_prefill_required(rossh, files)
+            for fname, reason in sorted(reasons.items()):
+                logger.info("Need to prefill {0} on {1}: {2}".format(
+                            fname, node.get_conn_id(), reason))
+            to_fill = dict((fname, files[fname]) for fname in reasons)
 
-        ddtime = 0
-        for fname, curr_sz in files.items():
-            if not force:
-                if not self.check_prefill_required(rossh, fname, curr_sz):
-                    logger.debug("prefill is skipped")
-                    continue
+        if len(to_fill) == 0:
+            logger.debug("prefill is skipped")
+            return None
+
+        return fill_pool.submit(self.do_prefill, node, rossh, to_fill)
 
-            logger.info("Prefilling file {0}".format(fname))
-            cmd = cmd_templ.format(fname, curr_sz)
-            ssize += curr_sz
+    def do_prefill(self, node, rossh, files):
+        ssize = sum(files.values())
 
-            stime = time.time()
-            rossh(cmd, timeout=curr_sz)
-            ddtime += time.time() - stime
+        stime = time.time()
+        # at least 1 MiBps expected
+        rossh(self.get_prefill_cmd(files), timeout=max(ssize, 60), nolog=True)
+        ddtime = time.time() - stime
+
+        # fill is verified by successfull fio exit, next runs skip full check
+        self.run_prefill_script(rossh, 'update', files)
 
         if ddtime > 1.0:
             fill_bw = int(ssize / ddtime)
-            mess = "Initiall fio fill bw is {0} MiBps for this vm"
-            logger.info(mess.format(fill_bw))
+            mess = "Initiall fio fill bw is {0} MiBps for {1}"
+            logger.info(mess.format(fill_bw, node.get_conn_id()))
+
+    def get_fio_path(self, os_info):
+        "path of prebuild fio binary for os"
+        fio_dir = os.path.dirname(os.path.dirname(wally.__file__))
+        fio_dir = os.path.join(os.getcwd(), fio_dir)
+        fio_dir = os.path.join(fio_dir, 'fio_binaries')
+        fname = 'fio_{0.release}_{0.arch}.bz2'.format(os_info)
+        fio_path = os.path.join(fio_dir, fname)
+
+        if not os.path.exists(fio_path):
+            raise RuntimeError("No prebuild fio available for {0}".format(os_info))
+        return fio_path
+
+    def deploy_tools(self, nodes):
+        """
+        deploy node side scripts and fio binaries to all nodes at once,
+        so bundles are spread by peer fan-out instead of being uploaded
+        from controller to each node
+        """
+        targets = [(node.connection, node.get_ip(), node.get_conn_id()) for node in nodes]
+        artifacts.deploy_many(targets, get_io_scripts_bundle(), self.config.remote_dir)
+
+        if self.use_system_fio:
+            return
+
+        # bundle => [target], nodes with different os need different fio
+        fio_targets = collections.OrderedDict()
+        for node, target in zip(nodes, targets):
+            fio_path = self.get_fio_path(self.node_os[node.get_conn_id()])
+            fio_targets.setdefault(get_fio_bundle(fio_path), []).append(target)
+
+        for bundle, bundle_targets in fio_targets.items():
+            # bundle is unpacked on node once and reused by next tests and runs
+            artifacts.deploy_many(bundle_targets, bundle, self.config.remote_dir)
+            logger.debug("fio {0} deployed to {1} nodes".format(bundle, len(bundle_targets)))
 
     def install_utils(self, node, rossh, max_retry=3, timeout=5):
         need_install = []
         packs = [('screen', 'screen')]
-        os_info = get_os(rossh)
+        os_info = self.node_os[node.get_conn_id()]
 
         if self.use_system_fio:
             packs.append(('fio', 'fio'))
-        else:
-            packs.append(('bzip2', 'bzip2'))
 
         for bin_name, package in packs:
             if bin_name is None:
@@ -594,33 +1301,88 @@ class IOPerfTest(PerfTest):
             else:
                 raise OSError("Can't install - " + str(err))
 
-        if not self.use_system_fio:
-            fio_dir = os.path.dirname(os.path.dirname(wally.__file__))
-            fio_dir = os.path.join(os.getcwd(), fio_dir)
-            fio_dir = os.path.join(fio_dir, 'fio_binaries')
-            fname = 'fio_{0.release}_{0.arch}.bz2'.format(os_info)
-            fio_path = os.path.join(fio_dir, fname)
-
-            if not os.path.exists(fio_path):
-                raise RuntimeError("No prebuild fio available for {0}".format(os_info))
-
-            bz_dest = self.join_remote('fio.bz2')
-            with node.connection.open_sftp() as sftp:
-                sftp.put(fio_path, bz_dest)
+    def get_storage_facts(self, node):
+        """
+        returns (ram size, space for test file) in bytes for node,
+        space for test file is device size or free fs space plus size
+        of test file, if it already exists. For multi-device test
+        space is the smallest one for all node devices
+        """
+        sudo = "sudo " if self.use_sudo else ""
+        cmd = "grep MemTotal /proc/meminfo"
+        for fname in self.get_node_test_files(node):
+            cmd += (" ; if [ -b {0} ] ; then echo dev $({1}blockdev --getsize64 {0}) ; " +
+                    "else echo fs $(df -B1 -P $(dirname {0}) | tail -1 | awk '{{print $4}}') " +
+                    "$(stat -c %s {0} 2>/dev/null || echo 0) ; fi").format(fname, sudo)
+
+        out = run_on_node(node)(cmd, nolog=True).strip().split("\n")
+        ram_size = int(out[0].split()[1]) * 1024
+
+        if node.hw_info is not None and node.hw_info.ram_size != 0:
+            ram_size = node.hw_info.ram_size
+
+        spaces = []
+        for line in out[1:]:
+            space = line.split()
+            if space[0] == 'dev':
+                spaces.append(int(space[1]))
+            else:
+                spaces.append(int(space[1]) + int(space[2]))
+        return ram_size, min(spaces)
 
-            rossh("bzip2 --decompress " + bz_dest, nolog=True)
-            rossh("chmod a+x " + self.join_remote("fio"), nolog=True)
+    def detect_file_size(self):
+        "set TEST_FILE_SIZE, common for all nodes, from nodes RAM and storage size"
+        with ThreadPoolExecutor(len(self.config.nodes)) as pool:
+            facts = list(pool.map(self.get_storage_facts, self.config.nodes))
+
+        per_node = {}
+        sizes = []
+        for node, (ram_size, space) in zip(self.config.nodes, facts):
+            size, limit, rationale = choose_file_size(ram_size, space, self.cache_size,
+                                                      self.file_size_factor,
+                                                      self.min_file_size,
+                                                      self.max_space_usage)
+            per_node[node.get_conn_id()] = {'ram': ram_size,
+                                            'space': space,
+                                            'size': size,
+                                            'rationale': rationale}
+            sizes.append((size, limit))
+
+        # all nodes run the same job file, so size is common -
+        # the largest required, which fits on all nodes
+        need = max(size for size, _ in sizes)
+        size = min(need, min(limit for _, limit in sizes))
+        if size < need:
+            msg = "Test file size is limited to {0}B by the smallest storage, " + \
+                  "results on other nodes may be affected by cache"
+            logger.warning(msg.format(b2ssize(size)))
+
+        self.config_params['TEST_FILE_SIZE'] = "{0}m".format(size // 1024 ** 2)
+        self.file_size_info = {'size': size,
+                               'factor': self.file_size_factor,
+                               'cache_size': self.cache_size,
+                               'nodes': per_node}
+
+        logger.info("Test file size is set to {0}B".format(b2ssize(size)))
+        for conn_id, info in sorted(per_node.items()):
+            logger.debug("{0}: {1}".format(conn_id, info['rationale']))
 
     def pre_run(self):
-        if 'FILESIZE' not in self.config_params:
-            # need to detect file size
-            pass
+        if self.test_devices is not None:
+            self.find_test_devices()
+
+        if self.config_params.get('TEST_FILE_SIZE', 'auto') == 'auto':
+            self.detect_file_size()
 
         self.fio_configs = fio_cfg_compile(self.raw_cfg,
                                            self.config_fname,
                                            self.config_params)
         self.fio_configs = list(self.fio_configs)
 
+        if self.log_compression is not None:
+            for section in self.fio_configs:
+                section.vals['log_compression'] = self.log_compression
+
         files = {}
         for section in self.fio_configs:
             sz = ssize2b(section.vals['size'])
@@ -635,41 +1397,230 @@ class IOPerfTest(PerfTest):
             # take largest size
             files[fname] = max(files.get(fname, 0), msz)
 
-        with ThreadPoolExecutor(len(self.config.nodes)) as pool:
+        with ThreadPoolExecutor(len(self.config.nodes)) as pool, \
+                ThreadPoolExecutor(len(self.config.nodes)) as fill_pool:
+            list(pool.map(self.prepare_remote_dir, self.config.nodes))
+            self.deploy_tools(self.config.nodes)
+
             fc = functools.partial(self.pre_run_th,
                                    files=files,
+                                   fill_pool=fill_pool,
                                    force=self.force_prefill)
-            list(pool.map(fc, self.config.nodes))
+            fills = [fill for fill in pool.map(fc, self.config.nodes) if fill is not None]
+
+            # files are filled in background, while other nodes are prepared
+            for fill in fills:
+                fill.result()
+
+    def prepare_remote_dir(self, node):
+        "create empty tests folder on node and detect node os"
+        rossh = run_on_node(node)
+
+        try:
+            cmd = 'mkdir -p "{0}"'.format(self.config.remote_dir)
+            if self.use_sudo:
+                cmd = "sudo " + cmd
+                cmd += " ; sudo chown {0} {1}".format(node.get_user(),
+                                                      self.config.remote_dir)
+            rossh(cmd, nolog=True)
+
+            assert self.config.remote_dir != "" and self.config.remote_dir != "/"
+            rossh("rm -rf {0}/*".format(self.config.remote_dir), nolog=True)
+
+        except Exception as exc:
+            msg = "Failed to create folder {0} on remote {1}. Error: {2!s}"
+            msg = msg.format(self.config.remote_dir, node.get_conn_id(), exc)
+            logger.exception(msg)
+            raise StopTestError(msg, exc)
+
+        if node.hw_info is not None and node.hw_info.os_info is not None:
+            self.node_os[node.get_conn_id()] = node.hw_info.os_info
+        else:
+            self.node_os[node.get_conn_id()] = get_os(rossh)
 
-    def pre_run_th(self, node, files, force):
+    def pre_run_th(self, node, files, fill_pool, force):
         try:
             # fill files with pseudo-random data
             rossh = run_on_node(node)
             rossh.connection = node.connection
 
-            try:
-                cmd = 'mkdir -p "{0}"'.format(self.config.remote_dir)
-                if self.use_sudo:
-                    cmd = "sudo " + cmd
-                    cmd += " ; sudo chown {0} {1}".format(node.get_user(),
-                                                          self.config.remote_dir)
-                rossh(cmd, nolog=True)
+            self.install_utils(node, rossh)
 
-                assert self.config.remote_dir != "" and self.config.remote_dir != "/"
-                rossh("rm -rf {0}/*".format(self.config.remote_dir), nolog=True)
+            if self.cpu_pinning:
+                self.node_pinning[node.get_conn_id()] = self.get_node_pinning(node, rossh)
 
-            except Exception as exc:
-                msg = "Failed to create folder {0} on remote {1}. Error: {2!s}"
-                msg = msg.format(self.config.remote_dir, node.get_conn_id(), exc)
-                logger.exception(msg)
-                raise StopTestError(msg, exc)
+            if self.fio_server:
+                self.start_fio_server(node, rossh)
 
-            self.install_utils(node, rossh)
-            self.prefill_test_files(rossh, files, force)
+            devices = self.node_devices.get(node.get_conn_id())
+            if devices is not None:
+                # all tests files are replaced by node devices
+                size = max(files.values())
+                files = dict((dev, size) for dev in devices)
+
+            return self.prefill_test_files(node, rossh, files, fill_pool, force)
         except:
             logger.exception("XXXX")
             raise
 
+    def get_node_devices_param(self, node):
+        "returns test_devices option value for node"
+        if not isinstance(self.test_devices, dict):
+            return self.test_devices
+
+        for key in (node.get_conn_id(), node.get_ip(), 'default'):
+            if key in self.test_devices:
+                return self.test_devices[key]
+        return None
+
+    def discover_test_devices(self, node):
+        """
+        returns [device path] to test on node or None,
+        if node should test FILENAME
+        """
+        devices = self.get_node_devices_param(node)
+        if devices is None:
+            return None
+
+        rossh = run_on_node(node)
+        if devices == 'auto':
+            devices = []
+            for line in rossh(DISCOVER_DEVICES_CMD, nolog=True).split("\n"):
+                items = line.split()
+                # 7th field is fs signature
+                if len(items) != 6 or items[0].startswith(SKIP_DISKS):
+                    continue
+                name, read_only, size, parts, holders, mounts = items
+                if read_only == '0' and size != '0' and parts == holders == mounts == '0':
+                    devices.append("/dev/" + name)
+        else:
+            cmd = "for dev in {0} ; do [ -b $dev ] || echo $dev ; done"
+            missing = rossh(cmd.format(" ".join(devices)), nolog=True).split()
+            if len(missing) != 0:
+                msg = "Test devices {0} are not found on {1}"
+                raise StopTestError(msg.format(", ".join(missing), node.get_conn_id()))
+
+        if len(devices) == 0:
+            raise StopTestError("No test devices found on {0}".format(node.get_conn_id()))
+
+        return devices
+
+    def find_test_devices(self):
+        "fill node_devices for multi-device test"
+        with ThreadPoolExecutor(len(self.config.nodes)) as pool:
+            devices = list(pool.map(self.discover_test_devices, self.config.nodes))
+
+        for node, node_devices in zip(self.config.nodes, devices):
+            if node_devices is not None:
+                self.node_devices[node.get_conn_id()] = node_devices
+                logger.info("Test devices on {0}: {1}".format(node.get_conn_id(),
+                                                               " ".join(node_devices)))
+
+    def get_node_test_files(self, node):
+        "returns node devices for multi-device test or [FILENAME]"
+        return self.node_devices.get(node.get_conn_id(), [self.config_params['FILENAME']])
+
+    def get_node_sections(self, node, fio_cfg, pos):
+        """
+        returns [(test position, device label, section)] - sections of
+        node job file. Label is None, if node tests only FILENAME
+        """
+        if isinstance(fio_cfg, FioJobBatch):
+            sections = zip(fio_cfg.ids, fio_cfg.sections)
+        else:
+            sections = [(pos, fio_cfg)]
+
+        devices = self.node_devices.get(node.get_conn_id())
+        if devices is None:
+            return [(sec_pos, None, sec) for sec_pos, sec in sections]
+
+        return [(sec_pos, label, dev_sec)
+                for sec_pos, sec in sections
+                for label, dev_sec in split_by_devices(sec, devices)]
+
+    def get_test_devices(self, rossh, fname=None):
+        """
+        returns names of block device, which holds test file (FILENAME
+        by default), and devices it's built on (partitions, lvm, md slaves)
+        """
+        if fname is None:
+            fname = self.config_params['FILENAME']
+        cmd = "if [ -b {0} ] ; then dev={0} ; " + \
+              "else dev=$(df -P {0} | tail -1 | awk '{{print $1}}') ; fi ; " + \
+              "lsblk -s -n -o KNAME $dev"
+        return rossh(cmd.format(fname), nolog=True).split()
+
+    def get_test_device_numa(self, rossh, devices_numa, fname=None):
+        "returns numa node of disk, which holds test file, or None"
+        try:
+            devices = self.get_test_devices(rossh, fname)
+        except OSError:
+            return None
+
+        # device itself first, then devices it's built on
+        for dev in devices:
+            if dev in devices_numa:
+                return devices_numa[dev]
+        return None
+
+    def get_node_pinning(self, node, rossh):
+        "returns fio options to pin jobs on node"
+        if node.hw_info is not None and node.hw_info.numa_nodes != {}:
+            numa_nodes = node.hw_info.numa_nodes
+            devices_numa = node.hw_info.devices_numa
+        else:
+            numa_nodes, devices_numa = get_numa_info(node.connection)
+
+        if len(numa_nodes) == 0:
+            raise StopTestError("No NUMA info found on {0}".format(node.get_conn_id()))
+
+        numa_id = self.pin_numa_node
+        reason = "config"
+        if numa_id == 'auto':
+            # multi-device test is pinned to the first device node
+            numa_id = self.get_test_device_numa(rossh, devices_numa,
+                                                self.get_node_test_files(node)[0])
+            reason = "test device"
+
+        if numa_id is None and node.hw_info is not None:
+            # rbd, iscsi, etc - network is local to data
+            nics_numa = set(devices_numa[dev] for dev in node.hw_info.net_info
+                            if dev in devices_numa)
+            if len(nics_numa) == 1:
+                numa_id = nics_numa.pop()
+                reason = "NIC"
+
+        if numa_id is None:
+            numa_id = min(numa_nodes)
+            reason = "default"
+
+        if numa_id not in numa_nodes:
+            msg = "No NUMA node {0} on {1}".format(numa_id, node.get_conn_id())
+            raise StopTestError(msg)
+
+        pinning = collections.OrderedDict()
+        pinning['cpus_allowed'] = format_cpu_list(numa_nodes[numa_id])
+        pinning['cpus_allowed_policy'] = 'split'
+        if self.pin_numa_mem:
+            pinning['numa_cpu_nodes'] = str(numa_id)
+            pinning['numa_mem_policy'] = "bind:{0}".format(numa_id)
+
+        logger.debug("Pin fio on {0} to numa node {1} ({2}), cpus {3}".format(
+                     node.get_conn_id(), numa_id, reason, pinning['cpus_allowed']))
+        return pinning
+
+    def get_job_text(self, node, fio_cfg):
+        "fio job file for node, with node specific devices and options"
+        pinning = self.node_pinning.get(node.get_conn_id())
+
+        res = []
+        for _, _, section in self.get_node_sections(node, fio_cfg, None):
+            if pinning is not None:
+                section = section.copy()
+                section.vals.update(pinning)
+            res.append(str(section))
+        return "\n".join(res)
+
     def show_test_execution_time(self):
         if len(self.fio_configs) > 1:
             # +10% - is a rough estimation for additional operations
@@ -687,11 +1638,15 @@ class IOPerfTest(PerfTest):
         self.pre_run()
         self.show_test_execution_time()
 
-        tname = os.path.basename(self.config_fname)
-        if tname.endswith('.cfg'):
-            tname = tname[:-4]
+        return IOTestResults(self.config.params['cfg'],
+                             self.run_tests(), self.config.log_directory)
 
-        barrier = Barrier(len(self.config.nodes))
+    def run_tests(self, check_result=None):
+        """
+        run all tests on prepared nodes, returns [FioRunResult].
+        check_result(FioRunResult) - if returns False rest of tests
+        are skipped, not called in pipeline mode
+        """
         results = []
 
         # set of Operation_Mode_BlockSize str's
@@ -699,13 +1654,37 @@ class IOPerfTest(PerfTest):
         # they already too slow with previous thread count
         lat_bw_limit_reached = set()
 
-        with ThreadPoolExecutor(len(self.config.nodes)) as pool:
+        if self.pipeline and not self.collect_during_tests and \
+                (self.max_latency is not None or self.min_bw_per_thread is not None):
+            logger.warning("max_lat/min_bw limits are ignored, as results are " +
+                           "collected after all tests")
+
+        # tests, which results are not collected yet - [(pos, fio_cfg, nodes, futures)]
+        not_collected = []
+        prepared = None
+
+        # tests, which was already executed as a part of batch
+        batched = set()
+
+        with ThreadPoolExecutor(len(self.config.nodes)) as pool, \
+                ThreadPoolExecutor(len(self.config.nodes)) as io_pool:
             for pos, fio_cfg in enumerate(self.fio_configs):
+                if pos in batched:
+                    continue
+
                 test_descr = get_test_summary(fio_cfg.vals).split("th")[0]
                 if test_descr in lat_bw_limit_reached:
                     continue
-                else:
-                    logger.info("Will run {0} test".format(fio_cfg.name))
+
+                if self.batch > 1:
+                    positions = self.get_batch(pos, lat_bw_limit_reached)
+                    if len(positions) > 1:
+                        batched.update(positions)
+                        results.extend(self.run_batch(pool, positions,
+                                                      lat_bw_limit_reached))
+                        continue
+
+                logger.info("Will run {0} test".format(fio_cfg.name))
 
                 templ = "Test should takes about {0}." + \
                         " Should finish at {1}," + \
@@ -722,168 +1701,677 @@ class IOPerfTest(PerfTest):
                                          end_dt.strftime("%H:%M:%S"),
                                          wait_till.strftime("%H:%M:%S")))
 
-                func = functools.partial(self.do_run,
-                                         barrier=barrier,
-                                         fio_cfg=fio_cfg,
-                                         pos=pos)
+                if self.pipeline:
+                    if prepared is None or prepared[0] != pos:
+                        prepared = (pos, self.submit_prepare(io_pool, fio_cfg, pos))
 
-                max_retr = 3
-                for idx in range(max_retr):
-                    try:
-                        intervals = list(pool.map(func, self.config.nodes))
-                        if None not in intervals:
-                            break
-                    except (EnvironmentError, SSHException) as exc:
-                        logger.exception("During fio run")
-                        if idx == max_retr - 1:
-                            raise StopTestError("Fio failed", exc)
+                    for future in prepared[1]:
+                        future.result()
 
-                    logger.info("Reconnectiong, sleeping %ss and retrying", self.retry_time)
+                    prepared = None
+                    if pos + 1 < len(self.fio_configs):
+                        prepared = (pos + 1, self.submit_prepare(io_pool,
+                                                                 self.fio_configs[pos + 1],
+                                                                 pos + 1))
 
-                    wait([pool.submit(node.connection.close)
-                          for node in self.config.nodes])
+                try:
+                    nodes, intervals = self.run_on_nodes(pool, fio_cfg, pos)
+                except TestStoppedError:
+                    logger.error("Skip results of test {0}".format(fio_cfg.name))
+                    continue
 
-                    time.sleep(self.retry_time)
+                self.save_test_params(pos, fio_cfg, nodes, intervals)
 
-                    wait([pool.submit(reconnect, node.connection, node.conn_url)
-                             for node in self.config.nodes])
+                if not self.pipeline:
+                    results.append(self.load_results(pos, fio_cfg, test_descr,
+                                                     lat_bw_limit_reached))
+                    if check_result is not None and not check_result(results[-1]):
+                        break
+                    continue
 
-                fname = "{0}_task.fio".format(pos)
-                with open(os.path.join(self.config.log_directory, fname), "w") as fd:
-                    fd.write(str(fio_cfg))
+                if self.collect_during_tests:
+                    # results of previous test was downloaded during this test
+                    for prev_pos, prev_cfg, _, futures in not_collected:
+                        for future in futures:
+                            future.result()
+                        prev_descr = get_test_summary(prev_cfg.vals).split("th")[0]
+                        results.append(self.load_results(prev_pos, prev_cfg, prev_descr,
+                                                         lat_bw_limit_reached))
+
+                    futures = [io_pool.submit(self.collect_run, node, fio_cfg, pos)
+                               for node in nodes]
+                    not_collected = [(pos, fio_cfg, nodes, futures)]
+                else:
+                    not_collected.append((pos, fio_cfg, nodes, []))
 
-                params = {'vm_count': len(self.config.nodes)}
-                params['name'] = fio_cfg.name
-                params['vals'] = dict(fio_cfg.vals.items())
-                params['intervals'] = intervals
-                params['nodes'] = [node.get_conn_id() for node in self.config.nodes]
+            if not self.collect_during_tests:
+                # all tests are done - now downloads can't affect results
+                for pos, fio_cfg, nodes, futures in not_collected:
+                    futures.extend(io_pool.submit(self.collect_run, node, fio_cfg, pos)
+                                   for node in nodes)
 
-                fname = "{0}_params.yaml".format(pos)
-                with open(os.path.join(self.config.log_directory, fname), "w") as fd:
-                    fd.write(dumps(params))
+            for pos, fio_cfg, nodes, futures in not_collected:
+                for future in futures:
+                    future.result()
+                test_descr = get_test_summary(fio_cfg.vals).split("th")[0]
+                results.append(self.load_results(pos, fio_cfg, test_descr,
+                                                 lat_bw_limit_reached))
 
-                res = load_test_results(self.config.log_directory, pos)
-                results.append(res)
+        return results
 
-                if self.max_latency is not None:
-                    lat_50, _ = res.get_lat_perc_50_95_multy()
+    def get_batch(self, pos, lat_bw_limit_reached):
+        """
+        select tests for one fio run, starting from pos
+        returns list of tests positions
+        """
+        first = self.fio_configs[pos]
+        positions = [pos]
 
-                    # conver us to ms
-                    if self.max_latency < lat_50:
-                        logger.info(("Will skip all subsequent tests of {0} " +
-                                     "due to lat/bw limits").format(fio_cfg.name))
-                        lat_bw_limit_reached.add(test_descr)
+        for next_pos in range(pos + 1, len(self.fio_configs)):
+            if len(positions) >= self.batch:
+                break
 
-                test_res = res.get_params_from_fio_report()
-                if self.min_bw_per_thread is not None:
-                    if self.min_bw_per_thread > average(test_res['bw']):
-                        lat_bw_limit_reached.add(test_descr)
+            fio_cfg = self.fio_configs[next_pos]
+            test_descr = get_test_summary(fio_cfg.vals).split("th")[0]
+            if test_descr in lat_bw_limit_reached:
+                continue
 
-        return IOTestResults(self.config.params['cfg'],
-                             results, self.config.log_directory)
+            if not is_batch_compatible(first, fio_cfg):
+                break
 
-    def do_run(self, node, barrier, fio_cfg, pos, nolog=False):
-        if self.use_sudo:
-            sudo = "sudo "
-        else:
-            sudo = ""
+            positions.append(next_pos)
 
-        bash_file = """
-#!/bin/bash
+        return positions
 
-function get_dev() {{
-    if [ -b "$1" ] ; then
-        echo $1
-    else
-        echo $(df "$1" | tail -1 | awk '{{print $1}}')
-    fi
-}}
+    def run_batch(self, pool, positions, lat_bw_limit_reached):
+        """
+        run several tests by one fio process and split results
+        into usual per-test files. lat/bw limits are checked
+        only after whole batch is finished
+        """
+        fio_cfgs = [self.fio_configs[pos] for pos in positions]
+        batch = FioJobBatch(fio_cfgs, positions)
 
-function log_io_activiti(){{
-    local dest="$1"
-    local dev=$(get_dev "$2")
-    local sleep_time="$3"
-    dev=$(basename "$dev")
+        exec_time = execution_time(batch)
+        end_dt = datetime.datetime.now() + datetime.timedelta(0, exec_time)
+        logger.info("Will run tests {0} by one fio. Should finish at {1}".format(
+                    ", ".join(fio_cfg.name for fio_cfg in fio_cfgs),
+                    end_dt.strftime("%H:%M:%S")))
 
-    echo $dev
+        try:
+            nodes, intervals = self.run_on_nodes(pool, batch, positions[0])
+        except TestStoppedError:
+            logger.error("Skip results of tests {0}".format(batch.name))
+            return []
 
-    for (( ; ; )) ; do
-        grep -E "\\b$dev\\b" /proc/diskstats >> "$dest"
-        sleep $sleep_time
-    done
-}}
+        sections_intervals = self.split_batch_results(batch, nodes, intervals)
 
-sync
-cd {exec_folder}
+        results = []
+        for pos, fio_cfg, sec_intervals in zip(positions, fio_cfgs, sections_intervals):
+            self.save_test_params(pos, fio_cfg, nodes, sec_intervals)
+            test_descr = get_test_summary(fio_cfg.vals).split("th")[0]
+            results.append(self.load_results(pos, fio_cfg, test_descr,
+                                             lat_bw_limit_reached))
+        return results
+
+    def get_batch_file(self, pos, conn_id, name):
+        "local path for batch result file, which would be splitted"
+        fname = "batch_{0}_{1}_{2}".format(pos, conn_id, name)
+        return os.path.join(self.config.log_directory, fname)
+
+    def split_batch_results(self, batch, nodes, intervals):
+        """
+        split fio json output and diskstats log of batch run into
+        per-test files. Tests run intervals are calculated from
+        jobs elapsed time in fio output
+        returns [[(begin, end)]] - run intervals for each test and node
+        """
+        res = [[] for _ in batch.sections]
+
+        for node, (begin, end) in zip(nodes, intervals):
+            conn_id = node.get_conn_id().replace(":", "_")
+            rawres_path = self.get_batch_file(batch.ids[0], conn_id, "rawres.json")
+            sys_log_path = self.get_batch_file(batch.ids[0], conn_id, "diskstats.bin")
+
+            raw_res = parse_fio_json(open(rawres_path).read())
+
+            # each section is a separated reporting group due to stonewall,
+            # in multi-device test - group per section and device
+            groups = collections.OrderedDict()
+            for job in raw_res['jobs']:
+                groups.setdefault(job['groupid'], []).append(job)
+
+            devices_count = len(self.node_devices.get(node.get_conn_id(), [None]))
+            if len(groups) != len(batch.sections) * devices_count:
+                msg = "Batch run on {0} produces {1} jobs groups instead of {2}"
+                raise StopTestError(msg.format(conn_id, len(groups),
+                                               len(batch.sections) * devices_count))
+
+            groups = groups.values()
+            sections_jobs = [sum(groups[idx * devices_count:(idx + 1) * devices_count], [])
+                             for idx in range(len(batch.sections))]
+
+            sys_log_parts = []
+            offset = 0.0
+            for idx, (pos, fio_cfg, jobs) in enumerate(zip(batch.ids, batch.sections,
+                                                           sections_jobs)):
+                if 'elapsed' in jobs[0]:
+                    duration = max(job['elapsed'] for job in jobs)
+                else:
+                    duration = execution_time(fio_cfg)
 
-log_io_activiti {io_log_file} {test_file} 1 &
-local pid="$!"
+                # elapsed includes fio startup, so it may be longer than run
+                sec_begin = min(begin + offset, end)
+                if idx == len(batch.sections) - 1:
+                    sec_end = end
+                else:
+                    sec_end = min(sec_begin + duration, end)
+                res[idx].append((sec_begin, sec_end))
 
-{fio_path}fio --output-format=json --output={out_file} --alloc-size=262144 {job_file} >{err_out_file} 2>&1
-echo $? >{res_code_file}
-kill -9 $pid
+                fname = "{0}_{1}_rawres.json".format(pos, conn_id)
+                with open(os.path.join(self.config.log_directory, fname), "w") as fd:
+                    fd.write(json.dumps(dict(raw_res, jobs=jobs)))
 
-"""
+                # diskstats sampling starts with fio
+                fname = "{0}_{1}_diskstats.bin".format(pos, conn_id)
+                sys_log_parts.append((os.path.join(self.config.log_directory, fname),
+                                      offset, offset + duration))
 
-        exec_folder = self.config.remote_dir
+                offset += duration
 
-        if self.use_system_fio:
-            fio_path = ""
-        else:
-            if not exec_folder.endswith("/"):
-                fio_path = exec_folder + "/"
-            else:
-                fio_path = exec_folder
+            if os.path.exists(sys_log_path):
+                diskstats.split_log(sys_log_path, sys_log_parts)
+                os.unlink(sys_log_path)
 
-        bash_file = bash_file.format(out_file=self.results_file,
-                                     job_file=self.task_file,
-                                     err_out_file=self.err_out_file,
-                                     res_code_file=self.exit_code_file,
-                                     exec_folder=exec_folder,
-                                     fio_path=fio_path,
-                                     test_file=self.config_params['FILENAME'],
-                                     io_log_file=self.io_log_file).strip()
+            os.unlink(rawres_path)
+
+        return res
 
-        with node.connection.open_sftp() as sftp:
-            save_to_remote(sftp, self.task_file, str(fio_cfg))
-            save_to_remote(sftp, self.sh_file, bash_file)
+    def submit_prepare(self, pool, fio_cfg, pos):
+        return [pool.submit(self.prepare_run, node, fio_cfg, pos)
+                for node in self.active_nodes]
+
+    def save_test_params(self, pos, fio_cfg, nodes, intervals):
+        fname = "{0}_task.fio".format(pos)
+        with open(os.path.join(self.config.log_directory, fname), "w") as fd:
+            fd.write(str(fio_cfg))
+
+        params = {'vm_count': len(nodes)}
+        params['name'] = fio_cfg.name
+        params['vals'] = dict(fio_cfg.vals.items())
+        params['intervals'] = intervals
+        params['nodes'] = [node.get_conn_id() for node in nodes]
+        params['excluded_nodes'] = dict(self.excluded_nodes)
+
+        # empty if test isn't multi-device
+        params['devices'] = dict((node.get_conn_id(), self.node_devices[node.get_conn_id()])
+                                 for node in nodes
+                                 if node.get_conn_id() in self.node_devices)
+
+        if self.sync_start:
+            params['start_times'] = dict((node.get_conn_id(), begin)
+                                         for node, (begin, _) in zip(nodes, intervals))
+            params['time_offsets'] = dict((node.get_conn_id(), node.time_offset or 0.0)
+                                          for node in nodes)
+        params['node_failures'] = dict(self.node_failures)
+
+        if self.file_size_info is not None:
+            params['file_size'] = self.file_size_info
+
+        # empty if jobs weren't pinned
+        params['cpu_pinning'] = dict((node.get_conn_id(),
+                                      dict(self.node_pinning[node.get_conn_id()]))
+                                     for node in nodes
+                                     if node.get_conn_id() in self.node_pinning)
+
+        fname = "{0}_params.yaml".format(pos)
+        with open(os.path.join(self.config.log_directory, fname), "w") as fd:
+            fd.write(dumps(params))
+
+    def load_results(self, pos, fio_cfg, test_descr, lat_bw_limit_reached):
+        """
+        load collected test results and check lat/bw limits,
+        test_descr is added to lat_bw_limit_reached if limit is reached
+        """
+        res = load_test_results(self.config.log_directory, pos)
 
-        exec_time = execution_time(fio_cfg)
+        if self.max_latency is not None:
+            lat_50, _ = res.get_lat_perc_50_95_multy()
+
+            # conver us to ms
+            if self.max_latency < lat_50:
+                logger.info(("Will skip all subsequent tests of {0} " +
+                             "due to lat/bw limits").format(fio_cfg.name))
+                lat_bw_limit_reached.add(test_descr)
+
+        test_res = res.get_params_from_fio_report()
+        if self.min_bw_per_thread is not None:
+            if self.min_bw_per_thread > average(test_res['bw']):
+                lat_bw_limit_reached.add(test_descr)
+
+        return res
+
+    def run_on_nodes(self, pool, fio_cfg, pos):
+        "returns ([Node], [(begin, end)]) - nodes, which passed test and their run intervals"
+        if self.settle_caches:
+            self.settle_nodes_caches()
+
+        if self.fio_server:
+            return self.run_client(fio_cfg, pos)
+        return self.run_isolated(pool, fio_cfg, pos)
+
+    def settle_caches_th(self, node):
+        "returns settle_caches.py report for node"
+        cmd = "python - {0} {1} {2}".format(int(self.drop_caches),
+                                           self.max_dirty // 1024,
+                                           self.settle_timeout)
+        if self.use_sudo:
+            cmd = "sudo " + cmd
+        out = run_on_node(node)(cmd, stdin_data=open(SETTLE_CACHES_SCRIPT).read(),
+                                timeout=self.settle_timeout + 60, nolog=True)
+        return json.loads(out)
+
+    def settle_nodes_caches(self):
+        "sync and drop caches on test and storage nodes in parallel"
+        nodes = self.active_nodes[:]
+        for node in self.config.other_nodes:
+            if any(role in node.roles for role in self.settle_caches_roles) and \
+                    node.connection is not None:
+                nodes.append(node)
+
+        begin = time.time()
+        reports = fan_out(self.settle_caches_th, nodes,
+                          timeout=self.settle_timeout + 120,
+                          return_exceptions=True)
+
+        for node, report in zip(nodes, reports):
+            conn_id = node.get_conn_id()
+            if isinstance(report, Exception):
+                logger.warning("Failed to settle caches on {0}: {1!s}".format(conn_id, report))
+                continue
+
+            after = report['after']
+            msg = "{0}: caches settled in {1:.1f}s, Cached {2}B => {3}B, Dirty+Writeback {4}B"
+            logger.debug(msg.format(conn_id, report['settle_time'],
+                                    b2ssize(report['before']['Cached'] * 1024),
+                                    b2ssize(after['Cached'] * 1024),
+                                    b2ssize((after['Dirty'] + after['Writeback']) * 1024)))
+            if not report['settled']:
+                logger.warning("Dirty pages on {0} aren't written back in {1}s".format(
+                               conn_id, self.settle_timeout))
+
+        logger.info("Caches on {0} nodes are settled in {1:.1f}s".format(len(nodes),
+                                                                         time.time() - begin))
+
+    def get_fio_client_version(self):
+        if self.fio_client_version is None:
+            try:
+                out = subprocess.check_output([self.fio_client, "--version"])
+            except (OSError, subprocess.CalledProcessError) as exc:
+                msg = "Can't run local fio {0!r}, required for fio_server mode: {1!s}"
+                raise StopTestError(msg.format(self.fio_client, exc))
+            self.fio_client_version = out.strip()
+        return self.fio_client_version
+
+    def start_fio_server(self, node, rossh):
+        "start fio server on node, if it isn't started yet by previous tests"
+        if not isinstance(node.connection, Local):
+            creds = parse_ssh_uri(node.conn_url[6:])
+            if (creds.host, int(creds.port)) in JUMP_HOSTS:
+                msg = "Node {0} is behind jump host and can't be used in fio_server mode"
+                raise StopTestError(msg.format(node.get_conn_id()))
+
+        sudo = "sudo " if self.use_sudo else ""
+        pid_file = node.tools.get('fio_server')
+
+        if pid_file is not None:
+            try:
+                rossh("{0}kill -0 $(cat {1})".format(sudo, pid_file), nolog=True)
+                logger.debug("Reuse fio server on %s", node.get_conn_id())
+                return
+            except OSError:
+                del node.tools['fio_server']
+
+        fio_path = "fio" if self.use_system_fio else self.join_remote("fio")
+        version = rossh(fio_path + " --version", nolog=True).strip()
+        if version != self.get_fio_client_version():
+            msg = "fio version on node {0} is {1}, local fio version is {2}"
+            raise StopTestError(msg.format(node.get_conn_id(), version,
+                                           self.get_fio_client_version()))
+
+        # fio server has no authentication and runs jobs as root, so it
+        # listens only on address, used by fio client to reach the node
+        cmd = "cd / && {0}{1} --server=ip:{2},{3} --daemonize={4}"
+        rossh(cmd.format(sudo, fio_path, node.get_ip(), self.fio_server_port,
+                         FIO_SERVER_PID_FILE),
+              nolog=True)
+        node.tools['fio_server'] = FIO_SERVER_PID_FILE
+
+        # normally servers are stopped by disconnect stage, cleanup
+        # is a no-op then, as stop_fio_servers forgets stopped servers
+        clean_resource(stop_fio_servers, [node])
+
+    def run_client(self, fio_cfg, pos):
+        """
+        run test on all active nodes by one local fio client process.
+        fio client stores logs from all nodes in its folder with
+        '<host>.' prefix and reports jobs for all hosts in one json.
+        Unlike run_isolated there is no TestRunState here: test can't be
+        aborted by abort rules or straggler timeout and failure of any
+        node fails the test on all nodes without retries and exclusion
+        returns ([Node], [(begin, end)])
+        """
+        nodes = self.active_nodes[:]
+        run_dir = os.path.join(self.config.log_directory, "fio_client_{0}".format(pos))
+        if os.path.exists(run_dir):
+            shutil.rmtree(run_dir)
+        os.makedirs(run_dir)
+
+        out_file = os.path.join(run_dir, "results.json")
+        err_out_file = os.path.join(run_dir, "fio_err_out")
+        cmd = [self.fio_client, "--output-format=json", "--output=" + out_file]
+
+        hosts = [node.get_ip() for node in nodes]
+        for node, host in zip(nodes, hosts):
+            # job files may differ by node specific options
+            job_file = os.path.join(run_dir, "task_{0}.fio".format(host))
+            with open(job_file, "w") as fd:
+                fd.write(self.get_job_text(node, fio_cfg))
+            cmd.extend(["--client={0},{1}".format(host, self.fio_server_port), job_file])
 
+        exec_time = execution_time(fio_cfg)
         timeout = int(exec_time + max(300, exec_time))
-        soft_tout = exec_time
 
         begin = time.time()
+        with open(err_out_file, "w") as err_fd:
+            proc = subprocess.Popen(cmd, cwd=run_dir,
+                                    stdout=err_fd, stderr=subprocess.STDOUT)
+
+        while proc.poll() is None:
+            if time.time() - begin > timeout:
+                proc.kill()
+                proc.wait()
+                raise StopTestError("Test timeout - fio client killed")
+            time.sleep(0.1)
+
+        end = time.time()
+
+        if proc.returncode != 0:
+            msg = "fio client exit with code {0}: {1}"
+            logger.critical(msg.format(proc.returncode, open(err_out_file).read()).strip())
+            raise StopTestError("fio failed")
 
-        fnames_before = run_on_node(node)("ls -1 " + exec_folder, nolog=True)
+        raw_res = parse_fio_json(open(out_file).read())
 
-        barrier.wait()
+        jobs = collections.defaultdict(lambda: [])
+        for job in raw_res.get('client_stats', []):
+            if job.get('jobname') != 'All clients':
+                jobs[job.get('hostname')].append(job)
 
-        task = BGSSHTask(node, self.use_sudo)
-        task.start(sudo + "bash " + self.sh_file)
+        all_files = os.listdir(run_dir)
+        rawres_fname = os.path.basename(self.results_file)
 
+        for node, host in zip(nodes, hosts):
+            if host not in jobs:
+                raise StopTestError("No results for {0} in fio client output".format(host))
+
+            pref = host + "."
+            files = [fname[len(pref):] for fname in all_files if fname.startswith(pref)]
+            names, _ = self.get_download_names(node, fio_cfg, files, pos)
+
+            node_res = dict((key, val) for key, val in raw_res.items()
+                            if key != 'client_stats')
+            node_res['jobs'] = jobs[host]
+            with open(names.pop(rawres_fname), "w") as fd:
+                fd.write(json.dumps(node_res))
+
+            for fname, loc_path in names.items():
+                shutil.move(os.path.join(run_dir, pref + fname), loc_path)
+
+        shutil.rmtree(run_dir)
+        return nodes, [(begin, end)] * len(nodes)
+
+    def get_progress(self, fio_cfg, run_state):
+        if isinstance(fio_cfg, FioJobBatch):
+            # iops of tests in batch differs, only errors are checked
+            sections = fio_cfg.sections
+            throughput_rules = False
+        else:
+            sections = [fio_cfg]
+            throughput_rules = True
+
+        ramp_time = max(sec.vals.get('ramp_time', 0) for sec in sections)
+        return FioProgress(fio_cfg.name, run_state, self.status_interval,
+                           self.abort_rules, ramp_time, throughput_rules)
+
+    def run_isolated(self, pool, fio_cfg, pos, max_retr=3):
+        """
+        run one test on all active nodes, retrying failed nodes
+        returns ([Node], [(begin, end)]) - nodes, which passed test and
+        their run intervals
+        """
+        attempt = 0
         while True:
-            try:
-                task.wait(soft_tout, timeout)
-                break
-            except paramiko.SSHException:
-                pass
+            nodes = self.active_nodes[:]
+            run_state = TestRunState(len(nodes), self.straggler_timeout)
 
-            try:
-                node.connection.close()
-            except:
-                pass
+            if self.status_interval is not None:
+                run_state.progress = self.get_progress(fio_cfg, run_state)
 
-            reconnect(node.connection, node.conn_url)
+            futures = [pool.submit(self.do_run_isolated, node, run_state, fio_cfg, pos)
+                       for node in nodes]
+            wait(futures)
 
-        end = time.time()
-        rossh = run_on_node(node)
-        fnames_after = rossh("ls -1 " + exec_folder, nolog=True)
+            if run_state.progress is not None:
+                run_state.progress.stop()
+
+            if not run_state.is_aborted():
+                return self.drop_stragglers(nodes, futures, run_state)
+
+            if run_state.stopped:
+                raise TestStoppedError(run_state.abort_reason)
+
+            logger.error("Test %s aborted on all nodes - %s", fio_cfg.name,
+                         run_state.abort_reason)
+
+            need_reconnect = []
+            excluded_count = len(self.excluded_nodes)
+            for node in nodes:
+                exc = run_state.failed.get(node.get_conn_id())
+                if exc is None:
+                    continue
+
+                if self.count_node_failure(node, exc):
+                    continue
+
+                if isinstance(exc, StopTestError):
+                    raise exc
+
+                if isinstance(exc, (EnvironmentError, SSHException)):
+                    need_reconnect.append(node)
+
+            if len(self.active_nodes) == 0:
+                raise StopTestError("All test nodes are excluded due to failures")
+
+            # attempts, which leads to nodes exclusion, aren't counted
+            if excluded_count == len(self.excluded_nodes):
+                attempt += 1
+                if attempt == max_retr:
+                    raise StopTestError("Fio failed: " + run_state.abort_reason)
+
+            if len(need_reconnect) != 0:
+                # healthy connections are kept, dead are reconnected at once
+                checks = [pool.submit(ensure_connected, node.connection, True)
+                          for node in need_reconnect]
+                wait(checks)
+                need_reconnect = [node for node, check in zip(need_reconnect, checks)
+                                  if not check.result()]
+
+            if len(need_reconnect) != 0:
+                logger.info("Can't reconnect %s, sleeping %ss and retrying",
+                            ",".join(node.get_conn_id() for node in need_reconnect),
+                            self.retry_time)
+
+                time.sleep(self.retry_time)
+                wait([pool.submit(reconnect, node.connection, node.conn_url)
+                      for node in need_reconnect])
+            else:
+                logger.info("Retrying test on %s nodes", len(self.active_nodes))
 
+    def count_node_failure(self, node, exc):
+        """
+        count node failure, node is excluded from the rest of tests after
+        max_node_failures failures. Returns True if node was excluded
+        """
+        conn_id = node.get_conn_id()
+        self.node_failures[conn_id] += 1
+        if self.max_node_failures is None or \
+                self.node_failures[conn_id] < self.max_node_failures:
+            return False
+
+        logger.error("Node %s failed %s times, excluding it from the rest of tests",
+                     conn_id, self.node_failures[conn_id])
+        self.excluded_nodes[conn_id] = str(exc)
+        self.active_nodes.remove(node)
+        return True
+
+    def drop_stragglers(self, nodes, futures, run_state):
+        """
+        results of nodes, killed by straggler timeout, are dropped for
+        this test only, results of finished nodes are kept
+        returns ([Node], [(begin, end)]) - finished nodes and their run intervals
+        """
+        passed_nodes = []
+        intervals = []
+        for node, future in zip(nodes, futures):
+            exc = run_state.stragglers.get(node.get_conn_id())
+            if exc is None:
+                passed_nodes.append(node)
+                intervals.append(future.result())
+            else:
+                self.count_node_failure(node, exc)
+
+        return passed_nodes, intervals
+
+    def do_run_isolated(self, node, run_state, fio_cfg, pos):
+        try:
+            res = self.do_run(node, run_state, fio_cfg, pos)
+            if res is None:
+                raise RuntimeError("fio failed to start")
+            return res
+        except TaksFinished:
+            # test was aborted due to other node failure
+            raise
+        except StragglerKilled as exc:
+            logger.error("Node %s is too slow, test %s results of it are dropped",
+                         node.get_conn_id(), fio_cfg.name)
+            run_state.node_straggled(node.get_conn_id(), exc)
+            raise
+        except Exception as exc:
+            logger.exception("During fio run on node %s", node.get_conn_id())
+            run_state.node_failed(node.get_conn_id(), exc)
+            raise
+
+    def list_remote_dir(self, node, path):
+        agent = get_agent(node.connection)
+        if agent is not None:
+            return agent.listdir(path)
+        return run_on_node(node)("ls -1 " + path, nolog=True).split()
+
+    def read_run_status(self, node, conn_id, begin, time_offset, pos):
+        """
+        check fio exit code and get its start time
+        returns fio start time or None if fio failed to start
+        """
+        exit_code_file = self.run_path(self.exit_code_file, pos)
+        err_out_file = self.run_path(self.err_out_file, pos)
+        start_time_file = self.run_path(self.start_time_file, pos)
+        service_files = [exit_code_file, err_out_file, start_time_file]
+        agent = get_agent(node.connection)
+
+        if agent is not None:
+            data = agent.get_many(service_files)
+        else:
+            data = {}
+            with open_sftp(node.connection) as sftp:
+                for path in service_files:
+                    try:
+                        data[path] = read_from_remote(sftp, path)
+                    except IOError:
+                        pass
+
+        if exit_code_file not in data:
+            logger.error("No exit code file found on %s. Looks like process failed to start",
+                         conn_id)
+            return None
+
+        exit_code = data[exit_code_file].strip()
+        if exit_code != '0':
+            msg = "fio exit with code {0}: {1}".format(exit_code,
+                                                       data.get(err_out_file, ""))
+            logger.critical(msg.strip())
+            raise StopTestError("fio failed")
+
+        try:
+            return float(data[start_time_file].strip()) - time_offset
+        except (KeyError, ValueError):
+            logger.warning("Can't get fio start time on %s", conn_id)
+            return begin
+
+    def get_local_names(self, files, pos, conn_id, device=None):
+        """
+        returns {log file name: local path} for fio logs from get_result_files,
+        device label is added to names of multi-device test logs
+        """
+        res = {}
+        for ftype, fls in files.items():
+            for idx, fname in fls:
+                if device is None:
+                    loc_fname = "{0}_{1}_{2}.{3}.log".format(pos, conn_id, ftype, idx)
+                else:
+                    loc_fname = "{0}_{1}_{2}.{3}.{4}.log".format(pos, conn_id, ftype, idx,
+                                                                  device)
+                res[fname] = os.path.join(self.config.log_directory, loc_fname)
+        return res
+
+    def get_download_names(self, node, fio_cfg, new_files, pos):
+        """
+        returns ({result file name: local path}, [all result files]).
+        For batch logs are mapped to each test files, fio output
+        and diskstats are stored to be splitted by split_batch_results
+        """
         conn_id = node.get_conn_id().replace(":", "_")
-        if not nolog:
-            logger.debug("Test on node {0} is finished".format(conn_id))
+        names = {}
+        all_files = set()
+        for sec_pos, label, sec in self.get_node_sections(node, fio_cfg, pos):
+            files, sec_files = self.get_result_files(sec, new_files)
+            files.pop('diskstats', None)
+            names.update(self.get_local_names(files, sec_pos, conn_id, label))
+            all_files.update(sec_files)
+
+        if isinstance(fio_cfg, FioJobBatch):
+            rawres_path = self.get_batch_file(pos, conn_id, "rawres.json")
+            io_log_path = self.get_batch_file(pos, conn_id, "diskstats.bin")
+        else:
+            rawres_path = os.path.join(self.config.log_directory,
+                                       "{0}_{1}_rawres.json".format(pos, conn_id))
+            io_log_path = os.path.join(self.config.log_directory,
+                                       "{0}_{1}_diskstats.bin".format(pos, conn_id))
+
+        names[os.path.basename(self.results_file)] = rawres_path
+
+        io_log_fname = os.path.basename(self.io_log_file)
+        if io_log_fname in all_files:
+            names[io_log_fname] = io_log_path
+
+        return names, list(all_files)
 
+    def get_result_files(self, fio_cfg, new_files):
+        """
+        select fio logs and diskstats log from files, created by test
+        returns ({type: [(idx, fname)]}, [fname]) - logs by type and
+        list of all result files, including fio json output
+        """
         log_files_pref = []
         if 'write_lat_log' in fio_cfg.vals:
             fname = fio_cfg.vals['write_lat_log']
@@ -901,7 +2389,6 @@ kill -9 $pid
 
         files = collections.defaultdict(lambda: [])
         all_files = [os.path.basename(self.results_file)]
-        new_files = set(fnames_after.split()) - set(fnames_before.split())
 
         for fname in new_files:
             if fname.endswith('.log') and fname.split('.')[0] in log_files_pref:
@@ -915,69 +2402,370 @@ kill -9 $pid
                 files[tp].append((int(cnt), fname))
                 all_files.append(fname)
             elif fname == os.path.basename(self.io_log_file):
-                files['iops'].append(('sys', fname))
+                files['diskstats'].append(('bin', fname))
                 all_files.append(fname)
 
-        arch_name = self.join_remote('wally_result.tar.gz')
-        tmp_dir = os.path.join(self.config.log_directory, 'tmp_' + conn_id)
+        return files, all_files
+
+    def do_run_local(self, node, run_state, fio_cfg, pos):
+        """
+        run test on local node - spawn fio directly, without bash
+        wrapper, screen and tar, collect diskstats in this process
+        """
+        exec_folder = self.config.remote_dir
+        conn_id = node.get_conn_id().replace(":", "_")
 
-        if os.path.exists(tmp_dir):
-            shutil.rmtree(tmp_dir)
+        with open(self.task_file, "w") as fd:
+            fd.write(self.get_job_text(node, fio_cfg))
 
-        os.mkdir(tmp_dir)
-        loc_arch_name = os.path.join(tmp_dir, 'wally_result.{0}.tar.gz'.format(conn_id))
-        file_full_names = " ".join(all_files)
+        if self.use_system_fio:
+            cmd = ["fio"]
+        else:
+            cmd = [self.join_remote("fio")]
+
+        if self.use_sudo:
+            cmd = ["sudo"] + cmd
+
+        cmd.extend(["--output-format=json",
+                    "--output=" + self.results_file,
+                    "--alloc-size=262144"])
+
+        if self.status_interval is not None:
+            cmd.append("--status-interval={0}".format(self.status_interval))
+
+        cmd.append(self.task_file)
+
+        if os.path.exists(self.results_file):
+            os.unlink(self.results_file)
+
+        exec_time = execution_time(fio_cfg)
+        timeout = int(exec_time + max(300, exec_time))
+
+        fnames_before = set(os.listdir(exec_folder))
+        if isinstance(fio_cfg, FioJobBatch):
+            sys_log_path = self.get_batch_file(pos, conn_id, "diskstats.bin")
+        else:
+            sys_log_fname = "{0}_{1}_diskstats.bin".format(pos, conn_id)
+            sys_log_path = os.path.join(self.config.log_directory, sys_log_fname)
 
+        sampler = DiskStatsSampler(self.get_node_test_files(node), sys_log_path,
+                                   self.diskstats_interval / 1000.0)
+
+        run_state.barrier.wait()
+        subprocess.check_call(["sync"])
+
+        if self.sync_start:
+            start_at = run_state.get_start_time(self.sync_start_lead)
+            time.sleep(max(0, start_at - time.time()))
+
+        sampler.start()
+
+        begin = time.time()
         try:
-            os.unlink(loc_arch_name)
-        except:
-            pass
+            with open(self.err_out_file, "w") as err_fd:
+                proc = subprocess.Popen(cmd, cwd=exec_folder,
+                                        stdout=err_fd, stderr=subprocess.STDOUT)
+
+            if run_state.progress is not None:
+                run_state.progress.follow_local(node.get_conn_id(), self.results_file)
+
+            while proc.poll() is None:
+                if run_state.should_stop() or time.time() - begin > timeout:
+                    stop_local_fio(proc)
+                    if run_state.is_aborted():
+                        raise TaksFinished()
+                    if run_state.is_straggler_deadline():
+                        raise StragglerKilled("Local node is too slow - " +
+                                              "fio killed after straggler timeout")
+                    raise RuntimeError("Local fio killed by timeout")
+                time.sleep(0.1)
+        finally:
+            sampler.stop()
+
+        end = time.time()
+        run_state.node_finished()
+
+        if proc.returncode != 0:
+            err_out = open(self.err_out_file).read()
+            msg = "fio exit with code {0}: {1}".format(proc.returncode, err_out)
+            logger.critical(msg.strip())
+            raise StopTestError("fio failed")
+
+        names, _ = self.get_download_names(node, fio_cfg,
+                                           set(os.listdir(exec_folder)) - fnames_before,
+                                           pos)
+
+        for fname, loc_path in names.items():
+            shutil.move(os.path.join(exec_folder, fname), loc_path)
+
+        return begin, end
+
+    def get_run_dir(self, pos):
+        "remote folder for test files, in pipelined mode each test has own"
+        if self.pipeline:
+            return self.join_remote("run_{0}".format(pos))
+        return self.config.remote_dir
+
+    def run_path(self, path, pos):
+        "path of test file in run folder"
+        return os.path.join(self.get_run_dir(pos), os.path.basename(path))
+
+    def do_run(self, node, run_state, fio_cfg, pos, nolog=False):
+        if isinstance(node.connection, Local):
+            return self.do_run_local(node, run_state, fio_cfg, pos)
+
+        if self.pipeline:
+            # task is uploaded in advance, results are collected by run()
+            return self.execute_run(node, run_state, fio_cfg, pos)
+
+        fnames_before = self.prepare_run(node, fio_cfg, pos)
+        res = self.execute_run(node, run_state, fio_cfg, pos)
+        if res is not None:
+            self.collect_run(node, fio_cfg, pos, fnames_before, nolog)
+        return res
+
+    def prepare_run(self, node, fio_cfg, pos):
+        """
+        upload fio task and runner script to node
+        returns list of files in run folder before test
+        """
+        if isinstance(node.connection, Local):
+            return []
+
+        bash_file = """
+#!/bin/bash
+
+function wait_till(){{
+    local start_at_ns="$1"
+    local now_ns=$(date +%s%N)
+    local delay_ms=$(( (start_at_ns - now_ns) / 1000000 ))
+
+    if (( delay_ms > 0 )) ; then
+        sleep $(printf "%d.%03d" $(( delay_ms / 1000 )) $(( delay_ms % 1000 )))
+    fi
+}}
+
+sync
+cd {exec_folder}
+rm -f {out_file}
+
+if [ "$1" != "" ] ; then
+    wait_till "$1"
+fi
+
+PY=$(which python || which python3)
+$PY {diskstats_script} {diskstats_interval} {io_log_file} {test_files} &
+pid="$!"
+
+date +%s.%N >{start_time_file}
+{fio_path}fio --output-format=json --output={out_file} --alloc-size=262144 {status_opt}{job_file} >{err_out_file} 2>&1
+echo $? >{res_code_file}
+kill $pid
+wait $pid
+
+"""
+
+        exec_folder = self.get_run_dir(pos)
+        fio_folder = self.config.remote_dir
+
+        if self.use_system_fio:
+            fio_path = ""
+        else:
+            if not fio_folder.endswith("/"):
+                fio_path = fio_folder + "/"
+            else:
+                fio_path = fio_folder
+
+        if self.status_interval is not None:
+            status_opt = "--status-interval={0} ".format(self.status_interval)
+        else:
+            status_opt = ""
+
+        bash_file = bash_file.format(out_file=self.run_path(self.results_file, pos),
+                                     status_opt=status_opt,
+                                     job_file=self.run_path(self.task_file, pos),
+                                     err_out_file=self.run_path(self.err_out_file, pos),
+                                     res_code_file=self.run_path(self.exit_code_file, pos),
+                                     start_time_file=self.run_path(self.start_time_file, pos),
+                                     exec_folder=exec_folder,
+                                     fio_path=fio_path,
+                                     test_files=" ".join(self.get_node_test_files(node)),
+                                     diskstats_script=self.diskstats_remote,
+                                     diskstats_interval=self.diskstats_interval,
+                                     io_log_file=self.run_path(self.io_log_file, pos)).strip()
+
+        if self.pipeline:
+            run_on_node(node)("mkdir -p {0}".format(exec_folder), nolog=True)
+
+        with open_sftp(node.connection) as sftp:
+            save_to_remote(sftp, self.run_path(self.task_file, pos),
+                           self.get_job_text(node, fio_cfg))
+            save_to_remote(sftp, self.run_path(self.sh_file, pos), bash_file)
+
+        return self.list_remote_dir(node, exec_folder)
+
+    def execute_run(self, node, run_state, fio_cfg, pos):
+        """
+        start prepared test synchronously with other nodes and wait
+        for it. Returns (fio start time, end time) or None if
+        fio failed to start
+        """
+        if self.use_sudo:
+            sudo = "sudo "
+        else:
+            sudo = ""
+
+        exec_time = execution_time(fio_cfg)
+
+        timeout = int(exec_time + max(300, exec_time))
+        soft_tout = exec_time
+
+        begin = time.time()
+
+        run_state.barrier.wait()
 
-        with node.connection.open_sftp() as sftp:
+        cmd = sudo + "bash " + self.run_path(self.sh_file, pos)
+        time_offset = node.time_offset or 0.0
+
+        if self.sync_start:
+            start_at = run_state.get_start_time(self.sync_start_lead)
+            cmd += " {0}".format(int((start_at + time_offset) * 1E9))
+            soft_tout += max(0, start_at - time.time())
+
+        # connection monitor probes would disturb test and loaded node
+        # may not answer them in time, so it's paused till fio finishes
+        with pause_monitoring():
+            task = BGSSHTask(node, self.use_sudo)
+            task.start(cmd)
             try:
-                exit_code = read_from_remote(sftp, self.exit_code_file)
-            except IOError:
-                logger.error("No exit code file found on %s. Looks like process failed to start",
-                             conn_id)
-                return None
+                if run_state.progress is not None:
+                    run_state.progress.follow_remote(node, self.run_path(self.results_file, pos))
 
-            err_out = read_from_remote(sftp, self.err_out_file)
-            exit_code = exit_code.strip()
+                finished = self.wait_task(node, task, run_state, soft_tout, timeout)
+            finally:
+                task.release()
 
-            if exit_code != '0':
-                msg = "fio exit with code {0}: {1}".format(exit_code, err_out)
-                logger.critical(msg.strip())
-                raise StopTestError("fio failed")
+        if not finished:
+            if run_state.is_aborted():
+                raise TaksFinished()
 
-            rossh("rm -f {0}".format(arch_name), nolog=True)
-            pack_files_cmd = "cd {0} ; tar zcvf {1} {2}".format(exec_folder, arch_name, file_full_names)
-            rossh(pack_files_cmd, nolog=True)
-            sftp.get(arch_name, loc_arch_name)
+            if run_state.is_straggler_deadline():
+                raise StragglerKilled("Node is too slow - killed after straggler timeout")
 
-        unpack_files_cmd = "cd {0} ; tar xvzf {1} >/dev/null".format(tmp_dir, loc_arch_name)
-        subprocess.check_call(unpack_files_cmd, shell=True)
-        os.unlink(loc_arch_name)
+            raise RuntimeError("Test timeout - fio killed")
+
+        run_state.node_finished()
+        end = time.time()
+
+        conn_id = node.get_conn_id().replace(":", "_")
+        begin = self.read_run_status(node, conn_id, begin, time_offset, pos)
+        if begin is None:
+            return None
 
-        for ftype, fls in files.items():
-            for idx, fname in fls:
-                cname = os.path.join(tmp_dir, fname)
-                loc_fname = "{0}_{1}_{2}.{3}.log".format(pos, conn_id, ftype, idx)
-                loc_path = os.path.join(self.config.log_directory, loc_fname)
-                os.rename(cname, loc_path)
-
-        cname = os.path.join(tmp_dir,
-                             os.path.basename(self.results_file))
-        loc_fname = "{0}_{1}_rawres.json".format(pos, conn_id)
-        loc_path = os.path.join(self.config.log_directory, loc_fname)
-        os.rename(cname, loc_path)
-        os.rmdir(tmp_dir)
-
-        remove_remote_res_files_cmd = "cd {0} ; rm -f {1} {2}".format(exec_folder,
-                                                                      arch_name,
-                                                                      file_full_names)
-        rossh(remove_remote_res_files_cmd, nolog=True)
         return begin, end
 
+    def wait_task(self, node, task, run_state, soft_tout, timeout):
+        """
+        wait for fio on node, restoring lost connection up to
+        max_reconnects times. Returns False if fio was killed
+        """
+        # timeouts are counted from fio start, not from last reconnect
+        soft_end_time = time.time() + soft_tout
+        end_time = time.time() + timeout
+        reconnects = 0
+
+        while True:
+            try:
+                return task.wait(max(0, soft_end_time - time.time()),
+                                 max(0, end_time - time.time()),
+                                 run_state.should_stop)
+            except paramiko.SSHException as exc:
+                reconnects += 1
+                if reconnects > self.max_reconnects:
+                    msg = "Connection to {0} is lost {1} times during test, giving up"
+                    raise StopTestError(msg.format(node.get_conn_id(), reconnects), exc)
+
+                logger.warning("Connection to {0} is lost during test: {1!s}. Reconnecting"
+                               .format(node.get_conn_id(), exc))
+
+            try:
+                node.connection.close()
+            except:
+                pass
+
+            try:
+                reconnect(node.connection, node.conn_url)
+            except Exception as exc:
+                logger.warning("Can't reconnect to {0}: {1!s}".format(node.get_conn_id(), exc))
+                time.sleep(self.reconnect_delay)
+                continue
+
+            task.refresh_agent()
+
+    def collect_run(self, node, fio_cfg, pos, fnames_before=(), nolog=False):
+        "download test results from node and remove them from it"
+        if isinstance(node.connection, Local):
+            return
+
+        exec_folder = self.get_run_dir(pos)
+        fnames_after = self.list_remote_dir(node, exec_folder)
+
+        conn_id = node.get_conn_id().replace(":", "_")
+        if not nolog:
+            logger.debug("Collecting results of test {0} from node {1}".format(pos, conn_id))
+
+        new_files = set(fnames_after) - set(fnames_before)
+        names, all_files = self.get_download_names(node, fio_cfg, new_files, pos)
+
+        if self.reduce_logs is not None:
+            log_files = [fname for fname in names if fname.endswith('.log')]
+            if len(log_files) != 0:
+                self.reduce_node_logs(node, exec_folder, log_files, pos)
+                loc_fname = "{0}_{1}_logsumm.json".format(pos, conn_id)
+                names[REDUCED_LOGS_SUMMARY] = os.path.join(self.config.log_directory, loc_fname)
+                all_files.append(REDUCED_LOGS_SUMMARY)
+
+        get_files_stream(node.connection, exec_folder, names,
+                         compress=self.compress_results,
+                         node=conn_id)
+
+        if self.pipeline:
+            run_on_node(node)("rm -rf " + exec_folder, nolog=True)
+            return
+
+        paths = [os.path.join(exec_folder, fname) for fname in all_files]
+        # stale status files shouldn't be taken for next test status
+        paths.extend([self.exit_code_file, self.start_time_file])
+
+        agent = get_agent(node.connection)
+        if agent is not None:
+            # files, which fio didn't create, are ok
+            agent.remove(paths, missing_ok=True)
+        else:
+            run_on_node(node)("rm -f " + " ".join(paths), nolog=True)
+
+    def reduce_node_logs(self, node, exec_folder, log_files, pos):
+        "replace fio logs on node by averaged ones, see reduce_logs.py"
+        if self.keep_raw_logs:
+            raw_dir = os.path.join(self.raw_logs_dir, str(self.config.test_uuid),
+                                   os.path.basename(self.config.log_directory),
+                                   str(pos))
+        else:
+            raw_dir = "-"
+
+        cmd = "cd {0} && python - {1} {2} {3} {4}".format(exec_folder,
+                                                         self.reduce_logs,
+                                                         REDUCED_LOGS_SUMMARY,
+                                                         raw_dir,
+                                                         " ".join(sorted(log_files)))
+        run_on_node(node)(cmd, stdin_data=open(REDUCE_LOGS_SCRIPT).read(),
+                          timeout=max(60, self.soft_runcycle), nolog=True)
+
+    @classmethod
+    def console_summary(cls, result):
+        return "{0.oper}{0.mode} {0.bsize:>4} {0.th_count:>3}th {0.vm_count:>2}vm".format(
+            result.summary_tpl())
+
     @classmethod
     def prepare_data(cls, results):
         """
@@ -1026,7 +2814,7 @@ kill -9 $pid
             iops = round_3_digit(iops)
             bw = round_3_digit(bw)
 
-            summ = "{0.oper}{0.mode} {0.bsize:>4} {0.th_count:>3}th {0.vm_count:>2}vm".format(item.summary_tpl())
+            summ = cls.console_summary(item)
 
             res.append({"name": key_func(item)[0],
                         "key": key_func(item)[:4],
@@ -1087,6 +2875,59 @@ kill -9 $pid
             prev_k = item["key"]
             tab.add_row([item[f.attr] for f in cls.fiels_and_header])
 
+        res = tab.draw()
+        if any(len(item.devices()) != 0 for item in results):
+            res += "\n\n" + cls.format_devices_for_console(results)
+        return res
+
+    @classmethod
+    def format_devices_for_console(cls, results):
+        """
+        create a table with per device and per node
+        results of multi-device tests for console
+        """
+        tab = texttable.Texttable(max_width=120)
+        tab.set_deco(tab.HEADER | tab.VLINES | tab.BORDER)
+        tab.set_cols_align(["l", "l", "l", "r", "r", "r"])
+        tab.set_cols_dtype(["t", "t", "t", "i", "i", "t"])
+        tab.header(["Test", "Node", "Device", "IOPS", "KiBps", "IOPS\nsys"])
+        sep = ["-" * 3] * 6
+
+        def sys_iops(matr, conn_id):
+            if matr is None or conn_id not in matr.connections_ids:
+                return "-"
+            series = matr.per_vm()[matr.connections_ids.index(conn_id)]
+            return str(int(sum(average(ts.values) for ts in series)))
+
+        first = True
+        for item in sorted(results, key=lambda item: item.idx):
+            if len(item.devices()) == 0:
+                continue
+
+            if not first:
+                tab.add_row(sep)
+            first = False
+
+            summ = "{0} {1}".format(item.name, cls.console_summary(item))
+            nodes = item.bw.connections_ids
+            total = item.get_params_from_fio_report()
+            per_dev = dict((dev, item.get_params_from_fio_report(dev))
+                           for dev in item.devices())
+
+            for node_idx, conn_id in enumerate(nodes):
+                for dev in item.devices():
+                    if len(item.get_node_jobs(conn_id, dev)) == 0:
+                        continue
+                    tab.add_row([summ, conn_id, dev,
+                                 per_dev[dev]['flt_iops'][node_idx],
+                                 per_dev[dev]['flt_bw'][node_idx],
+                                 sys_iops(item.devices_ts[dev].get('iops:sys'), conn_id)])
+
+                tab.add_row([summ, conn_id, "all",
+                             total['flt_iops'][node_idx],
+                             total['flt_bw'][node_idx],
+                             sys_iops(item.iops_sys, conn_id)])
+
         return tab.draw()
 
     @classmethod
@@ -50,6 +50,91 @@ class FioJobSection(object):
         return res
 
 
+LOG_OPTIONS = ('write_lat_log', 'write_iops_log', 'write_bw_log')
+
+
+class FioJobBatch(object):
+    """
+    Several sections, executed by one fio run one after another.
+    Each section gets own log files prefix and starts a new
+    reporting group, so results can be splitted back
+
+    sections:[FioJobSection] - sections with updated log prefixes
+    ids:[int] - sections ids, provided by caller
+    name:str - name for logging
+    """
+    def __init__(self, sections, ids):
+        self.ids = ids
+        self.sections = []
+
+        for idx, sec in enumerate(sections):
+            sec = sec.copy()
+            for opt in LOG_OPTIONS:
+                if opt in sec.vals:
+                    sec.vals[opt] = "{0}_s{1}".format(sec.vals[opt], idx)
+            sec.vals['stonewall'] = '1'
+            self.sections.append(sec)
+
+        self.name = "{0}+{1}".format(sections[0].name, len(sections) - 1)
+
+    def __str__(self):
+        return "\n".join(map(str, self.sections))
+
+
+def device_label(path):
+    "short device name for job names, logs and reports: /dev/vdb => vdb"
+    name = os.path.basename(path.rstrip('/'))
+    return name.replace('.', '-').replace('_', '-').replace('@', '-')
+
+
+DEVICE_SEP = '@'
+
+
+def split_by_devices(sec, devices):
+    """
+    returns [(device label, section)] - copy of section for each device.
+    Copies run simultaneously, each copy is a separated reporting group
+    with own log files prefix and '<name>@<label>' job name
+    """
+    res = []
+    for idx, dev in enumerate(devices):
+        label = device_label(dev)
+        dev_sec = sec.copy()
+        dev_sec.name = "{0}{1}{2}".format(sec.name, DEVICE_SEP, label)
+        dev_sec.vals['filename'] = dev
+
+        for opt in LOG_OPTIONS:
+            if opt in dev_sec.vals:
+                dev_sec.vals[opt] = "{0}_{1}".format(dev_sec.vals[opt], label)
+
+        if idx != 0:
+            dev_sec.vals.pop('stonewall', None)
+            dev_sec.vals['new_group'] = '1'
+
+        res.append((label, dev_sec))
+    return res
+
+
+def get_job_device(job):
+    "returns device label for job from fio json output or None"
+    name = job.get('jobname', '')
+    if DEVICE_SEP in name:
+        return name.rsplit(DEVICE_SEP, 1)[1]
+    return None
+
+
+def is_batch_compatible(sec1, sec2):
+    "could sections be executed by one fio run"
+    if sec1.vals.get('filename') != sec2.vals.get('filename'):
+        return False
+
+    for opt in LOG_OPTIONS:
+        if (opt in sec1.vals) != (opt in sec2.vals):
+            return False
+
+    return True
+
+
 class ParseError(ValueError):
     def __init__(self, msg, fname, lineno, line_cont=""):
         ValueError.__init__(self, msg)
@@ -388,6 +473,8 @@ def get_test_summary(sec, vm_count=None):
 
 
 def execution_time(sec):
+    if isinstance(sec, FioJobBatch):
+        return sum(map(execution_time, sec.sections))
     return sec.vals.get('ramp_time', 0) + sec.vals.get('runtime', 0)
 
 
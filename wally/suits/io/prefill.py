@@ -0,0 +1,135 @@
+"""
+Test files prefill checker, executed on test node by io test as
+'python - ARGS' with this file as stdin. Doesn't depend on wally.
+
+check - for each file detect if it has to be filled: too small, has
+        holes (SEEK_HOLE) or zero blocks at sampled offsets. Files,
+        found in manifest with the same device/inode and enough size,
+        are only checked for zero first block. Verified files are
+        added to manifest.
+        Prints json {fname: reason or null}
+update - add files to manifest, after they was filled
+
+usage: prefill.py check|update MANIFEST NUM_BLOCKS FNAME:SIZE_MIB...
+"""
+import os
+import sys
+import json
+import stat
+import random
+
+
+SEEK_HOLE = getattr(os, 'SEEK_HOLE', 4)
+SAMPLE_SIZE = 1024
+
+
+def load_manifest(path):
+    try:
+        with open(path) as fd:
+            return json.load(fd)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def save_manifest(path, manifest):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as fd:
+        fd.write(json.dumps(manifest))
+    os.rename(tmp_path, path)
+
+
+def get_entry(st, size):
+    return {'dev': st.st_dev, 'ino': st.st_ino, 'rdev': st.st_rdev, 'size': size}
+
+
+def in_manifest(entry, manifest_entry):
+    if manifest_entry is None:
+        return False
+
+    for key in ('dev', 'ino', 'rdev'):
+        if manifest_entry.get(key) != entry[key]:
+            return False
+
+    return manifest_entry.get('size', 0) >= entry['size']
+
+
+def find_hole(fd, size):
+    "returns offset of first hole in first size bytes or None"
+    try:
+        hole = os.lseek(fd, 0, SEEK_HOLE)
+    except OSError:
+        # SEEK_HOLE isn't supported
+        return None
+    return hole if hole < size else None
+
+
+def is_zero_block(fd, offset):
+    os.lseek(fd, offset, os.SEEK_SET)
+    data = os.read(fd, SAMPLE_SIZE)
+    return data.count(b'\0') == len(data)
+
+
+def check_file(fname, size, manifest, num_blocks):
+    "returns reason, why file need to be filled, or None"
+    try:
+        st = os.stat(fname)
+    except OSError:
+        return "no such file"
+
+    is_regular = stat.S_ISREG(st.st_mode)
+    if is_regular and st.st_size < size:
+        return "file is too small"
+
+    fd = os.open(fname, os.O_RDONLY)
+    try:
+        if in_manifest(get_entry(st, size), manifest.get(fname)):
+            # one block check to catch new empty volume with the same device number
+            if not is_zero_block(fd, 0):
+                return None
+
+        if is_regular:
+            hole = find_hole(fd, size)
+            if hole is not None:
+                return "hole at offset {0}".format(hole)
+
+        offsets = [random.randrange(size - SAMPLE_SIZE) for _ in range(num_blocks)]
+        offsets.extend([0, size - SAMPLE_SIZE])
+
+        for offset in offsets:
+            if is_zero_block(fd, offset):
+                return "zero block at offset {0}".format(offset)
+    finally:
+        os.close(fd)
+
+    manifest[fname] = get_entry(st, size)
+    return None
+
+
+def main(argv):
+    action = argv[1]
+    manifest_path = argv[2]
+    num_blocks = int(argv[3])
+
+    files = []
+    for arg in argv[4:]:
+        fname, size = arg.rsplit(":", 1)
+        files.append((fname, int(size) * 1024 ** 2))
+
+    manifest = load_manifest(manifest_path)
+
+    if action == 'check':
+        res = {}
+        for fname, size in files:
+            res[fname] = check_file(fname, size, manifest, num_blocks)
+        sys.stdout.write(json.dumps(res))
+    else:
+        assert action == 'update'
+        for fname, size in files:
+            manifest[fname] = get_entry(os.stat(fname), size)
+
+    save_manifest(manifest_path, manifest)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,102 @@
+"""
+fio logs reducer, executed on test node by io test as 'python - ARGS'
+with this file as stdin. Doesn't depend on wally.
+
+Each fio log is replaced by series of averages over INTERVAL ms windows
+in the same 'offset, value' format, so it's loaded as usual raw log.
+Samples count/min/max/avg for each log and log2 histograms for latency
+logs are stored to summary file as json.
+
+usage: reduce_logs.py INTERVAL_MS SUMMARY_FILE RAW_LOGS_DIR|- LOG_FILE...
+"""
+import os
+import sys
+import json
+import shutil
+
+
+LAT_TYPES = ('lat', 'clat', 'slat')
+
+
+def log_type(fname):
+    "fio_log_clat.1.log => clat"
+    return os.path.basename(fname).split('.')[0].split('_')[-1]
+
+
+def reduce_log(fname, interval):
+    """
+    replace log by averaged one, returns samples summary
+    """
+    is_lat = log_type(fname) in LAT_TYPES
+    windows = {}
+    count = 0
+    total = 0
+    vmin = None
+    vmax = None
+    hist = {}
+
+    with open(fname) as fd:
+        for line in fd:
+            items = line.split(',')
+            if len(items) < 2:
+                continue
+
+            offset = int(items[0])
+            val = int(items[1])
+
+            # offset is the end of sample period
+            idx = max(offset - 1, 0) // interval
+            wsum, wcount = windows.get(idx, (0, 0))
+            windows[idx] = (wsum + val, wcount + 1)
+
+            count += 1
+            total += val
+            vmin = val if vmin is None else min(vmin, val)
+            vmax = val if vmax is None else max(vmax, val)
+
+            if is_lat:
+                bucket = val.bit_length() if hasattr(val, 'bit_length') else len(bin(val)) - 2
+                hist[bucket] = hist.get(bucket, 0) + 1
+
+    tmp_fname = fname + ".tmp"
+    with open(tmp_fname, "w") as fd:
+        for idx in sorted(windows):
+            wsum, wcount = windows[idx]
+            fd.write("{0}, {1}, 0, 0\n".format((idx + 1) * interval, wsum // wcount))
+
+    res = {'count': count,
+           'min': vmin,
+           'max': vmax,
+           'avg': float(total) / count if count != 0 else None}
+
+    if is_lat:
+        # bucket N contains values in [2 ** (N - 1), 2 ** N) us
+        res['hist'] = dict((str(bucket), cnt) for bucket, cnt in hist.items())
+
+    return tmp_fname, res
+
+
+def main(argv):
+    interval = int(argv[1])
+    summary_file = argv[2]
+    raw_logs_dir = argv[3]
+    summary = {}
+
+    if raw_logs_dir != '-' and not os.path.isdir(raw_logs_dir):
+        os.makedirs(raw_logs_dir)
+
+    for fname in argv[4:]:
+        tmp_fname, summary[os.path.basename(fname)] = reduce_log(fname, interval)
+
+        if raw_logs_dir != '-':
+            shutil.move(fname, os.path.join(raw_logs_dir, os.path.basename(fname)))
+        os.rename(tmp_fname, fname)
+
+    with open(summary_file, "w") as fd:
+        fd.write(json.dumps(summary))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
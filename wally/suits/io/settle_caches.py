@@ -0,0 +1,71 @@
+"""
+Page cache reset between tests, executed on test and storage nodes by
+io test as 'python - ARGS' with this file as stdin. Doesn't depend on
+wally. Should be executed as root to drop caches.
+
+Syncs, waits till Dirty + Writeback from /proc/meminfo (the same
+values, which system-ram sensor reports) settle below MAX_DIRTY_KB,
+drops page cache if DROP is 1 and prints json with settle time and
+cache state before and after.
+
+usage: settle_caches.py DROP MAX_DIRTY_KB TIMEOUT_S
+"""
+import sys
+import json
+import time
+import subprocess
+
+
+FIELDS = ('Dirty', 'Writeback', 'Cached')
+POLL_INTERVAL = 0.1
+
+
+def meminfo():
+    "returns {field: KiB} for FIELDS"
+    res = {}
+    with open('/proc/meminfo') as fd:
+        for line in fd:
+            vals = line.split()
+            name = vals[0].rstrip(":")
+            if name in FIELDS:
+                res[name] = int(vals[1])
+    return res
+
+
+def main(argv):
+    drop = argv[1] == '1'
+    max_dirty = int(argv[2])
+    timeout = float(argv[3])
+
+    begin = time.time()
+    before = meminfo()
+
+    subprocess.call(["sync"])
+
+    settled = False
+    while True:
+        curr = meminfo()
+        if curr['Dirty'] + curr['Writeback'] <= max_dirty:
+            settled = True
+            break
+        if time.time() - begin > timeout:
+            break
+        time.sleep(POLL_INTERVAL)
+
+    if drop:
+        # only clean pages are dropped, so drop after writeback is done
+        with open('/proc/sys/vm/drop_caches', 'w') as fd:
+            fd.write("3\n")
+
+    after = meminfo()
+    res = {'settled': settled,
+           'settle_time': time.time() - begin,
+           'before': before,
+           'after': after}
+
+    sys.stdout.write(json.dumps(res))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
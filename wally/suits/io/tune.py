@@ -0,0 +1,358 @@
+import os
+import copy
+import math
+import logging
+
+import yaml
+import texttable
+
+from wally.pretty_yaml import dumps
+from wally.utils import StopTestError, fan_out
+from wally.suits.itest import run_on_node
+
+from .fio import IOPerfTest
+from .fio_task_parser import get_test_summary_tuple
+
+
+logger = logging.getLogger("wally")
+
+
+# scheduler change resets nr_requests, so it goes first
+TUNABLES_ORDER = ['scheduler', 'nr_requests', 'read_ahead_kb',
+                  'rq_affinity', 'max_sectors_kb']
+
+TUNING_FILE = "tuning.yaml"
+
+
+def read_tunables(rossh, devices, params):
+    "returns {dev: {param: value}}, params, not supported by device, are skipped"
+    cmd = "for dev in {0} ; do for param in {1} ; do " + \
+          "if [ -f /sys/block/$dev/queue/$param ] ; then " + \
+          "echo $dev $param $(cat /sys/block/$dev/queue/$param) ; fi ; done ; done"
+    out = rossh(cmd.format(" ".join(devices), " ".join(params)), nolog=True)
+
+    res = {}
+    for line in out.split("\n"):
+        items = line.split()
+        if len(items) < 3:
+            continue
+
+        dev, param, vals = items[0], items[1], items[2:]
+        if param == 'scheduler':
+            # noop deadline [cfq]
+            vals = [val[1:-1] for val in vals if val.startswith('[')]
+            if len(vals) == 0:
+                continue
+        res.setdefault(dev, {})[param] = vals[0]
+    return res
+
+
+def write_tunables(rossh, settings, use_sudo=True):
+    "settings:{dev: {param: value}}"
+    cmds = []
+    sudo = "sudo " if use_sudo else ""
+    for dev, params in sorted(settings.items()):
+        for param in sorted(params, key=get_tunable_order):
+            path = "/sys/block/{0}/queue/{1}".format(dev, param)
+            cmds.append("echo {0} | {1}tee {2} >/dev/null".format(params[param], sudo, path))
+
+    if len(cmds) != 0:
+        rossh(" && ".join(cmds), nolog=True)
+
+
+def get_tunable_order(param):
+    if param in TUNABLES_ORDER:
+        return (TUNABLES_ORDER.index(param), param)
+    return (len(TUNABLES_ORDER), param)
+
+
+def get_workload_class(sec):
+    "tunables are compared per operation, sync mode and block size"
+    tpl = get_test_summary_tuple(sec)
+    return "{0.oper}{0.mode}{0.bsize}".format(tpl)
+
+
+def geo_mean(vals):
+    return math.exp(sum(math.log(val) for val in vals) / len(vals))
+
+
+class TuneResults(object):
+    """
+    Tunables sweep results
+
+    suite_name:str - test config name
+    log_directory:str - folder with tuning.yaml and candidates results
+    tuning:{str:Any} - content of tuning.yaml
+    """
+    def __init__(self, suite_name, log_directory, tuning):
+        self.suite_name = suite_name
+        self.log_directory = log_directory
+        self.tuning = tuning
+
+    def get_yamable(self):
+        return {self.suite_name: [self.log_directory]}
+
+
+class IOTuneTest(IOPerfTest):
+    """
+    Block layer tunables sweep. Job set from config is executed with
+    original device settings and then for candidates, selected by
+    coordinate descent: each tunable values are tried, while already
+    checked tunables are fixed at the best found values. Candidate is
+    pruned, when any test gets less than prune_ratio of the best
+    bandwidth, measured for this test so far.
+
+    Tunables are set on test nodes for devices, which hold test files
+    (or tune_devices), and on not test nodes with tune_roles roles for
+    tune_storage_devices (names or shell globs). Original settings are
+    restored after sweep.
+    """
+    def __init__(self, *dt, **mp):
+        IOPerfTest.__init__(self, *dt, **mp)
+        get = self.config.params.get
+
+        self.tunables = get('tunables', {})
+        if len(self.tunables) == 0:
+            raise StopTestError("No tunables set for io_tune test")
+
+        self.tune_devices = get('tune_devices', None)
+        self.tune_roles = get('tune_roles', [])
+        self.tune_storage_devices = get('tune_storage_devices', [])
+        self.prune_ratio = get('prune_ratio', 0.8)
+
+        # candidate results are compared test by test
+        if self.pipeline or self.batch > 1:
+            logger.warning("pipeline and batch options are ignored by io_tune test")
+        self.pipeline = False
+        self.batch = 1
+
+        self.base_config = self.config
+        # node => {dev: {param: value}}
+        self.original = {}
+        # test position => best bandwidth
+        self.best_bw = {}
+
+    def get_tune_nodes(self):
+        "returns [(node, device names)] to apply tunables"
+        res = []
+        for node in self.config.nodes:
+            rossh = run_on_node(node)
+            if self.tune_devices is not None:
+                devices = self.tune_devices
+            else:
+                devices = []
+                for fname in self.get_node_test_files(node):
+                    devices.extend(dev for dev in self.get_test_devices(rossh, fname)
+                                   if dev not in devices)
+            res.append((node, devices))
+
+        for node in self.config.other_nodes:
+            if node.connection is None or \
+                    not any(role in node.roles for role in self.tune_roles):
+                continue
+
+            if len(self.tune_storage_devices) == 0:
+                msg = "tune_storage_devices should be set for tune_roles nodes"
+                raise StopTestError(msg)
+
+            cmd = "for dev in {0} ; do basename $dev ; done"
+            globs = " ".join("/sys/block/" + dev for dev in self.tune_storage_devices)
+            devices = [dev for dev in run_on_node(node)(cmd.format(globs), nolog=True).split()
+                       if '*' not in dev]
+            res.append((node, devices))
+
+        return res
+
+    def apply(self, candidate):
+        "set candidate tunables on all nodes, returns False on error"
+        def apply_th(node):
+            settings = {}
+            for dev, orig in self.original[node].items():
+                params = dict((param, val) for param, val in orig.items()
+                              if param not in candidate)
+                params.update((param, val) for param, val in candidate.items()
+                              if param in orig)
+                settings[dev] = params
+            write_tunables(run_on_node(node), settings, self.use_sudo)
+
+        nodes = list(self.original)
+        errors = fan_out(apply_th, nodes, return_exceptions=True)
+        failed = False
+        for node, err in zip(nodes, errors):
+            if isinstance(err, Exception):
+                logger.error("Failed to apply {0} on {1}: {2!s}".format(
+                             candidate, node.get_conn_id(), err))
+                failed = True
+
+        if failed:
+            # candidate is skipped, so nodes shouldn't keep it. Failed
+            # nodes are restored too - they may get part of settings
+            self.restore()
+
+        return not failed
+
+    def restore(self):
+        def restore_th(node):
+            write_tunables(run_on_node(node), self.original[node], self.use_sudo)
+
+        nodes = list(self.original)
+        errors = fan_out(restore_th, nodes, return_exceptions=True)
+        for node, err in zip(nodes, errors):
+            if isinstance(err, Exception):
+                logger.error("Failed to restore block settings on {0}: {1!s}".format(
+                             node.get_conn_id(), err))
+
+    def get_bw(self, result):
+        return sum(result.get_params_from_fio_report()['flt_bw'])
+
+    def evaluate(self, idx, candidate):
+        """
+        run job set with candidate tunables, returns candidate record
+        for tuning.yaml - {'tunables', 'bw', 'pruned', 'failed'}
+        """
+        record = {'tunables': candidate, 'bw': {}, 'pruned': False, 'failed': False}
+
+        if len(candidate) != 0 and not self.apply(candidate):
+            record['failed'] = True
+            return record
+
+        self.config = copy.copy(self.base_config)
+        self.config.log_directory = os.path.join(self.base_config.log_directory,
+                                                 "candidate_{0}".format(idx))
+        os.makedirs(self.config.log_directory)
+
+        def check_result(result):
+            bw = self.get_bw(result)
+            record['bw'][result.idx] = bw
+
+            best = self.best_bw.get(result.idx)
+            if best is not None and bw < best * self.prune_ratio:
+                logger.info("Candidate {0} is pruned: {1} has {2:.0%} of the best bw".format(
+                            candidate, result.summary(), float(bw) / best))
+                record['pruned'] = True
+                return False
+            return True
+
+        try:
+            self.run_tests(check_result)
+        finally:
+            self.config = self.base_config
+
+        if not record['pruned']:
+            for pos, bw in record['bw'].items():
+                self.best_bw[pos] = max(bw, self.best_bw.get(pos, 0))
+
+        return record
+
+    def get_gains(self, record, baseline):
+        """
+        returns {workload class: gain}, gain is geo mean of bw ratios
+        to baseline. Classes, not fully measured by pruned candidate,
+        are skipped
+        """
+        ratios = {}
+        incomplete = set()
+        for pos, base_bw in baseline['bw'].items():
+            wclass = get_workload_class(self.fio_configs[pos])
+            bw = record['bw'].get(pos)
+            if bw is None:
+                incomplete.add(wclass)
+            elif base_bw and bw:
+                ratios.setdefault(wclass, []).append(float(bw) / base_bw)
+
+        return dict((wclass, geo_mean(vals)) for wclass, vals in ratios.items()
+                    if wclass not in incomplete)
+
+    def sweep(self):
+        "returns tuning.yaml content"
+        baseline = self.evaluate(0, {})
+        candidates = []
+
+        current = {}
+        current_gain = 1.0
+
+        for param in sorted(self.tunables, key=get_tunable_order):
+            best_val = None
+            for val in self.tunables[param]:
+                candidate = dict(current)
+                candidate[param] = str(val)
+                record = self.evaluate(len(candidates) + 1, candidate)
+                candidates.append(record)
+
+                if record['failed']:
+                    continue
+
+                # pruned candidate still may be the best for some classes
+                gains = self.get_gains(record, baseline)
+                record['gains'] = gains
+                if record['pruned'] or len(gains) == 0:
+                    continue
+
+                gain = geo_mean(gains.values())
+                logger.info("Candidate {0}: gain {1:+.1%}".format(candidate, gain - 1))
+                if gain > current_gain:
+                    best_val = str(val)
+                    current_gain = gain
+
+            if best_val is not None:
+                current[param] = best_val
+
+        best = {}
+        for record in candidates:
+            for wclass, gain in record.get('gains', {}).items():
+                if wclass not in best or gain > best[wclass]['gain']:
+                    best[wclass] = {'tunables': record['tunables'], 'gain': gain}
+
+        return {'original': dict((node.get_conn_id(), settings)
+                                 for node, settings in self.original.items()),
+                'baseline': baseline,
+                'candidates': candidates,
+                'best': best,
+                'best_overall': {'tunables': current, 'gain': current_gain}}
+
+    def run(self):
+        logger.debug("Run preparation")
+        self.pre_run()
+
+        params = sorted(self.tunables, key=get_tunable_order)
+        for node, devices in self.get_tune_nodes():
+            settings = read_tunables(run_on_node(node), devices, params)
+            if len(settings) == 0:
+                msg = "No tunable block devices found on {0} from {1}"
+                raise StopTestError(msg.format(node.get_conn_id(), devices))
+            self.original[node] = settings
+            logger.debug("Block settings on {0}: {1}".format(node.get_conn_id(), settings))
+
+        try:
+            tuning = self.sweep()
+        finally:
+            self.restore()
+
+        with open(os.path.join(self.config.log_directory, TUNING_FILE), "w") as fd:
+            fd.write(dumps(tuning))
+
+        res = TuneResults(self.config.params['cfg'], self.config.log_directory, tuning)
+        logger.info("Block tunables sweep results:\n" + self.format_for_console([res]))
+        return res
+
+    @classmethod
+    def load(cls, suite_name, folder):
+        tuning = yaml.load(open(os.path.join(folder, TUNING_FILE)).read())
+        return TuneResults(suite_name, folder, tuning)
+
+    @classmethod
+    def format_for_console(cls, data):
+        tab = texttable.Texttable(max_width=120)
+        tab.set_deco(tab.HEADER | tab.VLINES | tab.BORDER)
+        tab.header(["Workload", "Best tunables", "Gain %"])
+
+        for res in data:
+            best = res.tuning['best'].items()
+            best.append(('all', res.tuning['best_overall']))
+            for wclass, info in sorted(best):
+                tunables = " ".join("{0}={1}".format(param, val)
+                                    for param, val in sorted(info['tunables'].items()))
+                tab.add_row([wclass, tunables or "original",
+                             int(round((info['gain'] - 1) * 100))])
+
+        return tab.draw()
@@ -8,7 +8,8 @@ from concurrent.futures import ThreadPoolExecutor
 
 from wally.utils import Barrier, StopTestError
 from wally.statistic import data_property
-from wally.ssh_utils import run_over_ssh, copy_paths
+from wally import artifacts
+from wally.ssh_utils import run_over_ssh
 
 
 logger = logging.getLogger("wally")
@@ -24,15 +25,18 @@ class TestConfig(object):
     log_directory:str - local directory to store results
     nodes:[Node] - node to run tests on
     remote_dir:str - directory on nodes to be used for local files
+    other_nodes:[Node] - not test nodes (storage, etc), which aren't
+                         used by concurrent tests
     """
     def __init__(self, test_type, params, test_uuid, nodes,
-                 log_directory, remote_dir):
+                 log_directory, remote_dir, other_nodes=None):
         self.test_type = test_type
         self.params = params
         self.test_uuid = test_uuid
         self.log_directory = log_directory
         self.nodes = nodes
         self.remote_dir = remote_dir
+        self.other_nodes = other_nodes if other_nodes is not None else []
 
 
 class TestResults(object):
@@ -269,17 +273,22 @@ class TwoScriptTest(ThreadedTest):
         self.prerun_tout = self.config.params.get('prerun_tout', 3600)
         self.run_tout = self.config.params.get('run_tout', 3600)
 
+        self.scripts_bundle = artifacts.Bundle("scripts")
+        for script in set([self.prerun_script, self.run_script]):
+            self.scripts_bundle.add_file(os.path.basename(script), script)
+
     def get_remote_for_script(self, script):
         return os.path.join(self.remote_dir,
                             os.path.basename(script))
 
-    def pre_run(self, node):
-        copy_paths(node.connection,
-                   {
-                       self.run_script: self.get_remote_for_script(self.run_script),
-                       self.prerun_script: self.get_remote_for_script(self.prerun_script),
-                   })
+    def run(self):
+        # scripts are deployed to all nodes at once to use peer fan-out
+        targets = [(node.connection, node.get_ip(), node.get_conn_id())
+                   for node in self.config.nodes]
+        artifacts.deploy_many(targets, self.scripts_bundle, self.remote_dir)
+        return ThreadedTest.run(self)
 
+    def pre_run(self, node):
         cmd = self.get_remote_for_script(self.prerun_script)
         cmd += ' ' + self.config.params.get('prerun_opts', '')
         run_on_node(node)(cmd, timeout=self.prerun_tout)
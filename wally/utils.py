@@ -1,6 +1,7 @@
 import re
 import os
 import sys
+import time
 import socket
 import logging
 import threading
@@ -112,11 +113,98 @@ class Barrier(object):
                 return True
             else:
                 self.cond.wait(timeout=timeout)
+                if self.exited:
+                    raise TaksFinished()
                 return False
 
     def exit(self):
         with self.cond:
             self.exited = True
+            self.cond.notify_all()
+
+
+FAN_OUT_LIMIT = 32
+
+
+class FanOutTimeout(RuntimeError):
+    pass
+
+
+def fan_out(func, items, max_parallel=FAN_OUT_LIMIT, timeout=None,
+            return_exceptions=False):
+    """
+    call func(item) for all items, not more than max_parallel calls
+    simultaneously. Call, which didn't finished in timeout seconds, is
+    abandoned with FanOutTimeout and its slot is given to next item.
+    Returns list of results in items order. If return_exceptions is
+    False - first error is raised after all calls finished, otherwise
+    errors are returned in place of results
+    """
+    items = list(items)
+    results = [None] * len(items)
+    errors = [None] * len(items)
+    done = [False] * len(items)
+    started = {}
+    state = {'next': 0, 'left': len(items)}
+    cond = threading.Condition()
+
+    def worker():
+        while True:
+            with cond:
+                if state['next'] >= len(items):
+                    return
+                idx = state['next']
+                state['next'] += 1
+                started[idx] = time.time()
+
+            res = err = None
+            try:
+                res = func(items[idx])
+            except Exception as exc:
+                err = exc
+
+            with cond:
+                if done[idx]:
+                    # timed out, other thread already took our slot
+                    return
+                started.pop(idx, None)
+                results[idx] = res
+                errors[idx] = err
+                done[idx] = True
+                state['left'] -= 1
+                cond.notify_all()
+
+    def start_worker():
+        th = threading.Thread(target=worker, name="fan_out")
+        th.daemon = True
+        th.start()
+
+    for _ in range(min(max_parallel, len(items))):
+        start_worker()
+
+    with cond:
+        while state['left'] != 0:
+            cond.wait(1)
+
+            if timeout is not None:
+                now = time.time()
+                for idx, stime in started.items():
+                    if now - stime > timeout:
+                        del started[idx]
+                        msg = "Call for {0!s} timeouted after {1}s"
+                        errors[idx] = FanOutTimeout(msg.format(items[idx], timeout))
+                        done[idx] = True
+                        state['left'] -= 1
+                        start_worker()
+
+    if return_exceptions:
+        return [res if err is None else err for res, err in zip(results, errors)]
+
+    for err in errors:
+        if err is not None:
+            raise err
+
+    return results
 
 
 SMAP = dict(k=1024, m=1024 ** 2, g=1024 ** 3, t=1024 ** 4)
@@ -323,8 +411,42 @@ def get_creds_openrc(path):
 os_release = collections.namedtuple("Distro", ["distro", "release", "arch"])
 
 
+def parse_os_release(data, arch):
+    """
+    returns os_release for /etc/os-release content or
+    None, if distro is unknown
+    """
+    params = {}
+    for line in data.split("\n"):
+        if '=' in line:
+            name, val = line.split("=", 1)
+            params[name.strip()] = val.strip().strip('"\'')
+
+    ids = [params.get('ID', '')] + params.get('ID_LIKE', '').split()
+    if any(os_id in ('rhel', 'centos', 'fedora') for os_id in ids):
+        return os_release('redhat', None, arch)
+
+    if any(os_id in ('ubuntu', 'debian') for os_id in ids):
+        release = params.get('VERSION_CODENAME') or params.get('UBUNTU_CODENAME')
+        if not release and ',' in params.get('VERSION', ''):
+            # VERSION="14.04.5 LTS, Trusty Tahr"
+            release = params['VERSION'].split(",", 1)[1].split()[0].lower()
+        return os_release('ubuntu', release or None, arch)
+
+    return None
+
+
+OS_INFO_CMD = "arch ; cat /etc/os-release 2>/dev/null ; true"
+
+
 def get_os(run_func):
-    arch = run_func("arch", nolog=True).strip()
+    out = run_func(OS_INFO_CMD, nolog=True)
+    arch, _, os_release_data = out.partition("\n")
+    arch = arch.strip()
+
+    res = parse_os_release(os_release_data, arch)
+    if res is not None:
+        return res
 
     try:
         run_func("ls -l /etc/redhat-release", nolog=True)